@@ -0,0 +1,140 @@
+from dataclasses import dataclass
+
+import frappe
+from frappe import _
+from frappe.query_builder.functions import Count, Sum
+from frappe.utils import cint, flt
+from pypika import CustomFunction
+
+DateFormat = CustomFunction("DATE_FORMAT", ["date", "format"])
+
+# Columns payments can be grouped by
+PAYMENT_GROUP_BY = ("status", "payment_type", "currency", "month")
+
+# Seconds a status histogram is served from cache
+STATUS_COUNT_TTL = 60
+
+# Filter operators accepted as [operator, value] pairs
+FILTER_OPERATORS = {
+	"=": lambda column, value: column == value,
+	"!=": lambda column, value: column != value,
+	">": lambda column, value: column > value,
+	"<": lambda column, value: column < value,
+	">=": lambda column, value: column >= value,
+	"<=": lambda column, value: column <= value,
+	"in": lambda column, value: column.isin(value),
+	"not in": lambda column, value: column.notin(value),
+	"like": lambda column, value: column.like(value),
+	"between": lambda column, value: column.between(value[0], value[1])
+}
+
+def apply_filters(query, table, filters):
+	"""Add `filters` to a query builder query as WHERE conditions"""
+	for field, value in (filters or {}).items():
+		if isinstance(value, (list, tuple)):
+			operator, value = value
+			query = query.where(FILTER_OPERATORS[operator](table[field], value))
+		else:
+			query = query.where(table[field] == value)
+	
+	return query
+
+@dataclass(frozen=True)
+class PaymentAggregate:
+	"""One group of payments with its summed amount and row count"""
+	total_amount: float
+	payment_count: int
+	status: str | None = None
+	payment_type: str | None = None
+	currency: str | None = None
+	month: str | None = None
+
+@dataclass(frozen=True)
+class PaymentTotals:
+	"""Completed payments and refunds of a set of payments"""
+	total_paid: float
+	total_refunded: float
+	net_amount: float
+	
+	def as_dict(self):
+		return {
+			"total_paid": self.total_paid,
+			"total_refunded": self.total_refunded,
+			"net_amount": self.net_amount
+		}
+
+def aggregate_payments(filters=None, group_by=()):
+	"""SUM and COUNT BMS Payment rows in the database, grouped by any of `PAYMENT_GROUP_BY`
+	
+	`filters` maps a field to a value or an [operator, value] pair, e.g.
+	{"customer": "CUST-1", "status": ["in", ["Completed", "Refunded"]]}.
+	"""
+	Payment = frappe.qb.DocType("BMS Payment")
+	group_columns = {
+		"status": Payment.status,
+		"payment_type": Payment.payment_type,
+		"currency": Payment.currency,
+		"month": DateFormat(Payment.payment_date, "%Y-%m")
+	}
+	
+	query = frappe.qb.from_(Payment).select(
+		Sum(Payment.amount).as_("total_amount"),
+		Count(Payment.name).as_("payment_count")
+	)
+	
+	for field in group_by:
+		if field not in PAYMENT_GROUP_BY:
+			frappe.throw(_("Cannot group payments by {0}").format(field))
+		query = query.select(group_columns[field].as_(field)).groupby(group_columns[field])
+	
+	query = apply_filters(query, Payment, filters)
+	
+	return [
+		PaymentAggregate(
+			total_amount=flt(row.total_amount),
+			payment_count=cint(row.payment_count),
+			**{field: row.get(field) for field in group_by}
+		)
+		for row in query.run(as_dict=True)
+	]
+
+def get_total_amount(filters=None):
+	"""Return the summed amount of the payments matching `filters`"""
+	return aggregate_payments(filters)[0].total_amount
+
+def get_payment_totals(filters=None):
+	"""Return the completed payments and refunds matching `filters` in a single grouped query"""
+	totals = {"Payment": 0.0, "Refund": 0.0}
+	
+	for group in aggregate_payments({**(filters or {}), "status": "Completed"}, group_by=("payment_type",)):
+		if group.payment_type in totals:
+			totals[group.payment_type] = group.total_amount
+	
+	return PaymentTotals(
+		total_paid=totals["Payment"],
+		total_refunded=totals["Refund"],
+		net_amount=totals["Payment"] - totals["Refund"]
+	)
+
+def count_by_status(doctype, filters=None, use_cache=True):
+	"""Return {status: count} for a BMS doctype from a single GROUP BY status query
+
+	Results are cached for `STATUS_COUNT_TTL` seconds.
+	"""
+	if not doctype.startswith("BMS ") or not frappe.get_meta(doctype).has_field("status"):
+		frappe.throw(_("Status counts are not available for {0}").format(doctype))
+	
+	cache_key = f"bms:status_counts:{doctype}:{frappe.as_json(filters or {}, indent=None)}"
+	if use_cache:
+		counts = frappe.cache.get_value(cache_key)
+		if counts is not None:
+			return counts
+	
+	Table = frappe.qb.DocType(doctype)
+	query = frappe.qb.from_(Table).select(Table.status, Count(Table.name).as_("count")).groupby(Table.status)
+	query = apply_filters(query, Table, filters)
+	
+	counts = {row.status: cint(row.count) for row in query.run(as_dict=True)}
+	frappe.cache.set_value(cache_key, counts, expires_in_sec=STATUS_COUNT_TTL)
+	
+	return counts
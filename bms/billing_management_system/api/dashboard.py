@@ -1,8 +1,27 @@
 import frappe
 from frappe import _
-from frappe.utils import today, add_days, get_datetime
+from frappe.utils import today, add_days, get_datetime, getdate
 from datetime import datetime, timedelta
 
+from bms.billing_management_system.aggregates import count_by_status
+from bms.billing_management_system import permissions
+from bms.billing_management_system.customer_dashboard import get_customer_dashboard
+from bms.billing_management_system.dashboard_cache import get_dashboard_sections, get_dashboard_timings
+from bms.billing_management_system.doctype.bms_activity_log.bms_activity_log import get_activity_page
+from bms.billing_management_system.metrics import get_metric_rows, get_status_counts
+from bms.billing_management_system.pagination import get_page
+
+# Entries of the activity log shown as recent activities
+DASHBOARD_ACTIVITY_LIMIT = 10
+
+# Rows of the renewal and overdue feeds sent with the dashboard; the rest are paged in on demand
+DASHBOARD_FEED_PREVIEW = 5
+
+UPCOMING_RENEWAL_DAYS = 7
+
+UPCOMING_RENEWAL_FIELDS = ["customer", "customer_name", "plan", "amount", "currency", "next_billing_date"]
+OVERDUE_INVOICE_FIELDS = ["customer", "customer_name", "amount", "currency", "due_date"]
+
 @frappe.whitelist()
 def get_dashboard_data():
 	"""Get dashboard data for BMS"""
@@ -10,9 +29,9 @@ def get_dashboard_data():
 		user = frappe.session.user
 		
 		# Check if user is admin or regular user
-		if "BMS Admin" in frappe.get_roles(user):
+		if "BMS Admin" in permissions.get_user_roles(user):
 			return get_admin_dashboard_data()
-		elif "BMS User" in frappe.get_roles(user):
+		elif "BMS User" in permissions.get_user_roles(user):
 			return get_user_dashboard_data()
 		else:
 			return {
@@ -30,34 +49,10 @@ def get_dashboard_data():
 def get_admin_dashboard_data():
 	"""Get admin dashboard data"""
 	try:
-		# Get subscription statistics
-		subscription_stats = get_subscription_statistics()
-		
-		# Get revenue statistics
-		revenue_stats = get_revenue_statistics()
-		
-		# Get payment statistics
-		payment_stats = get_payment_statistics()
-		
-		# Get recent activities
-		recent_activities = get_recent_activities()
-		
-		# Get upcoming renewals
-		upcoming_renewals = get_upcoming_renewals()
-		
-		# Get overdue invoices
-		overdue_invoices = get_overdue_invoices()
-		
+		# Each section is served from its own stale-while-revalidate cache entry
 		return {
 			"status": "success",
-			"data": {
-				"subscriptions": subscription_stats,
-				"revenue": revenue_stats,
-				"payments": payment_stats,
-				"recent_activities": recent_activities,
-				"upcoming_renewals": upcoming_renewals,
-				"overdue_invoices": overdue_invoices
-			}
+			"data": get_dashboard_sections()
 		}
 		
 	except Exception as e:
@@ -67,6 +62,16 @@ def get_admin_dashboard_data():
 			"message": str(e)
 		}
 
+@frappe.whitelist()
+def get_dashboard_section_timings():
+	"""Get the compute time, age and freshness of each cached admin dashboard section"""
+	frappe.only_for("BMS Admin")
+	
+	return {
+		"status": "success",
+		"data": get_dashboard_timings()
+	}
+
 def get_user_dashboard_data():
 	"""Get user dashboard data"""
 	try:
@@ -78,25 +83,19 @@ def get_user_dashboard_data():
 				"message": _("Customer not found for this user")
 			}
 		
-		# Get user's subscriptions
-		user_subscriptions = get_user_subscriptions(customer)
-		
-		# Get user's payments
-		user_payments = get_user_payments(customer)
-		
-		# Get user's invoices
-		user_invoices = get_user_invoices(customer)
-		
-		# Get payment summary
-		payment_summary = get_user_payment_summary(customer)
+		dashboard = get_customer_dashboard(customer)
 		
 		return {
 			"status": "success",
 			"data": {
-				"subscriptions": user_subscriptions,
-				"payments": user_payments,
-				"invoices": user_invoices,
-				"payment_summary": payment_summary
+				"subscriptions": dashboard.subscriptions,
+				"payments": dashboard.payments,
+				"invoices": dashboard.invoices,
+				"payment_summary": {
+					"total_paid": dashboard.total_paid,
+					"total_refunded": dashboard.total_refunded,
+					"net_amount": dashboard.net_amount
+				}
 			}
 		}
 		
@@ -108,56 +107,33 @@ def get_user_dashboard_data():
 		}
 
 def get_subscription_statistics():
-	"""Get subscription statistics"""
-	total = frappe.db.count("BMS Subscription")
-	active = frappe.db.count("BMS Subscription", {"status": "Active"})
-	trial = frappe.db.count("BMS Subscription", {"status": "Trial"})
-	cancelled = frappe.db.count("BMS Subscription", {"status": "Cancelled"})
-	expired = frappe.db.count("BMS Subscription", {"status": "Expired"})
-	suspended = frappe.db.count("BMS Subscription", {"status": "Suspended"})
+	"""Get subscription statistics from the precomputed BMS Metrics rows"""
+	counts = get_status_counts("BMS Subscription")
 	
 	return {
-		"total": total,
-		"active": active,
-		"trial": trial,
-		"cancelled": cancelled,
-		"expired": expired,
-		"suspended": suspended
+		"total": sum(counts.values()),
+		"active": counts.get("Active", 0),
+		"trial": counts.get("Trial", 0),
+		"cancelled": counts.get("Cancelled", 0),
+		"expired": counts.get("Expired", 0),
+		"suspended": counts.get("Suspended", 0)
 	}
 
 def get_revenue_statistics():
-	"""Get revenue statistics"""
-	# Total revenue
-	total_payments = frappe.get_all("BMS Payment",
-		filters={
-			"payment_type": "Payment",
-			"status": "Completed"
-		},
-		fields=["amount"]
-	)
-	total_revenue = sum(payment.amount for payment in total_payments)
+	"""Get revenue statistics from the precomputed BMS Metrics rows"""
+	current_month = getdate(today()).strftime("%Y-%m")
 	
-	# Monthly revenue
-	current_month = today().strftime("%Y-%m")
-	monthly_payments = frappe.get_all("BMS Payment",
-		filters={
-			"payment_type": "Payment",
-			"status": "Completed",
-			"payment_date": ["like", f"{current_month}%"]
-		},
-		fields=["amount"]
-	)
-	monthly_revenue = sum(payment.amount for payment in monthly_payments)
+	total_revenue = 0
+	monthly_revenue = 0
+	total_refunded = 0
 	
-	# Refunds
-	total_refunds = frappe.get_all("BMS Payment",
-		filters={
-			"payment_type": "Refund",
-			"status": "Completed"
-		},
-		fields=["amount"]
-	)
-	total_refunded = sum(refund.amount for refund in total_refunds)
+	for row in get_metric_rows("BMS Payment", status="Completed"):
+		if row.payment_type == "Payment":
+			total_revenue += row.total_amount
+			if row.period == current_month:
+				monthly_revenue += row.total_amount
+		elif row.payment_type == "Refund":
+			total_refunded += row.total_amount
 	
 	return {
 		"total": total_revenue,
@@ -168,154 +144,115 @@ def get_revenue_statistics():
 
 def get_payment_statistics():
 	"""Get payment statistics"""
-	total = frappe.db.count("BMS Payment")
-	completed = frappe.db.count("BMS Payment", {"status": "Completed"})
-	pending = frappe.db.count("BMS Payment", {"status": "Pending"})
-	failed = frappe.db.count("BMS Payment", {"status": "Failed"})
-	refunded = frappe.db.count("BMS Payment", {"status": "Refunded"})
+	counts = count_by_status("BMS Payment")
 	
 	return {
-		"total": total,
-		"completed": completed,
-		"pending": pending,
-		"failed": failed,
-		"refunded": refunded
+		"total": sum(counts.values()),
+		"completed": counts.get("Completed", 0),
+		"pending": counts.get("Pending", 0),
+		"failed": counts.get("Failed", 0),
+		"refunded": counts.get("Refunded", 0)
 	}
 
 def get_recent_activities():
-	"""Get recent activities"""
+	"""Get the latest activities from the activity log"""
 	activities = []
 	
-	# Recent subscriptions
-	recent_subscriptions = frappe.get_all("BMS Subscription",
-		filters={},
-		fields=["name", "customer", "plan", "status", "creation"],
-		order_by="creation desc",
-		limit=5
-	)
-	
-	for sub in recent_subscriptions:
+	for activity in get_activity_page(page_size=DASHBOARD_ACTIVITY_LIMIT).data:
 		activities.append({
-			"type": "subscription",
-			"action": "created",
-			"description": f"Subscription {sub.name} created for {sub.customer}",
-			"date": sub.creation,
-			"status": sub.status
+			"type": activity.activity_type.lower(),
+			"action": activity.action,
+			"description": activity.description,
+			"date": activity.timestamp,
+			"status": activity.status or ""
 		})
 	
-	# Recent payments
-	recent_payments = frappe.get_all("BMS Payment",
-		filters={},
-		fields=["name", "customer", "amount", "payment_type", "status", "creation"],
-		order_by="creation desc",
-		limit=5
-	)
+	return activities
+
+@frappe.whitelist()
+def get_activity_feed(customer=None, activity_type=None, cursor=None, page_size=None):
+	"""Get one page of the activity log, newest first, optionally for one customer or activity type"""
+	frappe.only_for("BMS Admin")
 	
-	for payment in recent_payments:
-		activities.append({
-			"type": "payment",
-			"action": "processed",
-			"description": f"Payment {payment.name} of {payment.amount} processed",
-			"date": payment.creation,
-			"status": payment.status
-		})
+	filters = {}
+	if customer:
+		filters["customer"] = customer
+	if activity_type:
+		filters["activity_type"] = activity_type
 	
-	# Sort by date
-	activities.sort(key=lambda x: x["date"], reverse=True)
+	page = get_activity_page(filters, cursor, page_size)
 	
-	return activities[:10]
+	return {
+		"status": "success",
+		"data": page.data,
+		"next_cursor": page.next_cursor
+	}
 
 def get_upcoming_renewals():
-	"""Get upcoming renewals"""
-	upcoming_date = add_days(today(), 7)  # Next 7 days
-	
-	upcoming_renewals = frappe.get_all("BMS Subscription",
-		filters={
-			"status": "Active",
-			"auto_renewal": 1,
-			"next_billing_date": ["<=", upcoming_date]
-		},
-		fields=["name", "customer", "plan", "amount", "currency", "next_billing_date"],
-		order_by="next_billing_date asc"
-	)
-	
-	return upcoming_renewals
+	"""Get the upcoming renewals header and first page for the dashboard"""
+	return get_feed_summary("BMS Subscription", get_upcoming_renewal_filters(),
+		UPCOMING_RENEWAL_FIELDS, "next_billing_date")
 
 def get_overdue_invoices():
-	"""Get overdue invoices"""
-	overdue_invoices = frappe.get_all("BMS Invoice",
-		filters={
-			"status": "Overdue"
-		},
-		fields=["name", "customer", "amount", "currency", "due_date"],
-		order_by="due_date asc"
-	)
-	
-	return overdue_invoices
+	"""Get the overdue invoices header and first page for the dashboard"""
+	return get_feed_summary("BMS Invoice", {"status": "Overdue"}, OVERDUE_INVOICE_FIELDS, "due_date")
 
-def get_user_subscriptions(customer):
-	"""Get user's subscriptions"""
-	subscriptions = frappe.get_all("BMS Subscription",
-		filters={"customer": customer},
-		fields=["name", "plan", "status", "start_date", "end_date", "amount", "currency", "billing_cycle"],
-		order_by="creation desc"
-	)
+@frappe.whitelist()
+def get_upcoming_renewals_page(cursor=None, page_size=None):
+	"""Get one page of upcoming renewals, soonest first"""
+	frappe.only_for("BMS Admin")
 	
-	return subscriptions
-
-def get_user_payments(customer):
-	"""Get user's payments"""
-	payments = frappe.get_all("BMS Payment",
-		filters={"customer": customer},
-		fields=["name", "subscription", "amount", "currency", "payment_type", "status", "payment_date"],
-		order_by="payment_date desc",
-		limit=10
-	)
+	page = get_page("BMS Subscription", get_upcoming_renewal_filters(), UPCOMING_RENEWAL_FIELDS,
+		cursor, page_size, sort_field="next_billing_date", ascending=True)
 	
-	return payments
+	return {
+		"status": "success",
+		"data": page.data,
+		"next_cursor": page.next_cursor
+	}
 
-def get_user_invoices(customer):
-	"""Get user's invoices"""
-	invoices = frappe.get_all("BMS Invoice",
-		filters={"customer": customer},
-		fields=["name", "subscription", "amount", "currency", "status", "invoice_date", "due_date"],
-		order_by="invoice_date desc",
-		limit=10
-	)
+@frappe.whitelist()
+def get_overdue_invoices_page(cursor=None, page_size=None):
+	"""Get one page of overdue invoices, longest overdue first"""
+	frappe.only_for("BMS Admin")
+	
+	page = get_page("BMS Invoice", {"status": "Overdue"}, OVERDUE_INVOICE_FIELDS,
+		cursor, page_size, sort_field="due_date", ascending=True)
 	
-	return invoices
+	return {
+		"status": "success",
+		"data": page.data,
+		"next_cursor": page.next_cursor
+	}
 
-def get_user_payment_summary(customer):
-	"""Get user's payment summary"""
-	# Total payments
-	total_payments = frappe.get_all("BMS Payment",
-		filters={
-			"customer": customer,
-			"payment_type": "Payment",
-			"status": "Completed"
-		},
-		fields=["amount"]
-	)
-	total_paid = sum(payment.amount for payment in total_payments)
+def get_upcoming_renewal_filters():
+	return {
+		"status": "Active",
+		"auto_renewal": 1,
+		"next_billing_date": ["<=", add_days(today(), UPCOMING_RENEWAL_DAYS)]
+	}
+
+def get_feed_summary(doctype, filters, fields, sort_field):
+	"""Return a feed's count and per-currency totals from one grouped query, with its first rows
 	
-	# Total refunds
-	total_refunds = frappe.get_all("BMS Payment",
-		filters={
-			"customer": customer,
-			"payment_type": "Refund",
-			"status": "Completed"
-		},
-		fields=["amount"]
+	The rest of the feed is fetched page by page from `next_cursor`.
+	"""
+	totals = frappe.get_all(doctype,
+		filters=filters,
+		fields=["currency", "count(name) as count", "sum(amount) as amount"],
+		group_by="currency",
+		order_by="currency asc"
 	)
-	total_refunded = sum(refund.amount for refund in total_refunds)
+	page = get_page(doctype, filters, fields, page_size=DASHBOARD_FEED_PREVIEW,
+		sort_field=sort_field, ascending=True)
 	
 	return {
-		"total_paid": total_paid,
-		"total_refunded": total_refunded,
-		"net_amount": total_paid - total_refunded
+		"count": sum(row.count for row in totals),
+		"totals": totals,
+		"rows": page.data,
+		"next_cursor": page.next_cursor
 	}
 
 def get_customer_for_user(user):
 	"""Get customer linked to user"""
-	customer = frappe.db.get_value("BMS Customer", {"email": user}, "name")
-	return customer
+	return permissions.get_customer_for_user(user)
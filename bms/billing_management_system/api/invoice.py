@@ -3,6 +3,11 @@ from frappe import _
 from frappe.utils import today
 import json
 
+from bms.billing_management_system.pagination import get_page
+
+# Fields returned by get_customer_invoices when the client does not choose its own
+CUSTOMER_INVOICE_FIELDS = ["name", "subscription", "amount", "currency", "status", "invoice_date", "due_date"]
+
 @frappe.whitelist()
 def create_invoice(customer, subscription, amount, currency):
 	"""Create an invoice"""
@@ -71,19 +76,15 @@ def get_invoice_details(invoice):
 		}
 
 @frappe.whitelist()
-def get_customer_invoices(customer):
-	"""Get all invoices for a customer"""
+def get_customer_invoices(customer, cursor=None, page_size=None, fields=None):
+	"""Get one page of a customer's invoices, newest first"""
 	try:
-		invoices = frappe.get_all("BMS Invoice",
-			filters={"customer": customer},
-			fields=["name", "subscription", "amount", "currency", 
-					"status", "invoice_date", "due_date"],
-			order_by="invoice_date desc"
-		)
+		page = get_page("BMS Invoice", {"customer": customer}, fields or CUSTOMER_INVOICE_FIELDS, cursor, page_size)
 		
 		return {
 			"status": "success",
-			"data": invoices
+			"data": page.data,
+			"next_cursor": page.next_cursor
 		}
 		
 	except Exception as e:
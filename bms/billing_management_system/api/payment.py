@@ -3,6 +3,15 @@ from frappe import _
 from frappe.utils import today
 import json
 
+from bms.billing_management_system.aggregates import get_payment_totals
+from bms.billing_management_system.pagination import get_page
+
+# Fields returned by get_payment_history when the client does not choose its own
+PAYMENT_HISTORY_FIELDS = [
+	"name", "subscription", "plan", "amount", "currency",
+	"payment_type", "payment_date", "status", "payment_method"
+]
+
 @frappe.whitelist()
 def process_payment(customer, subscription, amount, payment_method, reference=None):
 	"""Process a payment"""
@@ -70,19 +79,15 @@ def process_refund(payment, reason=None):
 		}
 
 @frappe.whitelist()
-def get_payment_history(customer):
-	"""Get payment history for a customer"""
+def get_payment_history(customer, cursor=None, page_size=None, fields=None):
+	"""Get one page of a customer's payment history, newest first"""
 	try:
-		payments = frappe.get_all("BMS Payment",
-			filters={"customer": customer},
-			fields=["name", "subscription", "plan", "amount", "currency", 
-					"payment_type", "payment_date", "status", "payment_method"],
-			order_by="payment_date desc"
-		)
+		page = get_page("BMS Payment", {"customer": customer}, fields or PAYMENT_HISTORY_FIELDS, cursor, page_size)
 		
 		return {
 			"status": "success",
-			"data": payments
+			"data": page.data,
+			"next_cursor": page.next_cursor
 		}
 		
 	except Exception as e:
@@ -96,36 +101,11 @@ def get_payment_history(customer):
 def get_payment_summary(customer):
 	"""Get payment summary for a customer"""
 	try:
-		# Get total payments
-		total_payments = frappe.get_all("BMS Payment",
-			filters={
-				"customer": customer,
-				"payment_type": "Payment",
-				"status": "Completed"
-			},
-			fields=["amount"]
-		)
-		
-		# Get total refunds
-		total_refunds = frappe.get_all("BMS Payment",
-			filters={
-				"customer": customer,
-				"payment_type": "Refund",
-				"status": "Completed"
-			},
-			fields=["amount"]
-		)
-		
-		total_paid = sum(payment.amount for payment in total_payments)
-		total_refunded = sum(refund.amount for refund in total_refunds)
+		totals = get_payment_totals({"customer": customer})
 		
 		return {
 			"status": "success",
-			"data": {
-				"total_paid": total_paid,
-				"total_refunded": total_refunded,
-				"net_amount": total_paid - total_refunded
-			}
+			"data": totals.as_dict()
 		}
 		
 	except Exception as e:
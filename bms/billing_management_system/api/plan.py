@@ -1,6 +1,8 @@
 import frappe
 from frappe import _
 
+from bms.billing_management_system.visibility import is_plan_visible
+
 @frappe.whitelist()
 def get_available_plans_for_customer(customer):
 	"""Get plans available for a specific customer"""
@@ -21,10 +23,10 @@ def get_available_plans_for_customer(customer):
 		available_plans = []
 		
 		for plan in all_plans:
-			plan_doc = frappe.get_doc("BMS Plan", plan.name)
-			
 			# Check if plan is available for this customer
-			if plan_doc.is_available_for_customer(customer):
+			if is_plan_visible(plan.name, customer):
+				plan_doc = frappe.get_doc("BMS Plan", plan.name)
+				
 				# Get plan features
 				features = []
 				if plan_doc.features:
@@ -129,8 +131,7 @@ def check_plan_availability(plan, customer):
 		if not frappe.db.exists("BMS Customer", customer):
 			frappe.throw(_("Customer not found"))
 		
-		plan_doc = frappe.get_doc("BMS Plan", plan)
-		is_available = plan_doc.is_available_for_customer(customer)
+		is_available = is_plan_visible(plan, customer)
 		
 		return {
 			"status": "success",
@@ -1,8 +1,26 @@
 import frappe
 from frappe import _
-from frappe.utils import today, add_days, get_datetime
+from frappe.utils import today, add_days, cint, get_datetime, getdate
+from frappe.utils.csvutils import read_csv_content
 import json
 
+from bms.billing_management_system.pagination import get_page
+from bms.billing_management_system.snapshots import get_customer_snapshot, get_plan_snapshot
+from bms.billing_management_system.visibility import is_plan_visible
+
+# Subscriptions inserted per transaction by create_subscriptions_in_bulk
+BULK_SUBSCRIPTION_CHUNK_SIZE = 500
+
+# Larger imports are queued on the long queue instead of running in the request
+BULK_SUBSCRIPTION_SYNC_LIMIT = 500
+BULK_SUBSCRIPTION_JOB_TIMEOUT = 3600
+
+# Seconds the results of a queued import are kept for get_bulk_subscription_import
+BULK_SUBSCRIPTION_RESULT_TTL = 86400
+
+# Fields returned by get_customer_subscriptions when the client does not choose its own
+CUSTOMER_SUBSCRIPTION_FIELDS = ["name", "plan", "status", "start_date", "end_date", "amount", "currency"]
+
 @frappe.whitelist()
 def create_subscription(customer, plan, start_date=None):
 	"""Create a new subscription"""
@@ -38,6 +56,160 @@ def create_subscription(customer, plan, start_date=None):
 			"message": str(e)
 		}
 
+@frappe.whitelist()
+def create_subscriptions_in_bulk(rows=None, csv_content=None, chunk_size=BULK_SUBSCRIPTION_CHUNK_SIZE):
+	"""Create many subscriptions, with their initial invoices, from (customer, plan, start_date) rows
+	
+	`rows` is a JSON list of objects or [customer, plan, start_date] lists;
+	`csv_content` is CSV text with the same columns and an optional header row.
+	Each row is inserted under its own savepoint and every `chunk_size` rows
+	are committed together, so a bad row only fails itself. Returns one result
+	per input row, in order. Imports of more than `BULK_SUBSCRIPTION_SYNC_LIMIT`
+	rows run in a background job instead; fetch their results with
+	`get_bulk_subscription_import`.
+	"""
+	try:
+		frappe.has_permission("BMS Subscription", "create", throw=True)
+		
+		chunk_size = cint(chunk_size) if chunk_size not in (None, "") else BULK_SUBSCRIPTION_CHUNK_SIZE
+		if chunk_size < 1:
+			frappe.throw(_("Chunk size must be at least 1"))
+		
+		entries = parse_bulk_subscription_rows(rows, csv_content)
+		
+		if len(entries) > BULK_SUBSCRIPTION_SYNC_LIMIT:
+			job_id = f"bms_bulk_subscription::{frappe.generate_hash(length=10)}"
+			frappe.enqueue(
+				"bms.billing_management_system.api.subscription.run_bulk_subscription_import",
+				queue="long",
+				timeout=BULK_SUBSCRIPTION_JOB_TIMEOUT,
+				job_id=job_id,
+				entries=entries,
+				chunk_size=chunk_size,
+				job_key=job_id
+			)
+			
+			return {
+				"status": "queued",
+				"job_id": job_id,
+				"rows": len(entries)
+			}
+		
+		return run_bulk_subscription_import(entries, chunk_size)
+		
+	except Exception as e:
+		frappe.log_error(frappe.get_traceback(), "BMS Bulk Subscription Creation Error")
+		return {
+			"status": "error",
+			"message": str(e)
+		}
+
+@frappe.whitelist()
+def get_bulk_subscription_import(job_id):
+	"""Get the results of a background bulk subscription import, or its queued status"""
+	frappe.has_permission("BMS Subscription", "create", throw=True)
+	
+	return frappe.cache.get_value(get_bulk_import_key(job_id), expires=True) or {
+		"status": "queued",
+		"job_id": job_id
+	}
+
+def run_bulk_subscription_import(entries, chunk_size=BULK_SUBSCRIPTION_CHUNK_SIZE, job_key=None):
+	"""Insert the parsed rows chunk by chunk and return the per-row results
+	
+	Messages raised while inserting (invoice msgprints, row validation errors)
+	are muted and dropped after each row, so the response only carries the
+	structured results.
+	"""
+	results = []
+	mute_messages = frappe.flags.mute_messages
+	frappe.flags.mute_messages = True
+	
+	try:
+		for start in range(0, len(entries), chunk_size):
+			for index, entry in enumerate(entries[start:start + chunk_size], start=start):
+				results.append(create_bulk_subscription(index, entry))
+				frappe.clear_messages()
+			frappe.db.commit()
+	finally:
+		frappe.flags.mute_messages = mute_messages
+	
+	created = sum(1 for result in results if result["status"] == "success")
+	frappe.logger().info(f"Bulk subscription import: {created} of {len(results)} rows created")
+	
+	response = {
+		"status": "success",
+		"created": created,
+		"failed": len(results) - created,
+		"results": results
+	}
+	
+	if job_key:
+		frappe.cache.set_value(get_bulk_import_key(job_key), response, expires_in_sec=BULK_SUBSCRIPTION_RESULT_TTL)
+	
+	return response
+
+def get_bulk_import_key(job_id):
+	return f"bms:bulk_subscription_import:{job_id}"
+
+def parse_bulk_subscription_rows(rows=None, csv_content=None):
+	"""Normalise JSON rows or CSV content into a list of {customer, plan, start_date} dicts"""
+	if csv_content:
+		rows = read_csv_content(csv_content)
+		if rows and str(rows[0][0]).strip().lower() == "customer":
+			rows = rows[1:]
+	elif isinstance(rows, str):
+		rows = json.loads(rows)
+	
+	entries = []
+	for row in rows or []:
+		if isinstance(row, dict):
+			entries.append(frappe._dict(customer=row.get("customer"), plan=row.get("plan"), start_date=row.get("start_date")))
+		else:
+			row = list(row) + [None] * (3 - len(row))
+			entries.append(frappe._dict(customer=row[0], plan=row[1], start_date=row[2]))
+	
+	return entries
+
+def create_bulk_subscription(index, entry):
+	"""Validate one bulk row against the cached plan and customer data and insert it under a savepoint"""
+	result = {"row": index + 1, "customer": entry.customer, "plan": entry.plan}
+	
+	try:
+		if not entry.customer or not entry.plan:
+			frappe.throw(_("Customer and plan are required"))
+		
+		customer = get_customer_snapshot(entry.customer)
+		plan = get_plan_snapshot(entry.plan)
+		
+		if not plan.is_active:
+			frappe.throw(_("Plan {0} is not active").format(entry.plan))
+		if not is_plan_visible(plan.name, customer.name):
+			frappe.throw(_("Plan {0} is not available for customer {1}").format(entry.plan, entry.customer))
+		
+		start_date = getdate(entry.start_date) if entry.start_date else getdate(today())
+		
+	except Exception as e:
+		result.update(status="error", message=str(e))
+		return result
+	
+	frappe.db.savepoint("bms_bulk_subscription")
+	try:
+		subscription_doc = frappe.new_doc("BMS Subscription")
+		subscription_doc.customer = customer.name
+		subscription_doc.plan = plan.name
+		subscription_doc.start_date = start_date
+		subscription_doc.status = "Trial" if plan.trial_period_days > 0 else "Active"
+		subscription_doc.insert()
+		
+		result.update(status="success", subscription=subscription_doc.name)
+		
+	except Exception as e:
+		frappe.db.rollback(save_point="bms_bulk_subscription")
+		result.update(status="error", message=str(e))
+	
+	return result
+
 @frappe.whitelist()
 def cancel_subscription(subscription, reason=None):
 	"""Cancel a subscription"""
@@ -147,17 +319,15 @@ def get_subscription_details(subscription):
 		}
 
 @frappe.whitelist()
-def get_customer_subscriptions(customer):
-	"""Get all subscriptions for a customer"""
+def get_customer_subscriptions(customer, cursor=None, page_size=None, fields=None):
+	"""Get one page of a customer's subscriptions, newest first"""
 	try:
-		subscriptions = frappe.get_all("BMS Subscription",
-			filters={"customer": customer},
-			fields=["name", "plan", "status", "start_date", "end_date", "amount", "currency"]
-		)
+		page = get_page("BMS Subscription", {"customer": customer}, fields or CUSTOMER_SUBSCRIPTION_FIELDS, cursor, page_size)
 		
 		return {
 			"status": "success",
-			"data": subscriptions
+			"data": page.data,
+			"next_cursor": page.next_cursor
 		}
 		
 	except Exception as e:
@@ -6,6 +6,26 @@ import hashlib
 import hmac
 import os
 
+from bms.billing_management_system import permissions
+from bms.billing_management_system.doctype.bms_activity_log.bms_activity_log import get_activity_page, log_bulk_status_change
+from bms.billing_management_system.doctype.bms_webhook_event.bms_webhook_event import store_webhook_event
+from bms.billing_management_system.catalogue import load_plan_catalogue
+from bms.billing_management_system.customer_dashboard import forget_customer_dashboard, get_customer_dashboard
+from bms.billing_management_system.gateway_ids import (
+	get_customer_id_key,
+	get_gateway_id,
+	get_plan_id_key,
+	get_subscription_for_razorpay_id,
+	link_razorpay_subscription,
+	save_gateway_id,
+	set_gateway_id,
+)
+from bms.billing_management_system.metrics import record_bulk_status_change
+from bms.billing_management_system.pagination import get_page
+from bms.billing_management_system.razorpay_client import get_razorpay_client, get_razorpay_credentials
+from bms.billing_management_system.snapshots import get_customer_snapshot, get_plan_snapshot
+from bms.billing_management_system.visibility import is_plan_visible
+
 # Optional Razorpay import
 try:
     import razorpay
@@ -14,6 +34,21 @@ except ImportError:
     RAZORPAY_AVAILABLE = False
     razorpay = None
 
+# Fields returned by the portal list endpoints when the client does not choose its own
+USER_SUBSCRIPTIONS_FIELDS = [
+	"name", "plan", "plan_name", "status", "start_date",
+	"end_date", "amount", "currency", "billing_cycle", "next_billing_date",
+	"auto_renewal", "cancellation_date", "cancellation_reason"
+]
+USER_INVOICES_FIELDS = [
+	"name", "subscription", "plan", "amount", "currency",
+	"invoice_date", "due_date", "status"
+]
+USER_PAYMENTS_FIELDS = [
+	"name", "subscription", "plan", "amount", "currency",
+	"payment_date", "payment_method", "status", "payment_type"
+]
+
 def get_currency_conversion_rate(from_currency, to_currency):
 	"""Get currency conversion rate - for now return 1:1 for same currency or basic USD to INR"""
 	if from_currency == to_currency:
@@ -56,15 +91,12 @@ def get_customer_for_user(user_email=None):
 	if not user_email:
 		user_email = frappe.session.user
 	
-	customer_records = frappe.get_all("BMS Customer",
-		filters={"email": user_email},
-		limit=1
-	)
+	customer = permissions.get_customer_for_user(user_email)
 	
-	if not customer_records:
+	if not customer:
 		frappe.throw(_("No customer record found for user: {0}").format(user_email))
 	
-	return customer_records[0].name
+	return customer
 
 @frappe.whitelist()
 def get_current_customer():
@@ -97,74 +129,51 @@ def get_user_plans(customer_email=None):
 	
 	customer_id = customer_records[0].name
 	
-	# Get all active plans
-	all_plans = frappe.get_all("BMS Plan",
-		filters={"is_active": 1},
-		fields=[
-			"name", "plan_name", "plan_description", "amount", 
-			"currency", "billing_cycle", "plan_visibility", 
-			"trial_period_days", "max_users", "storage_limit_gb", 
-			"api_calls_limit"
-		],
-		order_by="amount asc"
-	)
-	
+	catalogue = load_plan_catalogue(customer_id)
 	available_plans = []
 	
-	for plan in all_plans:
-		plan_doc = frappe.get_doc("BMS Plan", plan.name)
-		if plan_doc.is_available_for_customer(customer_id):
-			# Check if customer has any subscription for this plan
-			existing_subscription = frappe.get_all("BMS Subscription",
-				filters={
-					"customer": customer_id,
-					"plan": plan.name,
-					"status": ["in", ["Active", "Trial", "Cancelled"]]
-				},
-				fields=["name", "status", "start_date", "end_date", "next_billing_date", "auto_renewal"],
-				order_by="creation desc",
-				limit=1
-			)
-			
-			# Get plan features
-			features = []
-			if plan.plan_description:
-				features.extend(plan.plan_description.split('\n'))
-			features.append(f"{plan.max_users} Users")
-			features.append(f"{plan.storage_limit_gb} GB Storage")
-			features.append(f"{plan.api_calls_limit} API Calls")
-			if plan.trial_period_days > 0:
-				features.append(f"{plan.trial_period_days} Days Free Trial")
-			
-			plan.features = [f.strip() for f in features if f.strip()]
+	for plan in catalogue.plans:
+		# Customer's latest subscription for this plan, if any
+		subscription_data = catalogue.latest_subscriptions.get(plan.name)
+		
+		# Get plan features
+		features = []
+		if plan.plan_description:
+			features.extend(plan.plan_description.split('\n'))
+		features.append(f"{plan.max_users} Users")
+		features.append(f"{plan.storage_limit_gb} GB Storage")
+		features.append(f"{plan.api_calls_limit} API Calls")
+		if plan.trial_period_days > 0:
+			features.append(f"{plan.trial_period_days} Days Free Trial")
+		
+		plan.features = [f.strip() for f in features if f.strip()]
+		
+		# Add subscription status information
+		if subscription_data:
+			plan.has_active_subscription = subscription_data.status in ["Active", "Trial"]
+			plan.has_cancelled_subscription = subscription_data.status == "Cancelled"
+			plan.subscription = subscription_data
 			
-			# Add subscription status information
-			if existing_subscription:
-				subscription_data = existing_subscription[0]
-				plan.has_active_subscription = subscription_data.status in ["Active", "Trial"]
-				plan.has_cancelled_subscription = subscription_data.status == "Cancelled"
-				plan.subscription = subscription_data
-				
-				# Check if cancelled subscription can be reactivated (not expired)
-				if plan.has_cancelled_subscription:
-					today_date = frappe.utils.getdate(frappe.utils.today())
-					end_date = frappe.utils.getdate(subscription_data.end_date)
-					plan.can_reactivate = today_date <= end_date
-				else:
-					plan.can_reactivate = False
+			# Check if cancelled subscription can be reactivated (not expired)
+			if plan.has_cancelled_subscription:
+				today_date = frappe.utils.getdate(frappe.utils.today())
+				end_date = frappe.utils.getdate(subscription_data.end_date)
+				plan.can_reactivate = today_date <= end_date
 			else:
-				plan.has_active_subscription = False
-				plan.has_cancelled_subscription = False
 				plan.can_reactivate = False
-				plan.subscription = None
-			
-			available_plans.append(plan)
+		else:
+			plan.has_active_subscription = False
+			plan.has_cancelled_subscription = False
+			plan.can_reactivate = False
+			plan.subscription = None
+		
+		available_plans.append(plan)
 	
 	return available_plans
 
 @frappe.whitelist()
-def get_user_subscriptions(customer_email=None):
-	"""Get subscriptions for a specific customer by email"""
+def get_user_subscriptions(customer_email=None, cursor=None, page_size=None, fields=None):
+	"""Get one page of subscriptions for a customer by email, newest first, as {"data", "next_cursor"}"""
 	if not customer_email:
 		customer_email = frappe.session.user
 	
@@ -179,21 +188,11 @@ def get_user_subscriptions(customer_email=None):
 	
 	customer = customer_records[0].name
 	
-	subscriptions = frappe.get_all("BMS Subscription",
-		filters={"customer": customer},
-		fields=[
-			"name", "plan", "plan_name", "status", "start_date", 
-			"end_date", "amount", "billing_cycle", "next_billing_date",
-			"auto_renewal", "cancellation_date", "cancellation_reason"
-		],
-		order_by="creation desc"
-	)
-	
-	return subscriptions
+	return get_page("BMS Subscription", {"customer": customer}, fields or USER_SUBSCRIPTIONS_FIELDS, cursor, page_size)
 
 @frappe.whitelist()
-def get_user_invoices(customer_email=None):
-	"""Get invoices for a specific customer by email"""
+def get_user_invoices(customer_email=None, cursor=None, page_size=None, fields=None):
+	"""Get one page of invoices for a customer by email, newest first, as {"data", "next_cursor"}"""
 	if not customer_email:
 		customer_email = frappe.session.user
 	
@@ -208,20 +207,11 @@ def get_user_invoices(customer_email=None):
 	
 	customer = customer_records[0].name
 	
-	invoices = frappe.get_all("BMS Invoice",
-		filters={"customer": customer},
-		fields=[
-			"name", "subscription", "plan", "amount", "currency",
-			"invoice_date", "due_date", "status"
-		],
-		order_by="creation desc"
-	)
-	
-	return invoices
+	return get_page("BMS Invoice", {"customer": customer}, fields or USER_INVOICES_FIELDS, cursor, page_size)
 
 @frappe.whitelist()
-def get_user_payments(customer_email=None):
-	"""Get payments for a specific customer by email"""
+def get_user_payments(customer_email=None, cursor=None, page_size=None, fields=None):
+	"""Get one page of payments for a customer by email, newest first, as {"data", "next_cursor"}"""
 	if not customer_email:
 		customer_email = frappe.session.user
 	
@@ -236,16 +226,24 @@ def get_user_payments(customer_email=None):
 	
 	customer = customer_records[0].name
 	
-	payments = frappe.get_all("BMS Payment",
-		filters={"customer": customer},
-		fields=[
-			"name", "subscription", "plan", "amount", "currency",
-			"payment_date", "payment_method", "status", "payment_type"
-		],
-		order_by="creation desc"
+	return get_page("BMS Payment", {"customer": customer}, fields or USER_PAYMENTS_FIELDS, cursor, page_size)
+
+@frappe.whitelist()
+def get_user_activity(customer_email=None, cursor=None, page_size=None):
+	"""Get one page of a customer's activity timeline by email, newest first, as {"data", "next_cursor"}"""
+	if not customer_email:
+		customer_email = frappe.session.user
+	
+	# Find customer record by email
+	customer_records = frappe.get_all("BMS Customer",
+		filters={"email": customer_email},
+		limit=1
 	)
 	
-	return payments
+	if not customer_records:
+		frappe.throw(_("No customer record found for email: {0}").format(customer_email))
+	
+	return get_activity_page({"customer": customer_records[0].name}, cursor, page_size)
 
 @frappe.whitelist()
 def purchase_plan(plan, customer_email=None, payment_method=None, billing_address=None):
@@ -270,13 +268,13 @@ def purchase_plan(plan, customer_email=None, payment_method=None, billing_addres
 	if not plan:
 		frappe.throw(_("Plan is required"))
 	
-	# Get plan details
-	plan_doc = frappe.get_doc("BMS Plan", plan)
-	
 	# Check if plan is available for customer
-	if not plan_doc.is_available_for_customer(customer):
+	if not is_plan_visible(plan, customer):
 		frappe.throw(_("This plan is not available for you"))
 	
+	# Get plan details
+	plan_doc = frappe.get_doc("BMS Plan", plan)
+	
 	# Check if customer already has an active subscription for this plan
 	existing_subscription = frappe.get_all("BMS Subscription",
 		filters={
@@ -455,41 +453,8 @@ def get_user_dashboard_data(customer_email=None):
 	
 	customer = customer_records[0].name
 	
-	# Get customer info
-	customer_doc = frappe.get_doc("BMS Customer", customer)
-	
-	# Get subscription summary
-	active_subscriptions = frappe.db.count("BMS Subscription", {
-		"customer": customer,
-		"status": "Active"
-	})
-	
-	trial_subscriptions = frappe.db.count("BMS Subscription", {
-		"customer": customer,
-		"status": "Trial"
-	})
-	
-	# Get payment summary
-	total_paid = frappe.db.sql("""
-		SELECT SUM(amount) 
-		FROM `tabBMS Payment` 
-		WHERE customer = %s AND status = 'Completed' AND payment_type = 'Payment'
-	""", (customer,))[0][0] or 0
-	
-	# Get recent activity
-	recent_subscriptions = frappe.get_all("BMS Subscription",
-		filters={"customer": customer},
-		fields=["name", "plan_name", "status", "creation"],
-		order_by="creation desc",
-		limit=5
-	)
-	
-	recent_payments = frappe.get_all("BMS Payment",
-		filters={"customer": customer},
-		fields=["name", "amount", "status", "payment_date"],
-		order_by="creation desc",
-		limit=5
-	)
+	customer_doc = get_customer_snapshot(customer)
+	dashboard = get_customer_dashboard(customer)
 	
 	return {
 		"customer": {
@@ -498,13 +463,13 @@ def get_user_dashboard_data(customer_email=None):
 			"status": customer_doc.status
 		},
 		"summary": {
-			"active_subscriptions": active_subscriptions,
-			"trial_subscriptions": trial_subscriptions,
-			"total_paid": total_paid
+			"active_subscriptions": dashboard.subscription_counts.get("Active", 0),
+			"trial_subscriptions": dashboard.subscription_counts.get("Trial", 0),
+			"total_paid": dashboard.total_paid
 		},
 		"recent_activity": {
-			"subscriptions": recent_subscriptions,
-			"payments": recent_payments
+			"subscriptions": dashboard.subscriptions[:5],
+			"payments": dashboard.payments[:5]
 		}
 	}
 
@@ -548,18 +513,12 @@ def create_razorpay_subscription(plan, customer_email=None, currency=None):
 			currency = get_razorpay_currency_for_plan(plan_doc)
 		
 		# Check if plan is available for customer
-		if not plan_doc.is_available_for_customer(customer):
+		if not is_plan_visible(plan, customer):
 			frappe.throw(_("This plan is not available for you"))
 		
-		# Get Razorpay credentials from site config
-		razorpay_key_id = "rzp_test_RHC1S9293wovjQ"
-		razorpay_key_secret = "DAzu38mqdRSnkgtv83WdWe6O"
-		
-		if not razorpay_key_id or not razorpay_key_secret:
-			frappe.throw(_("Razorpay credentials not configured"))
-		
-		# Initialize Razorpay client
-		client = razorpay.Client(auth=(razorpay_key_id, razorpay_key_secret))
+		# Shared Razorpay client and the key id the checkout needs
+		client = get_razorpay_client()
+		razorpay_key_id = get_razorpay_credentials()[0]
 		
 		# Create or get Razorpay plan
 		razorpay_plan_id = create_or_get_razorpay_plan(client, plan_doc, currency)
@@ -628,24 +587,17 @@ def create_or_get_razorpay_plan(client, plan_doc, currency=None):
 	if not currency:
 		currency = get_razorpay_currency_for_plan(plan_doc)
 	
-	# Check if we already have a Razorpay plan ID stored
-	try:
-		existing_razorpay_id = frappe.db.get_value("BMS Plan", plan_doc.name, "razorpay_plan_id")
-		if existing_razorpay_id:
-			try:
-				existing_plan = client.plan.fetch(existing_razorpay_id)
-				frappe.log_error(f"Using existing Razorpay plan: {existing_razorpay_id}")
-				return existing_razorpay_id
-			except Exception as e:
-				frappe.log_error(f"Razorpay plan {existing_razorpay_id} not found, creating new one")
-	except Exception as e:
-		frappe.log_error(f"Error checking existing plan: {str(e)}")
-	
 	# Convert billing cycle to Razorpay format
 	if plan_doc.billing_cycle.lower() == "monthly":
 		period = "monthly"
 		interval = 1
-	elif plan_doc.billing_cycle.lower() == "yearly":
+	elif plan_doc.billing_cycle.lower() == "quarterly":
+		period = "monthly"
+		interval = 3
+	elif plan_doc.billing_cycle.lower() == "semi-annual":
+		period = "monthly"
+		interval = 6
+	elif plan_doc.billing_cycle.lower() in ("annual", "yearly"):
 		period = "yearly"
 		interval = 1
 	elif plan_doc.billing_cycle.lower() == "weekly":
@@ -666,6 +618,28 @@ def create_or_get_razorpay_plan(client, plan_doc, currency=None):
 	
 	frappe.log_error(f"Currency conversion: {plan_doc.amount} {plan_doc.currency} -> {converted_amount} {currency} -> {amount_in_smallest_unit} smallest units")
 	
+	# Reuse the Razorpay plan cached for this plan, currency, amount and billing period
+	cache_key = get_plan_id_key(plan_doc.name, currency, amount_in_smallest_unit, period, interval)
+	razorpay_plan_id = get_gateway_id(cache_key)
+	if razorpay_plan_id:
+		return razorpay_plan_id
+	
+	# Otherwise check the stored Razorpay plan once, it may have been created for another currency, amount or period
+	if plan_doc.razorpay_plan_id:
+		try:
+			razorpay_plan = client.plan.fetch(plan_doc.razorpay_plan_id)
+			item = razorpay_plan.get("item", {})
+			if (
+				item.get("amount") == amount_in_smallest_unit
+				and item.get("currency") == currency
+				and razorpay_plan.get("period") == period
+				and razorpay_plan.get("interval") == interval
+			):
+				set_gateway_id(cache_key, plan_doc.razorpay_plan_id)
+				return plan_doc.razorpay_plan_id
+		except Exception as e:
+			frappe.log_error(f"Razorpay plan {plan_doc.razorpay_plan_id} not found, creating new one")
+	
 	plan_data = {
 		"period": period,
 		"interval": interval,
@@ -690,12 +664,9 @@ def create_or_get_razorpay_plan(client, plan_doc, currency=None):
 	
 	frappe.log_error(f"Razorpay plan created: {razorpay_plan_id}")
 	
-	# Save the Razorpay plan ID to database
-	try:
-		frappe.db.set_value("BMS Plan", plan_doc.name, "razorpay_plan_id", razorpay_plan_id)
-		frappe.db.commit()
-	except Exception as db_error:
-		frappe.log_error(f"Failed to save razorpay_plan_id to database: {str(db_error)}")
+	# Cache the Razorpay plan ID and save it to the database in the background
+	set_gateway_id(cache_key, razorpay_plan_id)
+	save_gateway_id("BMS Plan", plan_doc.name, "razorpay_plan_id", razorpay_plan_id)
 	
 	return razorpay_plan_id
 
@@ -703,18 +674,20 @@ def create_or_get_razorpay_customer(client, customer_doc):
 	"""Create or get existing Razorpay customer"""
 	frappe.log_error(f"Creating Razorpay customer for: {customer_doc.customer_name}")
 	
-	# Check if we already have a Razorpay customer ID stored
-	try:
-		existing_razorpay_id = frappe.db.get_value("BMS Customer", customer_doc.name, "razorpay_customer_id")
-		if existing_razorpay_id:
-			try:
-				existing_customer = client.customer.fetch(existing_razorpay_id)
-				frappe.log_error(f"Using existing Razorpay customer: {existing_razorpay_id}")
-				return existing_razorpay_id
-			except Exception as e:
-				frappe.log_error(f"Razorpay customer {existing_razorpay_id} not found, creating new one")
-	except Exception as e:
-		frappe.log_error(f"Error checking existing customer: {str(e)}")
+	# Reuse the cached Razorpay customer ID
+	cache_key = get_customer_id_key(customer_doc.name)
+	razorpay_customer_id = get_gateway_id(cache_key)
+	if razorpay_customer_id:
+		return razorpay_customer_id
+	
+	# Otherwise check the stored Razorpay customer ID once
+	if customer_doc.razorpay_customer_id:
+		try:
+			client.customer.fetch(customer_doc.razorpay_customer_id)
+			set_gateway_id(cache_key, customer_doc.razorpay_customer_id)
+			return customer_doc.razorpay_customer_id
+		except Exception as e:
+			frappe.log_error(f"Razorpay customer {customer_doc.razorpay_customer_id} not found, creating new one")
 	
 	# Import time for unique email generation if needed
 	import time
@@ -736,12 +709,9 @@ def create_or_get_razorpay_customer(client, customer_doc):
 		razorpay_customer_id = created_customer["id"]
 		frappe.log_error(f"Razorpay customer created: {razorpay_customer_id}")
 		
-		# Save the Razorpay customer ID to database
-		try:
-			frappe.db.set_value("BMS Customer", customer_doc.name, "razorpay_customer_id", razorpay_customer_id)
-			frappe.db.commit()
-		except Exception as db_error:
-			frappe.log_error(f"Failed to save razorpay_customer_id to database: {str(db_error)}")
+		# Cache the Razorpay customer ID and save it to the database in the background
+		set_gateway_id(cache_key, razorpay_customer_id)
+		save_gateway_id("BMS Customer", customer_doc.name, "razorpay_customer_id", razorpay_customer_id)
 		
 		return razorpay_customer_id
 		
@@ -763,12 +733,9 @@ def create_or_get_razorpay_customer(client, customer_doc):
 				razorpay_customer_id = created_customer["id"]
 				frappe.log_error(f"Razorpay customer created with unique email: {razorpay_customer_id}")
 				
-				# Save the Razorpay customer ID to database
-				try:
-					frappe.db.set_value("BMS Customer", customer_doc.name, "razorpay_customer_id", razorpay_customer_id)
-					frappe.db.commit()
-				except Exception as db_error:
-					frappe.log_error(f"Failed to save razorpay_customer_id to database: {str(db_error)}")
+				# Cache the Razorpay customer ID and save it to the database in the background
+				set_gateway_id(cache_key, razorpay_customer_id)
+				save_gateway_id("BMS Customer", customer_doc.name, "razorpay_customer_id", razorpay_customer_id)
 				
 				return razorpay_customer_id
 				
@@ -809,7 +776,7 @@ def test_order_creation(plan, customer_email=None):
 			result["plan_visibility"] = plan_doc.plan_visibility
 			
 			if customer_records:
-				result["plan_available"] = plan_doc.is_available_for_customer(customer_records[0].name)
+				result["plan_available"] = is_plan_visible(plan, customer_records[0].name)
 		except Exception as e:
 			result["plan_found"] = False
 			result["plan_error"] = str(e)
@@ -847,6 +814,7 @@ def handle_razorpay_subscription_success(subscription_id, razorpay_payment_id, r
 		subscription_doc.payment_gateway = "Razorpay"   # Gateway that processed it
 		subscription_doc.razorpay_subscription_id = subscription_id
 		subscription_doc.save(ignore_permissions=True)
+		link_razorpay_subscription(subscription_id, subscription_doc.name)
 		
 		# Check for existing payment with same Razorpay payment ID to prevent duplicates
 		existing_payment = frappe.get_all("BMS Payment",
@@ -930,7 +898,7 @@ def razorpay_webhook():
 		webhook_signature = frappe.get_request_header("X-Razorpay-Signature")
 		
 		# Verify webhook signature
-		razorpay_key_secret = "DAzu38mqdRSnkgtv83WdWe6O"
+		razorpay_key_secret = get_razorpay_credentials()[1]
 		
 		import hmac
 		import hashlib
@@ -947,20 +915,10 @@ def razorpay_webhook():
 		# Parse webhook data
 		webhook_data = json.loads(webhook_body)
 		event = webhook_data.get('event')
-		payload = webhook_data.get('payload', {})
 		
-		frappe.log_error(f"Razorpay webhook received: {event}")
-		
-		if event == 'subscription.charged':
-			handle_subscription_charged(payload)
-		elif event == 'subscription.completed':
-			handle_subscription_completed(payload)
-		elif event == 'subscription.cancelled':
-			handle_subscription_cancelled(payload)
-		elif event == 'subscription.paused':
-			handle_subscription_paused(payload)
-		elif event == 'subscription.resumed':
-			handle_subscription_resumed(payload)
+		# Store the event and acknowledge; a background job runs the handlers
+		if not store_webhook_event(event, webhook_body, frappe.get_request_header("X-Razorpay-Event-Id")):
+			return {"status": "success", "message": "Duplicate event ignored"}
 		
 		return {"status": "success"}
 		
@@ -978,17 +936,16 @@ def handle_subscription_charged(payload):
 	amount = payment.get('amount', 0) / 100  # Convert from paise
 	
 	# Find BMS subscription
-	bms_subscriptions = frappe.get_all("BMS Subscription",
-		filters={"razorpay_subscription_id": razorpay_subscription_id},
-		limit=1
+	subscription_name = get_subscription_for_razorpay_id(razorpay_subscription_id)
+	bms_subscription = subscription_name and frappe.db.get_value("BMS Subscription", subscription_name,
+		["name", "customer", "plan", "currency", "payment_method", "payment_gateway"],
+		as_dict=True
 	)
 	
-	if not bms_subscriptions:
+	if not bms_subscription:
 		frappe.log_error(f"BMS Subscription not found for Razorpay ID: {razorpay_subscription_id}")
 		return
 	
-	bms_subscription = frappe.get_doc("BMS Subscription", bms_subscriptions[0].name)
-	
 	# Check for existing payment with same Razorpay payment ID to prevent duplicates
 	existing_payment = frappe.get_all("BMS Payment",
 		filters={"razorpay_payment_id": razorpay_payment_id},
@@ -1018,7 +975,7 @@ def handle_subscription_charged(payload):
 	payment_doc.save(ignore_permissions=True)
 	
 	# Create invoice for this billing cycle
-	plan_doc = frappe.get_doc("BMS Plan", bms_subscription.plan)
+	plan_doc = get_plan_snapshot(bms_subscription.plan)
 	
 	invoice_doc = frappe.new_doc("BMS Invoice")
 	invoice_doc.naming_series = "INV-.YYYY.-.MM.-.#####"
@@ -1056,71 +1013,55 @@ def handle_subscription_charged(payload):
 
 def handle_subscription_completed(payload):
 	"""Handle subscription completion"""
-	subscription = payload.get('subscription', {})
-	razorpay_subscription_id = subscription.get('id')
-	
-	# Find and update BMS subscription
-	bms_subscriptions = frappe.get_all("BMS Subscription",
-		filters={"razorpay_subscription_id": razorpay_subscription_id},
-		limit=1
-	)
-	
-	if bms_subscriptions:
-		bms_subscription = frappe.get_doc("BMS Subscription", bms_subscriptions[0].name)
-		bms_subscription.status = "Completed"
-		bms_subscription.save(ignore_permissions=True)
-		frappe.log_error(f"Subscription completed: {bms_subscription.name}")
+	set_razorpay_subscription_status(payload, "Completed")
 
 def handle_subscription_cancelled(payload):
 	"""Handle subscription cancellation"""
-	subscription = payload.get('subscription', {})
-	razorpay_subscription_id = subscription.get('id')
-	
-	# Find and update BMS subscription
-	bms_subscriptions = frappe.get_all("BMS Subscription",
-		filters={"razorpay_subscription_id": razorpay_subscription_id},
-		limit=1
-	)
-	
-	if bms_subscriptions:
-		bms_subscription = frappe.get_doc("BMS Subscription", bms_subscriptions[0].name)
-		bms_subscription.status = "Cancelled"
-		bms_subscription.save(ignore_permissions=True)
-		frappe.log_error(f"Subscription cancelled: {bms_subscription.name}")
+	set_razorpay_subscription_status(payload, "Cancelled", {
+		"cancellation_date": today(),
+		"auto_renewal": 0
+	})
 
 def handle_subscription_paused(payload):
 	"""Handle subscription pause"""
-	subscription = payload.get('subscription', {})
-	razorpay_subscription_id = subscription.get('id')
-	
-	# Find and update BMS subscription
-	bms_subscriptions = frappe.get_all("BMS Subscription",
-		filters={"razorpay_subscription_id": razorpay_subscription_id},
-		limit=1
-	)
-	
-	if bms_subscriptions:
-		bms_subscription = frappe.get_doc("BMS Subscription", bms_subscriptions[0].name)
-		bms_subscription.status = "Paused"
-		bms_subscription.save(ignore_permissions=True)
-		frappe.log_error(f"Subscription paused: {bms_subscription.name}")
+	set_razorpay_subscription_status(payload, "Paused")
 
 def handle_subscription_resumed(payload):
 	"""Handle subscription resume"""
-	subscription = payload.get('subscription', {})
-	razorpay_subscription_id = subscription.get('id')
+	set_razorpay_subscription_status(payload, "Active")
+
+def set_razorpay_subscription_status(payload, status, values=None):
+	"""Update only the status columns of the BMS Subscription behind a Razorpay subscription event"""
+	razorpay_subscription_id = payload.get('subscription', {}).get('id')
 	
-	# Find and update BMS subscription
-	bms_subscriptions = frappe.get_all("BMS Subscription",
-		filters={"razorpay_subscription_id": razorpay_subscription_id},
-		limit=1
+	subscription = get_subscription_for_razorpay_id(razorpay_subscription_id)
+	if not subscription:
+		frappe.logger().warning(f"BMS Subscription not found for Razorpay ID: {razorpay_subscription_id}")
+		return
+	
+	current = frappe.db.get_value("BMS Subscription", subscription,
+		["name", "customer", "status", "amount", "currency", "start_date", "billing_cycle", "end_date"],
+		as_dict=True
 	)
+	if not current or current.status == status:
+		return
+	
+	if status == "Active":
+		# Same as handle_status_change on save: a reactivated subscription gets its next billing date back
+		subscription_doc = frappe.get_doc({
+			"doctype": "BMS Subscription",
+			"billing_cycle": current.billing_cycle,
+			"end_date": current.end_date
+		})
+		subscription_doc.calculate_next_billing_date()
+		values = {"next_billing_date": subscription_doc.next_billing_date, **(values or {})}
+	
+	frappe.db.set_value("BMS Subscription", subscription, {"status": status, **(values or {})})
+	record_bulk_status_change("BMS Subscription", [current], status)
+	log_bulk_status_change("BMS Subscription", [current], status)
+	forget_customer_dashboard(current.customer)
 	
-	if bms_subscriptions:
-		bms_subscription = frappe.get_doc("BMS Subscription", bms_subscriptions[0].name)
-		bms_subscription.status = "Active"
-		bms_subscription.save(ignore_permissions=True)
-		frappe.log_error(f"Subscription resumed: {bms_subscription.name}")
+	frappe.logger().info(f"Subscription {subscription} set to {status} from Razorpay")
 
 # Keep the old function for backward compatibility (but deprecated)
 @frappe.whitelist()
@@ -1150,10 +1091,7 @@ def verify_payment_and_create_subscription(plan, customer_email=None, payment_id
 		frappe.throw(_("Payment verification data is incomplete"))
 	
 	# Get Razorpay credentials
-	razorpay_key_secret = 'DAzu38mqdRSnkgtv83WdWe6O'
-	
-	if not razorpay_key_secret:
-		frappe.throw(_("Razorpay credentials not configured"))
+	razorpay_key_secret = get_razorpay_credentials()[1]
 	
 	# Verify payment signature
 	body = f"{order_id}|{payment_id}"
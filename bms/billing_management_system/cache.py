@@ -0,0 +1,28 @@
+import frappe
+
+def get_cached_value(key, generator, expires_in_sec):
+	"""Return a cached value, building it and caching it for `expires_in_sec` on a miss
+	
+	None is returned without being cached, so a missing row is looked up again.
+	"""
+	value = frappe.cache.get_value(key, expires=True)
+	if value is None:
+		value = generator()
+		if value is not None:
+			frappe.cache.set_value(key, value, expires_in_sec=expires_in_sec)
+	
+	return value
+
+def delete_cached_values(*keys):
+	"""Drop cached values now and again once the current transaction commits
+	
+	A request running alongside this transaction can still read the old rows
+	and cache them after the first delete; the second one drops that copy.
+	"""
+	frappe.cache.delete_value(list(keys))
+	frappe.db.after_commit.add(lambda: frappe.cache.delete_value(list(keys)))
+
+def delete_cached_prefix(prefix):
+	"""Drop every cached value whose key starts with `prefix`, now and after commit"""
+	frappe.cache.delete_keys(prefix)
+	frappe.db.after_commit.add(lambda: frappe.cache.delete_keys(prefix))
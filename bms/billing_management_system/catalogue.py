@@ -0,0 +1,47 @@
+import frappe
+
+from bms.billing_management_system.visibility import get_visible_plans
+
+PLAN_CATALOGUE_FIELDS = [
+	"name", "plan_name", "plan_description", "amount",
+	"currency", "billing_cycle", "plan_visibility",
+	"trial_period_days", "max_users", "storage_limit_gb",
+	"api_calls_limit"
+]
+
+# Subscription statuses shown against a plan on the pricing page
+CATALOGUE_SUBSCRIPTION_STATUSES = ["Active", "Trial", "Cancelled"]
+
+def load_plan_catalogue(customer):
+	"""Load the active plans visible to `customer` and its latest subscription per plan
+	
+	Visibility comes from the cached plan visibility index, then two queries
+	load the plans and subscriptions regardless of the number of plans.
+	"""
+	plan_names = list(get_visible_plans(customer))
+	plans = []
+	latest_subscriptions = {}
+	
+	if plan_names:
+		plans = frappe.get_all("BMS Plan",
+			filters={"is_active": 1, "name": ["in", plan_names]},
+			fields=PLAN_CATALOGUE_FIELDS,
+			order_by="amount asc"
+		)
+		
+		for subscription in frappe.get_all("BMS Subscription",
+			filters={
+				"customer": customer,
+				"plan": ["in", plan_names],
+				"status": ["in", CATALOGUE_SUBSCRIPTION_STATUSES]
+			},
+			fields=["name", "plan", "status", "start_date", "end_date", "next_billing_date", "auto_renewal"],
+			order_by="creation desc"
+		):
+			latest_subscriptions.setdefault(subscription.pop("plan"), subscription)
+	
+	return frappe._dict(
+		customer=customer,
+		plans=plans,
+		latest_subscriptions=latest_subscriptions
+	)
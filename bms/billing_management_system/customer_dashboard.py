@@ -0,0 +1,120 @@
+import frappe
+from frappe.utils import cint, flt
+
+from bms.billing_management_system.cache import delete_cached_prefix, delete_cached_values, get_cached_value
+
+CUSTOMER_DASHBOARD_CACHE_KEY = "bms:customer_dashboard"
+
+# Seconds a customer dashboard is cached, in case an invalidation is missed
+CUSTOMER_DASHBOARD_TTL = 600
+
+# Rows of each doctype listed as recent activity
+RECENT_ACTIVITY_LIMIT = 10
+
+def get_customer_dashboard(customer):
+	"""Return the cached dashboard of a customer: status counts, payment totals and recent activity
+	
+	Built from two queries, one grouped summary and one UNION of the latest
+	subscriptions, payments and invoices, and cached until one of them changes.
+	"""
+	return get_cached_value(
+		get_customer_dashboard_key(customer),
+		lambda: build_customer_dashboard(customer),
+		CUSTOMER_DASHBOARD_TTL
+	)
+
+def get_customer_dashboard_key(customer):
+	return f"{CUSTOMER_DASHBOARD_CACHE_KEY}:{customer}"
+
+def build_customer_dashboard(customer):
+	dashboard = frappe._dict(
+		subscription_counts={},
+		invoice_counts={},
+		total_paid=0.0,
+		total_refunded=0.0,
+		subscriptions=[],
+		payments=[],
+		invoices=[]
+	)
+	
+	summary = frappe.db.sql("""
+		SELECT 'BMS Subscription' AS doctype, status, NULL AS payment_type, COUNT(*) AS count, 0 AS total
+		FROM `tabBMS Subscription`
+		WHERE customer = %(customer)s
+		GROUP BY status
+		UNION ALL
+		SELECT 'BMS Invoice', status, NULL, COUNT(*), 0
+		FROM `tabBMS Invoice`
+		WHERE customer = %(customer)s
+		GROUP BY status
+		UNION ALL
+		SELECT 'BMS Payment', status, payment_type, COUNT(*), SUM(amount)
+		FROM `tabBMS Payment`
+		WHERE customer = %(customer)s AND status = 'Completed'
+		GROUP BY status, payment_type
+	""", {"customer": customer}, as_dict=True)
+	
+	for row in summary:
+		if row.doctype == "BMS Subscription":
+			dashboard.subscription_counts[row.status] = cint(row.count)
+		elif row.doctype == "BMS Invoice":
+			dashboard.invoice_counts[row.status] = cint(row.count)
+		elif row.payment_type == "Payment":
+			dashboard.total_paid = flt(row.total)
+		elif row.payment_type == "Refund":
+			dashboard.total_refunded = flt(row.total)
+	
+	dashboard.net_amount = dashboard.total_paid - dashboard.total_refunded
+	
+	# Each branch reads the newest rows through the (customer, creation) index
+	recent = frappe.db.sql("""
+		(SELECT 'BMS Subscription' AS doctype, name, NULL AS subscription, plan, plan_name, status,
+			amount, currency, billing_cycle, NULL AS payment_type, start_date, end_date,
+			NULL AS payment_date, NULL AS invoice_date, NULL AS due_date, creation
+		FROM `tabBMS Subscription`
+		WHERE customer = %(customer)s
+		ORDER BY creation DESC
+		LIMIT %(limit)s)
+		UNION ALL
+		(SELECT 'BMS Payment', name, subscription, plan, NULL, status,
+			amount, currency, NULL, payment_type, NULL, NULL,
+			payment_date, NULL, NULL, creation
+		FROM `tabBMS Payment`
+		WHERE customer = %(customer)s
+		ORDER BY creation DESC
+		LIMIT %(limit)s)
+		UNION ALL
+		(SELECT 'BMS Invoice', name, subscription, plan, plan_name, status,
+			amount, currency, NULL, NULL, NULL, NULL,
+			NULL, invoice_date, due_date, creation
+		FROM `tabBMS Invoice`
+		WHERE customer = %(customer)s
+		ORDER BY creation DESC
+		LIMIT %(limit)s)
+		ORDER BY creation DESC
+	""", {"customer": customer, "limit": RECENT_ACTIVITY_LIMIT}, as_dict=True)
+	
+	lists = {"BMS Subscription": "subscriptions", "BMS Payment": "payments", "BMS Invoice": "invoices"}
+	for row in recent:
+		dashboard[lists[row.doctype]].append(row)
+	
+	return dashboard
+
+def clear_customer_dashboard(doc, method=None):
+	"""BMS Subscription/Payment/Invoice hook: drop the cached dashboard of the document's customer"""
+	customers = {doc.customer}
+	
+	before = doc.get_doc_before_save()
+	if before:
+		customers.add(before.customer)
+	
+	for customer in customers:
+		forget_customer_dashboard(customer)
+
+def forget_customer_dashboard(customer):
+	if customer:
+		delete_cached_values(get_customer_dashboard_key(customer))
+
+def clear_customer_dashboards():
+	"""Drop every cached dashboard, after bulk updates that bypass the document hooks"""
+	delete_cached_prefix(f"{CUSTOMER_DASHBOARD_CACHE_KEY}:")
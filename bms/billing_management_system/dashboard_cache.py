@@ -0,0 +1,138 @@
+import time
+
+import frappe
+
+# Builders of the admin dashboard sections
+DASHBOARD_SECTIONS = {
+	"subscriptions": "bms.billing_management_system.api.dashboard.get_subscription_statistics",
+	"revenue": "bms.billing_management_system.api.dashboard.get_revenue_statistics",
+	"payments": "bms.billing_management_system.api.dashboard.get_payment_statistics",
+	"recent_activities": "bms.billing_management_system.api.dashboard.get_recent_activities",
+	"upcoming_renewals": "bms.billing_management_system.api.dashboard.get_upcoming_renewals",
+	"overdue_invoices": "bms.billing_management_system.api.dashboard.get_overdue_invoices"
+}
+
+# Sections whose rows carry a customer_name, rebuilt when a customer is renamed
+CUSTOMER_NAME_SECTIONS = ["upcoming_renewals", "overdue_invoices"]
+
+# Seconds a section is served as fresh, overridable per section with the bms_dashboard_ttl site config dict
+DASHBOARD_SECTION_TTLS = {
+	"subscriptions": 60,
+	"revenue": 300,
+	"payments": 60,
+	"recent_activities": 30,
+	"upcoming_renewals": 300,
+	"overdue_invoices": 300
+}
+
+# Seconds past its TTL a section is still served while it is recomputed, overridable with bms_dashboard_stale_ttl
+DASHBOARD_STALE_TTL = 3600
+
+# Seconds a section recompute holds its lock before another worker may take over
+DASHBOARD_LOCK_TIMEOUT = 60
+
+# Seconds a request with nothing cached waits for another worker's recompute
+DASHBOARD_LOCK_WAIT = 5
+
+def get_dashboard_sections():
+	"""Return {section: value} for every admin dashboard section"""
+	return {section: get_dashboard_section(section) for section in DASHBOARD_SECTIONS}
+
+def get_dashboard_section(section):
+	"""Return one dashboard section, stale-while-revalidate
+	
+	A fresh entry is returned as is. A stale one is returned too, after queueing
+	a background recompute. Only a missing entry is computed in the request, and
+	the per-section lock makes sure one worker does it while the others wait.
+	"""
+	entry = frappe.cache.get_value(get_section_key(section), expires=True)
+	
+	if entry:
+		if time.time() - entry["computed_on"] > get_section_ttl(section) and acquire_section_lock(section):
+			frappe.enqueue(
+				"bms.billing_management_system.dashboard_cache.refresh_dashboard_section",
+				queue="short",
+				job_id=f"bms_dashboard_refresh::{section}",
+				deduplicate=True,
+				section=section
+			)
+		return entry["value"]
+	
+	if acquire_section_lock(section):
+		return refresh_dashboard_section(section)["value"]
+	
+	deadline = time.monotonic() + DASHBOARD_LOCK_WAIT
+	while time.monotonic() < deadline:
+		time.sleep(0.1)
+		entry = frappe.cache.get_value(get_section_key(section), expires=True)
+		if entry:
+			return entry["value"]
+	
+	# The recompute outlived the wait; serve this request without caching
+	return frappe.get_attr(DASHBOARD_SECTIONS[section])()
+
+def refresh_dashboard_section(section):
+	"""Recompute and cache one section, releasing its lock; also runs as a background job"""
+	try:
+		started = time.monotonic()
+		value = frappe.get_attr(DASHBOARD_SECTIONS[section])()
+		entry = {
+			"value": value,
+			"computed_on": time.time(),
+			"seconds": time.monotonic() - started
+		}
+		
+		frappe.cache.set_value(
+			get_section_key(section),
+			entry,
+			expires_in_sec=get_section_ttl(section) + (frappe.conf.get("bms_dashboard_stale_ttl") or DASHBOARD_STALE_TTL)
+		)
+		frappe.logger().debug(f"BMS dashboard section {section} computed in {entry['seconds'] * 1000:.0f}ms")
+		
+		return entry
+	
+	finally:
+		release_section_lock(section)
+
+def get_dashboard_timings():
+	"""Return {section: {"seconds", "age", "ttl", "stale"}} for monitoring, None for sections not cached"""
+	timings = {}
+	
+	for section in DASHBOARD_SECTIONS:
+		entry = frappe.cache.get_value(get_section_key(section), expires=True)
+		if not entry:
+			timings[section] = None
+			continue
+		
+		age = time.time() - entry["computed_on"]
+		timings[section] = {
+			"seconds": entry["seconds"],
+			"age": age,
+			"ttl": get_section_ttl(section),
+			"stale": age > get_section_ttl(section)
+		}
+	
+	return timings
+
+def clear_dashboard_cache(sections=None):
+	"""Drop the cached sections, all of them unless `sections` is given"""
+	for section in sections or DASHBOARD_SECTIONS:
+		frappe.cache.delete_value(get_section_key(section))
+
+def get_section_key(section):
+	return f"bms:dashboard:{section}"
+
+def get_section_ttl(section):
+	return (frappe.conf.get("bms_dashboard_ttl") or {}).get(section) or DASHBOARD_SECTION_TTLS[section]
+
+def acquire_section_lock(section):
+	"""Take the recompute lock of a section with SET NX, True when this worker got it"""
+	return bool(frappe.cache.set(
+		frappe.cache.make_key(f"bms:dashboard_lock:{section}"),
+		1,
+		nx=True,
+		ex=DASHBOARD_LOCK_TIMEOUT
+	))
+
+def release_section_lock(section):
+	frappe.cache.delete(frappe.cache.make_key(f"bms:dashboard_lock:{section}"))
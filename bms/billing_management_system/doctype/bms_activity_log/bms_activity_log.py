@@ -0,0 +1,99 @@
+import frappe
+from frappe import _
+from frappe.model.document import Document
+from frappe.utils import now
+
+from bms.billing_management_system.pagination import get_page
+
+# Activity type of each logged doctype
+ACTIVITY_TYPES = {
+	"BMS Subscription": "Subscription",
+	"BMS Payment": "Payment",
+	"BMS Invoice": "Invoice",
+	"BMS Webhook Event": "Webhook"
+}
+
+ACTIVITY_FIELDS = [
+	"name", "timestamp", "activity_type", "action", "status", "customer",
+	"reference_doctype", "reference_name", "amount", "currency", "description"
+]
+
+class BMSActivityLog(Document):
+	def validate(self):
+		if not self.is_new():
+			frappe.throw(_("Activity log entries cannot be changed"))
+
+def log_activity(doctype, name, action, status=None, customer=None, amount=None, currency=None, description=None):
+	"""Append one entry to the activity log"""
+	frappe.get_doc({
+		"doctype": "BMS Activity Log",
+		"timestamp": now(),
+		"activity_type": ACTIVITY_TYPES[doctype],
+		"action": action,
+		"status": status,
+		"customer": customer,
+		"reference_doctype": doctype,
+		"reference_name": name,
+		"amount": amount,
+		"currency": currency,
+		"description": description or f"{ACTIVITY_TYPES[doctype]} {name} {action}"
+	}).insert(ignore_permissions=True)
+
+def log_bulk_status_change(doctype, rows, new_status):
+	"""Log rows whose status was changed without saving the documents, in one INSERT
+	
+	Each row must carry name, customer, amount and currency.
+	"""
+	timestamp = now()
+	values = [
+		(
+			frappe.generate_hash(length=10), timestamp, timestamp, frappe.session.user, frappe.session.user,
+			timestamp, ACTIVITY_TYPES[doctype], "status changed", new_status, row.customer, doctype, row.name,
+			row.amount, row.currency, f"{ACTIVITY_TYPES[doctype]} {row.name} is now {new_status}"
+		)
+		for row in rows
+	]
+	
+	frappe.db.bulk_insert("BMS Activity Log", [
+		"name", "creation", "modified", "owner", "modified_by", *ACTIVITY_FIELDS[1:]
+	], values)
+
+def log_document_insert(doc, method=None):
+	"""BMS Subscription/Payment/Invoice after_insert hook"""
+	log_activity(doc.doctype, doc.name, "created",
+		status=doc.status,
+		customer=doc.customer,
+		amount=doc.amount,
+		currency=doc.currency,
+		description=f"{ACTIVITY_TYPES[doc.doctype]} {doc.name} created for {doc.customer_name or doc.customer}"
+	)
+
+def log_document_update(doc, method=None):
+	"""BMS Subscription/Payment/Invoice on_update hook: log status changes of saved documents"""
+	if doc.flags.in_insert or not doc.has_value_changed("status"):
+		return
+	
+	log_activity(doc.doctype, doc.name, "status changed",
+		status=doc.status,
+		customer=doc.customer,
+		amount=doc.amount,
+		currency=doc.currency,
+		description=f"{ACTIVITY_TYPES[doc.doctype]} {doc.name} is now {doc.status}"
+	)
+
+def log_document_trash(doc, method=None):
+	"""BMS Subscription/Payment/Invoice on_trash hook"""
+	log_activity(doc.doctype, doc.name, "deleted",
+		status=doc.status,
+		customer=doc.customer,
+		amount=doc.amount,
+		currency=doc.currency
+	)
+
+def get_activity_page(filters=None, cursor=None, page_size=None):
+	"""Return one page of the activity log, newest first, as {"data", "next_cursor"}
+	
+	Served by a range scan of the timestamp index, or of (customer, timestamp)
+	for a customer timeline.
+	"""
+	return get_page("BMS Activity Log", filters or {}, ACTIVITY_FIELDS, cursor, page_size, sort_field="timestamp")
@@ -2,6 +2,11 @@ import frappe
 from frappe.model.document import Document
 from frappe import _
 
+from bms.billing_management_system.aggregates import get_total_amount
+from bms.billing_management_system.customer_dashboard import forget_customer_dashboard
+from bms.billing_management_system.dashboard_cache import CUSTOMER_NAME_SECTIONS, clear_dashboard_cache
+from bms.billing_management_system.permissions import clear_user_cache
+
 class BMSCustomer(Document):
 	def validate(self):
 		self.validate_email()
@@ -38,18 +43,31 @@ class BMSCustomer(Document):
 	
 	def on_update(self):
 		"""Update related documents when customer is updated"""
-		self.update_related_subscriptions()
+		if self.has_value_changed("email"):
+			self.clear_user_cache()
+		if not self.flags.in_insert and self.has_value_changed("customer_name"):
+			self.update_related_subscriptions()
+	
+	def on_trash(self):
+		"""Forget the cached user link of a deleted customer"""
+		clear_user_cache(self.email)
+	
+	def clear_user_cache(self):
+		"""Forget cached user -> customer links for the old and new email"""
+		before = self.get_doc_before_save()
+		if before and before.email:
+			clear_user_cache(before.email)
+		if self.email:
+			clear_user_cache(self.email)
 	
 	def update_related_subscriptions(self):
-		"""Update customer name in related subscriptions"""
-		subscriptions = frappe.get_all("BMS Subscription", 
-			filters={"customer": self.name}, 
-			fields=["name"])
-		
-		for subscription in subscriptions:
-			doc = frappe.get_doc("BMS Subscription", subscription.name)
-			doc.customer_name = self.customer_name
-			doc.save(ignore_permissions=True)
+		"""Queue the customer name update of related documents after this save is committed"""
+		frappe.enqueue(
+			"bms.billing_management_system.doctype.bms_customer.bms_customer.propagate_customer_name",
+			queue="short",
+			customer=self.name,
+			enqueue_after_commit=True
+		)
 	
 	def get_active_subscriptions(self):
 		"""Get all active subscriptions for this customer"""
@@ -63,11 +81,29 @@ class BMSCustomer(Document):
 	
 	def get_total_revenue(self):
 		"""Calculate total revenue from this customer"""
-		payments = frappe.get_all("BMS Payment",
-			filters={
-				"customer": self.name,
-				"status": "Completed"
-			},
-			fields=["amount"]
+		return get_total_amount({
+			"customer": self.name,
+			"status": "Completed"
+		})
+
+# Documents that keep a copy of the customer name
+CUSTOMER_NAME_DOCTYPES = ["BMS Subscription", "BMS Invoice", "BMS Payment", "BMS Plan Customer"]
+
+def propagate_customer_name(customer):
+	"""Copy the current customer name to all documents linked to the customer, one UPDATE per doctype"""
+	customer_name = frappe.db.get_value("BMS Customer", customer, "customer_name")
+	if customer_name is None:
+		return
+	
+	for doctype in CUSTOMER_NAME_DOCTYPES:
+		frappe.db.set_value(doctype,
+			{"customer": customer},
+			"customer_name", customer_name,
+			update_modified=False
 		)
-		return sum(payment.amount for payment in payments)
+	
+	# The UPDATEs skip the document hooks that would clear these
+	forget_customer_dashboard(customer)
+	frappe.db.after_commit.add(lambda: clear_dashboard_cache(CUSTOMER_NAME_SECTIONS))
+	
+	frappe.logger().info(f"Propagated customer name of {customer}")
@@ -3,6 +3,8 @@ from frappe.model.document import Document
 from frappe import _
 from datetime import datetime, timedelta
 
+from bms.billing_management_system.snapshots import get_customer_snapshot, get_plan_snapshot
+
 class BMSInvoice(Document):
 	def validate(self):
 		self.validate_dates()
@@ -20,14 +22,12 @@ class BMSInvoice(Document):
 	def set_customer_name(self):
 		"""Set customer name from customer link"""
 		if self.customer:
-			customer_doc = frappe.get_doc("BMS Customer", self.customer)
-			self.customer_name = customer_doc.customer_name
+			self.customer_name = get_customer_snapshot(self.customer).customer_name
 	
 	def set_plan_name(self):
 		"""Set plan name from plan link"""
 		if self.plan:
-			plan_doc = frappe.get_doc("BMS Plan", self.plan)
-			self.plan_name = plan_doc.plan_name
+			self.plan_name = get_plan_snapshot(self.plan).plan_name
 	
 	def calculate_total_amount(self):
 		"""Calculate total amount including tax"""
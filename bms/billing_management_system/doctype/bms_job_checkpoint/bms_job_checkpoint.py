@@ -0,0 +1,49 @@
+import frappe
+from frappe.model.document import Document
+from frappe.utils import now_datetime
+
+class BMSJobCheckpoint(Document):
+	pass
+
+def get_checkpoint(job_name):
+	"""Get the checkpoint for a job, creating it if needed"""
+	checkpoint = frappe.db.get_value("BMS Job Checkpoint", job_name,
+		["name", "status", "last_processed", "processed_count"],
+		as_dict=True
+	)
+	
+	if not checkpoint:
+		doc = frappe.new_doc("BMS Job Checkpoint")
+		doc.job_name = job_name
+		doc.status = "Completed"
+		doc.processed_count = 0
+		doc.insert(ignore_permissions=True)
+		checkpoint = frappe._dict(name=doc.name, status=doc.status, last_processed=None, processed_count=0)
+	
+	return checkpoint
+
+def start_checkpoint(job_name):
+	"""Mark a fresh run of the job as started"""
+	frappe.db.set_value("BMS Job Checkpoint", job_name, {
+		"status": "Running",
+		"last_processed": None,
+		"processed_count": 0,
+		"started_on": now_datetime(),
+		"completed_on": None
+	}, update_modified=False)
+
+def advance_checkpoint(job_name, last_processed, count):
+	"""Record that the job committed everything up to `last_processed`"""
+	frappe.db.sql("""
+		UPDATE `tabBMS Job Checkpoint`
+		SET last_processed = %s, processed_count = processed_count + %s
+		WHERE name = %s
+	""", (last_processed, count, job_name))
+
+def complete_checkpoint(job_name):
+	"""Mark the current run of the job as completed"""
+	frappe.db.set_value("BMS Job Checkpoint", job_name, {
+		"status": "Completed",
+		"last_processed": None,
+		"completed_on": now_datetime()
+	}, update_modified=False)
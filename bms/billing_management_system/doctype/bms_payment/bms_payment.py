@@ -2,6 +2,9 @@ import frappe
 from frappe.model.document import Document
 from frappe import _
 
+from bms.billing_management_system.aggregates import get_payment_totals
+from bms.billing_management_system.snapshots import get_customer_snapshot
+
 class BMSPayment(Document):
 	def validate(self):
 		self.validate_amount()
@@ -24,33 +27,15 @@ class BMSPayment(Document):
 	def set_customer_name(self):
 		"""Set customer name from customer link"""
 		if self.customer:
-			customer_doc = frappe.get_doc("BMS Customer", self.customer)
-			self.customer_name = customer_doc.customer_name
+			self.customer_name = get_customer_snapshot(self.customer).customer_name
 	
 	def validate_refund_amount(self):
 		"""Validate refund amount against original payment"""
 		if self.payment_type == "Refund" and self.subscription:
-			# Get total payments for this subscription
-			total_payments = frappe.get_all("BMS Payment",
-				filters={
-					"subscription": self.subscription,
-					"payment_type": "Payment",
-					"status": "Completed"
-				},
-				fields=["amount"]
-			)
-			
-			total_refunds = frappe.get_all("BMS Payment",
-				filters={
-					"subscription": self.subscription,
-					"payment_type": "Refund",
-					"status": "Completed"
-				},
-				fields=["amount"]
-			)
-			
-			total_paid = sum(payment.amount for payment in total_payments)
-			total_refunded = sum(refund.amount for refund in total_refunds)
+			# Get total payments and refunds for this subscription
+			totals = get_payment_totals({"subscription": self.subscription})
+			total_paid = totals.total_paid
+			total_refunded = totals.total_refunded
 			
 			# Refund amount should not exceed total paid
 			if abs(self.amount) > (total_paid - total_refunded):
@@ -15,6 +15,37 @@ frappe.ui.form.on('BMS Plan', {
 					plan: frm.doc.name
 				});
 			}, __("Create"));
+			
+			frm.add_custom_button(__("Reprice Subscriptions"), function() {
+				// Dry run first, then queue the repricing once confirmed
+				frappe.call({
+					method: "bms.billing_management_system.doctype.bms_plan.bms_plan.preview_plan_repricing",
+					args: { plan: frm.doc.name },
+					callback: function(r) {
+						let preview = r.message;
+						if (!preview.subscription_count) {
+							frappe.msgprint(__("All active subscriptions already use this plan's amount and billing cycle"));
+							return;
+						}
+						
+						frappe.confirm(
+							__("{0} active subscriptions will be repriced, changing MRR by {1}. Continue?", [
+								preview.subscription_count,
+								format_currency(preview.mrr_change, frm.doc.currency)
+							]),
+							function() {
+								frappe.call({
+									method: "bms.billing_management_system.doctype.bms_plan.bms_plan.reprice_plan",
+									args: { plan: frm.doc.name },
+									callback: function() {
+										frm.reload_doc();
+									}
+								});
+							}
+						);
+					}
+				});
+			}, __("Actions"));
 		}
 	},
 	
@@ -1,6 +1,21 @@
 import frappe
 from frappe.model.document import Document
 from frappe import _
+from frappe.utils import flt, now
+
+from bms.billing_management_system.aggregates import get_total_amount
+from bms.billing_management_system.customer_dashboard import clear_customer_dashboards
+from bms.billing_management_system.visibility import is_plan_visible
+
+REPRICING_CHUNK_SIZE = 1000
+
+# Months covered by one billing period, used to turn an amount into monthly recurring revenue
+BILLING_CYCLE_MONTHS = {
+	"Monthly": 1,
+	"Quarterly": 3,
+	"Semi-Annual": 6,
+	"Annual": 12
+}
 
 class BMSPlan(Document):
 	def validate(self):
@@ -21,24 +36,31 @@ class BMSPlan(Document):
 	
 	def on_update(self):
 		"""Update related subscriptions when plan is updated"""
+		if self.flags.in_insert:
+			return
+		
 		if self.has_value_changed("amount") or self.has_value_changed("billing_cycle"):
 			self.update_related_subscriptions()
 	
 	def update_related_subscriptions(self):
-		"""Update amount in active subscriptions"""
-		active_subscriptions = frappe.get_all("BMS Subscription",
-			filters={
-				"plan": self.name,
-				"status": "Active"
-			},
-			fields=["name"]
-		)
+		"""Queue the repricing of active subscriptions after this save is committed"""
+		self.db_set({
+			"repricing_status": "Queued",
+			"repricing_total": 0,
+			"repricing_progress": 0,
+			"repricing_started_on": None,
+			"repricing_completed_on": None
+		}, update_modified=False)
 		
-		for subscription in active_subscriptions:
-			doc = frappe.get_doc("BMS Subscription", subscription.name)
-			doc.amount = self.amount
-			doc.billing_cycle = self.billing_cycle
-			doc.save(ignore_permissions=True)
+		# Not deduplicated: a job already running may have passed its last check
+		# before this save committed. Repricing is idempotent, so a redundant run
+		# finds nothing left to change.
+		frappe.enqueue(
+			"bms.billing_management_system.doctype.bms_plan.bms_plan.reprice_subscriptions",
+			queue="long",
+			enqueue_after_commit=True,
+			plan=self.name
+		)
 	
 	def get_active_subscriptions_count(self):
 		"""Get count of active subscriptions for this plan"""
@@ -49,14 +71,10 @@ class BMSPlan(Document):
 	
 	def get_total_revenue(self):
 		"""Calculate total revenue from this plan"""
-		payments = frappe.get_all("BMS Payment",
-			filters={
-				"plan": self.name,
-				"status": "Completed"
-			},
-			fields=["amount"]
-		)
-		return sum(payment.amount for payment in payments)
+		return get_total_amount({
+			"plan": self.name,
+			"status": "Completed"
+		})
 	
 	def validate_target_customers(self):
 		"""Validate target customers"""
@@ -85,14 +103,7 @@ class BMSPlan(Document):
 	
 	def is_available_for_customer(self, customer):
 		"""Check if plan is available for specific customer"""
-		if self.plan_visibility == "All Customers":
-			return True
-		elif self.plan_visibility == "Specific Customers":
-			if self.target_customers:
-				for target_customer in self.target_customers:
-					if target_customer.customer == customer:
-						return True
-		return False
+		return is_plan_visible(self.name, customer)
 	
 	def can_be_deleted(self):
 		"""Check if plan can be deleted"""
@@ -127,3 +138,124 @@ def get_pricing_plans_view_data():
 			plan.target_customers = []
 	
 	return plans
+
+def get_repricing_filters(plan):
+	"""Filters matching the active subscriptions of `plan` that do not carry its current amount or billing cycle"""
+	filters = {"plan": plan.name, "status": "Active"}
+	or_filters = {
+		"amount": ["!=", plan.amount],
+		"billing_cycle": ["!=", plan.billing_cycle]
+	}
+	return filters, or_filters
+
+def get_monthly_amount(amount, billing_cycle):
+	"""Monthly recurring revenue of one subscription, zero for one-time plans"""
+	months = BILLING_CYCLE_MONTHS.get(billing_cycle)
+	return flt(amount) / months if months else 0
+
+def get_repricing_preview(plan):
+	"""Count the active subscriptions a repricing would change and the resulting MRR change"""
+	plan = frappe.db.get_value("BMS Plan", plan, ["name", "amount", "billing_cycle"], as_dict=True)
+	filters, or_filters = get_repricing_filters(plan)
+	
+	groups = frappe.get_all("BMS Subscription",
+		filters=filters,
+		or_filters=or_filters,
+		fields=["amount", "billing_cycle", "count(name) as subscription_count"],
+		group_by="amount, billing_cycle"
+	)
+	
+	subscription_count = sum(group.subscription_count for group in groups)
+	current_mrr = sum(get_monthly_amount(group.amount, group.billing_cycle) * group.subscription_count for group in groups)
+	new_mrr = get_monthly_amount(plan.amount, plan.billing_cycle) * subscription_count
+	
+	return {
+		"plan": plan.name,
+		"subscription_count": subscription_count,
+		"current_mrr": current_mrr,
+		"new_mrr": new_mrr,
+		"mrr_change": new_mrr - current_mrr
+	}
+
+@frappe.whitelist()
+def preview_plan_repricing(plan):
+	"""Dry run of a repricing, nothing is changed"""
+	frappe.only_for("BMS Admin")
+	return get_repricing_preview(plan)
+
+@frappe.whitelist()
+def reprice_plan(plan):
+	"""Queue the repricing of a plan's active subscriptions, e.g. to resume a failed run"""
+	frappe.only_for("BMS Admin")
+	frappe.get_doc("BMS Plan", plan).update_related_subscriptions()
+
+def reprice_subscriptions(plan, chunk_size=REPRICING_CHUNK_SIZE):
+	"""Background job: move the active subscriptions of a plan to its current amount and billing cycle
+	
+	Only subscriptions that still differ from the plan are selected, so a re-run
+	picks up where a failed or superseded run stopped. A save that queues another
+	repricing while this one runs sends it round again before it completes.
+	"""
+	frappe.db.set_value("BMS Plan", plan, {
+		"repricing_status": "Running",
+		"repricing_total": get_repricing_preview(plan)["subscription_count"],
+		"repricing_progress": 0,
+		"repricing_started_on": now(),
+		"repricing_completed_on": None
+	}, update_modified=False)
+	frappe.db.commit()
+	
+	repriced = 0
+	
+	try:
+		while True:
+			repriced = reprice_pending_subscriptions(plan, chunk_size, repriced)
+			
+			# A save committed since the last chunk marks the plan Queued again
+			if frappe.db.get_value("BMS Plan", plan, "repricing_status") != "Queued":
+				break
+			
+			frappe.db.set_value("BMS Plan", plan, "repricing_status", "Running", update_modified=False)
+			frappe.db.commit()
+		
+		frappe.db.set_value("BMS Plan", plan, {
+			"repricing_status": "Completed",
+			"repricing_completed_on": now()
+		}, update_modified=False)
+		frappe.db.commit()
+		
+		frappe.logger().info(f"Repriced {repriced} subscriptions of plan {plan}")
+		
+	except Exception:
+		frappe.db.rollback()
+		frappe.db.set_value("BMS Plan", plan, "repricing_status", "Failed", update_modified=False)
+		frappe.db.commit()
+		frappe.log_error(frappe.get_traceback(), f"BMS Plan Repricing Error: {plan}")
+		raise
+
+def reprice_pending_subscriptions(plan, chunk_size=REPRICING_CHUNK_SIZE, repriced=0):
+	"""Reprice chunks of subscriptions until none differs from the plan, returning the running total"""
+	while True:
+		# Re-read the plan for every chunk so a change made mid-run is applied too
+		plan_doc = frappe.db.get_value("BMS Plan", plan, ["name", "amount", "billing_cycle"], as_dict=True)
+		filters, or_filters = get_repricing_filters(plan_doc)
+		
+		names = frappe.get_all("BMS Subscription",
+			filters=filters,
+			or_filters=or_filters,
+			pluck="name",
+			order_by="name asc",
+			limit=chunk_size
+		)
+		if not names:
+			return repriced
+		
+		frappe.db.set_value("BMS Subscription",
+			{"name": ["in", names]},
+			{"amount": plan_doc.amount, "billing_cycle": plan_doc.billing_cycle}
+		)
+		
+		repriced += len(names)
+		frappe.db.set_value("BMS Plan", plan, "repricing_progress", repriced, update_modified=False)
+		frappe.db.commit()
+		clear_customer_dashboards()
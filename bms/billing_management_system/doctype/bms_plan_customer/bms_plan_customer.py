@@ -2,6 +2,8 @@ import frappe
 from frappe.model.document import Document
 from frappe import _
 
+from bms.billing_management_system.snapshots import get_customer_snapshot
+
 class BMSPlanCustomer(Document):
 	def validate(self):
 		self.set_customer_name()
@@ -9,5 +11,4 @@ class BMSPlanCustomer(Document):
 	def set_customer_name(self):
 		"""Set customer name from customer link"""
 		if self.customer:
-			customer_doc = frappe.get_doc("BMS Customer", self.customer)
-			self.customer_name = customer_doc.customer_name
+			self.customer_name = get_customer_snapshot(self.customer).customer_name
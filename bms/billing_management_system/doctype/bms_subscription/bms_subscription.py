@@ -4,6 +4,10 @@ from frappe import _
 from datetime import datetime, timedelta
 import calendar
 
+from bms.billing_management_system.razorpay_client import get_razorpay_client
+from bms.billing_management_system.snapshots import get_customer_snapshot, get_plan_snapshot
+from bms.billing_management_system.visibility import get_visible_plans, is_plan_visible
+
 class BMSSubscription(Document):
 	def validate(self):
 		self.validate_dates()
@@ -21,14 +25,13 @@ class BMSSubscription(Document):
 	def validate_plan_availability(self):
 		"""Validate that the plan is available for the customer"""
 		if self.plan and self.customer:
-			plan_doc = frappe.get_doc("BMS Plan", self.plan)
-			if not plan_doc.is_available_for_customer(self.customer):
+			if not is_plan_visible(self.plan, self.customer):
 				frappe.throw(_("This plan is not available for the selected customer"))
 	
 	def set_plan_details(self):
 		"""Set plan details from selected plan"""
 		if self.plan:
-			plan_doc = frappe.get_doc("BMS Plan", self.plan)
+			plan_doc = get_plan_snapshot(self.plan)
 			self.plan_name = plan_doc.plan_name
 			self.amount = plan_doc.amount
 			self.currency = plan_doc.currency
@@ -65,8 +68,7 @@ class BMSSubscription(Document):
 	def set_customer_name(self):
 		"""Set customer name from customer link"""
 		if self.customer:
-			customer_doc = frappe.get_doc("BMS Customer", self.customer)
-			self.customer_name = customer_doc.customer_name
+			self.customer_name = get_customer_snapshot(self.customer).customer_name
 	
 	def add_months(self, date, months):
 		"""Add months to a date"""
@@ -86,7 +88,7 @@ class BMSSubscription(Document):
 		# API functions handle invoice creation themselves to avoid duplicates
 		if self.status in ["Active", "Trial"] and not frappe.flags.via_api:
 			try:
-				frappe.log_error(f"Creating invoice for new subscription {self.name} with status {self.status}")
+				frappe.logger().info(f"Creating invoice for new subscription {self.name} with status {self.status}")
 				self.create_invoice()
 			except Exception as e:
 				frappe.log_error(f"Error in after_insert for subscription {self.name}: {str(e)}")
@@ -148,23 +150,8 @@ class BMSSubscription(Document):
 			return False
 		
 		try:
-			# Import Razorpay
-			try:
-				import razorpay
-			except ImportError:
-				frappe.log_error("Razorpay module not available", "Razorpay Import Error")
-				return False
-			
-			# Get Razorpay credentials (same as used in user_portal.py)
-			razorpay_key_id = "rzp_test_RHC1S9293wovjQ"
-			razorpay_key_secret = "DAzu38mqdRSnkgtv83WdWe6O"
-			
-			if not razorpay_key_id or not razorpay_key_secret:
-				frappe.log_error("Razorpay credentials not configured", "Razorpay Config Error")
-				return False
-			
-			# Initialize Razorpay client
-			client = razorpay.Client(auth=(razorpay_key_id, razorpay_key_secret))
+			# Shared Razorpay client
+			client = get_razorpay_client()
 			
 			frappe.log_error(f"Attempting to cancel Razorpay subscription: {self.razorpay_subscription_id}", "Razorpay Cancellation Attempt")
 			
@@ -226,23 +213,8 @@ class BMSSubscription(Document):
 			return False
 		
 		try:
-			# Import Razorpay
-			try:
-				import razorpay
-			except ImportError:
-				frappe.log_error("Razorpay module not available", "Razorpay Import Error")
-				return False
-			
-			# Get Razorpay credentials (same as used in user_portal.py)
-			razorpay_key_id = "rzp_test_RHC1S9293wovjQ"
-			razorpay_key_secret = "DAzu38mqdRSnkgtv83WdWe6O"
-			
-			if not razorpay_key_id or not razorpay_key_secret:
-				frappe.log_error("Razorpay credentials not configured", "Razorpay Config Error")
-				return False
-			
-			# Initialize Razorpay client
-			client = razorpay.Client(auth=(razorpay_key_id, razorpay_key_secret))
+			# Shared Razorpay client
+			client = get_razorpay_client()
 			
 			# Remove the pending cancellation (reactivate)
 			response = client.subscription.update(self.razorpay_subscription_id, {
@@ -367,23 +339,21 @@ def get_available_plans_for_subscription(doctype, txt, searchfield, start, page_
 	if not customer:
 		return []
 	
-	# Get all active plans
-	all_plans = frappe.get_all("BMS Plan",
-		filters={"is_active": 1},
+	visible_plans = get_visible_plans(customer)
+	if not visible_plans:
+		return []
+	
+	available_plans = frappe.get_all("BMS Plan",
+		filters={"name": ["in", list(visible_plans)]},
 		fields=["name", "plan_name"]
 	)
 	
-	available_plans = []
-	
-	for plan in all_plans:
-		plan_doc = frappe.get_doc("BMS Plan", plan.name)
-		if plan_doc.is_available_for_customer(customer):
-			# Check if the plan matches the search text
-			if txt and txt.lower() not in plan.plan_name.lower():
-				continue
-			available_plans.append([plan.name, plan.plan_name])
-	
-	return available_plans
+	# Check if the plan matches the search text
+	return [
+		[plan.name, plan.plan_name]
+		for plan in available_plans
+		if not txt or txt.lower() in plan.plan_name.lower()
+	]
 
 @frappe.whitelist()
 def create_invoice_for_subscription(subscription):
@@ -0,0 +1,194 @@
+import hashlib
+import json
+import time
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import add_days, now
+
+from bms.billing_management_system.doctype.bms_activity_log.bms_activity_log import log_activity
+
+WEBHOOK_DRAIN_BATCH_SIZE = 100
+
+# Deliveries are retried this many times before the event is left as Failed
+WEBHOOK_MAX_ATTEMPTS = 5
+
+# Set while a drain is queued and has not started yet
+WEBHOOK_DRAIN_QUEUED_KEY = "bms:webhook_drain_queued"
+
+# Held by the running drain, so that two drains never process the same events
+WEBHOOK_DRAIN_LOCK_KEY = "bms:webhook_drain_lock"
+
+# Seconds the queued flag and the drain lock live without being refreshed
+WEBHOOK_DRAIN_LOCK_TIMEOUT = 300
+
+# Seconds a new drain waits for the running one to finish
+WEBHOOK_DRAIN_LOCK_WAIT = 60
+
+# Days processed events are kept to recognise redeliveries; Razorpay retries for up to 24 hours
+WEBHOOK_EVENT_TTL_DAYS = 30
+
+WEBHOOK_HANDLERS = {
+	"subscription.charged": "bms.billing_management_system.api.user_portal.handle_subscription_charged",
+	"subscription.completed": "bms.billing_management_system.api.user_portal.handle_subscription_completed",
+	"subscription.cancelled": "bms.billing_management_system.api.user_portal.handle_subscription_cancelled",
+	"subscription.paused": "bms.billing_management_system.api.user_portal.handle_subscription_paused",
+	"subscription.resumed": "bms.billing_management_system.api.user_portal.handle_subscription_resumed"
+}
+
+class BMSWebhookEvent(Document):
+	pass
+
+def store_webhook_event(event, body, event_id=None):
+	"""Persist a verified webhook delivery and wake up the drain job
+	
+	Returns None without storing anything when the event was already received.
+	"""
+	event_id = event_id or hashlib.sha256(body.encode("utf-8")).hexdigest()
+	if frappe.db.exists("BMS Webhook Event", {"event_id": event_id}):
+		return None
+	
+	doc = frappe.get_doc({
+		"doctype": "BMS Webhook Event",
+		"event": event,
+		"event_id": event_id,
+		"payload": body,
+		"status": "Queued",
+		"received_on": now()
+	})
+	try:
+		doc.insert(ignore_permissions=True)
+	except (frappe.DuplicateEntryError, frappe.UniqueValidationError):
+		# A concurrent delivery of the same event won the insert
+		return None
+	
+	log_activity("BMS Webhook Event", doc.name, "received", status="Queued", description=f"Razorpay {event} received")
+	enqueue_webhook_drain()
+	return doc.name
+
+def enqueue_webhook_drain():
+	"""Queue a drain after commit, unless one is already waiting"""
+	frappe.db.after_commit.add(queue_webhook_drain)
+
+def queue_webhook_drain():
+	"""Queue a drain unless one is queued and has not started yet
+	
+	A running drain does not count, as it may be past its last fetch; it
+	clears the flag when it starts.
+	"""
+	if not frappe.cache.set(frappe.cache.make_key(WEBHOOK_DRAIN_QUEUED_KEY), 1, nx=True, ex=WEBHOOK_DRAIN_LOCK_TIMEOUT):
+		return
+	
+	frappe.enqueue(
+		"bms.billing_management_system.doctype.bms_webhook_event.bms_webhook_event.drain_webhook_events",
+		queue="short"
+	)
+
+def enqueue_pending_webhook_events():
+	"""Scheduler safety net: drain events left queued by a failed attempt or a lost job"""
+	if frappe.db.exists("BMS Webhook Event", {"status": "Queued"}):
+		enqueue_webhook_drain()
+
+def drain_webhook_events(batch_size=WEBHOOK_DRAIN_BATCH_SIZE):
+	"""Process queued webhook events in arrival order, one batch at a time, committing after each event
+	
+	Events that fail stay queued for the next drain instead of being retried in this one.
+	"""
+	# Events stored from now on queue another drain
+	frappe.cache.delete(frappe.cache.make_key(WEBHOOK_DRAIN_QUEUED_KEY))
+	
+	if not acquire_drain_lock():
+		# The running drain is still busy; the scheduler safety net picks up what it leaves
+		frappe.logger().info("BMS webhook drain skipped, another drain is running")
+		return 0
+	
+	try:
+		return drain_queued_events(batch_size)
+	finally:
+		frappe.cache.delete(frappe.cache.make_key(WEBHOOK_DRAIN_LOCK_KEY))
+
+def drain_queued_events(batch_size):
+	processed = 0
+	failed = []
+	
+	while True:
+		frappe.cache.expire(frappe.cache.make_key(WEBHOOK_DRAIN_LOCK_KEY), WEBHOOK_DRAIN_LOCK_TIMEOUT)
+		
+		filters = {"status": "Queued"}
+		if failed:
+			filters["name"] = ["not in", failed]
+		
+		events = frappe.get_all("BMS Webhook Event",
+			filters=filters,
+			fields=["name", "event", "payload", "attempts"],
+			order_by="creation asc",
+			limit=batch_size
+		)
+		if not events:
+			break
+		
+		for event in events:
+			if process_webhook_event(event):
+				processed += 1
+			else:
+				failed.append(event.name)
+	
+	if processed:
+		frappe.logger().info(f"Drained {processed} BMS webhook events")
+	
+	return processed
+
+def acquire_drain_lock():
+	"""Take the drain lock with SET NX, waiting up to `WEBHOOK_DRAIN_LOCK_WAIT` for the running drain"""
+	deadline = time.monotonic() + WEBHOOK_DRAIN_LOCK_WAIT
+	
+	while True:
+		if frappe.cache.set(frappe.cache.make_key(WEBHOOK_DRAIN_LOCK_KEY), 1, nx=True, ex=WEBHOOK_DRAIN_LOCK_TIMEOUT):
+			return True
+		if time.monotonic() >= deadline:
+			return False
+		time.sleep(0.5)
+
+def process_webhook_event(event):
+	"""Run the handler of one stored event and record the outcome"""
+	try:
+		handler = WEBHOOK_HANDLERS.get(event.event)
+		if handler:
+			frappe.get_attr(handler)(json.loads(event.payload).get("payload", {}))
+		
+		frappe.db.set_value("BMS Webhook Event", event.name, {
+			"status": "Processed",
+			"attempts": event.attempts + 1,
+			"processed_on": now(),
+			"error": None
+		}, update_modified=False)
+		log_activity("BMS Webhook Event", event.name, "processed", status="Processed",
+			description=f"Razorpay {event.event} processed")
+		frappe.db.commit()
+		return True
+	
+	except Exception:
+		frappe.db.rollback()
+		
+		attempts = event.attempts + 1
+		frappe.db.set_value("BMS Webhook Event", event.name, {
+			"status": "Queued" if attempts < WEBHOOK_MAX_ATTEMPTS else "Failed",
+			"attempts": attempts,
+			"error": frappe.get_traceback()
+		}, update_modified=False)
+		
+		if attempts >= WEBHOOK_MAX_ATTEMPTS:
+			log_activity("BMS Webhook Event", event.name, "failed", status="Failed",
+				description=f"Razorpay {event.event} failed after {attempts} attempts")
+			frappe.log_error(frappe.get_traceback(), f"BMS Webhook Event Failed: {event.name}")
+		
+		frappe.db.commit()
+		
+		return False
+
+def cleanup_webhook_events():
+	"""Delete processed events older than `WEBHOOK_EVENT_TTL_DAYS`; failed events are kept for review"""
+	frappe.db.delete("BMS Webhook Event", {
+		"status": "Processed",
+		"received_on": ["<", add_days(now(), -WEBHOOK_EVENT_TTL_DAYS)]
+	})
@@ -0,0 +1,124 @@
+import time
+
+import frappe
+
+RAZORPAY_SUBSCRIPTION_CACHE_KEY = "bms:razorpay_subscription"
+
+# Razorpay plan and customer ids, keyed by "plan|<plan>|<currency>|<amount>|<period>|<interval>" or "customer|<customer>"
+GATEWAY_ID_CACHE_KEY = "bms:razorpay_ids"
+
+# Seconds a cached gateway id is used without asking the gateway, overridable with bms_gateway_id_ttl
+GATEWAY_ID_TTL = 86400
+
+def get_subscription_for_razorpay_id(razorpay_subscription_id):
+	"""Return the BMS Subscription linked to a Razorpay subscription id, or None"""
+	if not razorpay_subscription_id:
+		return None
+	
+	subscription = frappe.cache.hget(RAZORPAY_SUBSCRIPTION_CACHE_KEY, razorpay_subscription_id)
+	if subscription:
+		return subscription
+	
+	# Misses are not cached, the id may be linked by a later save
+	subscription = frappe.db.get_value("BMS Subscription", {"razorpay_subscription_id": razorpay_subscription_id}, "name")
+	if subscription:
+		frappe.cache.hset(RAZORPAY_SUBSCRIPTION_CACHE_KEY, razorpay_subscription_id, subscription)
+	
+	return subscription
+
+def link_razorpay_subscription(razorpay_subscription_id, subscription):
+	"""Remember which BMS Subscription a Razorpay subscription id belongs to, once the link is committed"""
+	if razorpay_subscription_id:
+		frappe.db.after_commit.add(
+			lambda: frappe.cache.hset(RAZORPAY_SUBSCRIPTION_CACHE_KEY, razorpay_subscription_id, subscription)
+		)
+
+def unlink_razorpay_subscription(razorpay_subscription_id):
+	"""Forget a Razorpay subscription id now and again after commit, so a concurrent lookup cannot restore it"""
+	if razorpay_subscription_id:
+		frappe.cache.hdel(RAZORPAY_SUBSCRIPTION_CACHE_KEY, razorpay_subscription_id)
+		frappe.db.after_commit.add(lambda: frappe.cache.hdel(RAZORPAY_SUBSCRIPTION_CACHE_KEY, razorpay_subscription_id))
+
+def on_subscription_update(doc, method=None):
+	"""BMS Subscription on_update hook: keep the map in step with the linked Razorpay id"""
+	if not doc.has_value_changed("razorpay_subscription_id"):
+		return
+	
+	before = doc.get_doc_before_save()
+	if before:
+		unlink_razorpay_subscription(before.razorpay_subscription_id)
+	link_razorpay_subscription(doc.razorpay_subscription_id, doc.name)
+
+def on_subscription_trash(doc, method=None):
+	"""BMS Subscription on_trash hook"""
+	unlink_razorpay_subscription(doc.razorpay_subscription_id)
+
+def get_plan_id_key(plan, currency, amount, period, interval):
+	"""Cache key of the Razorpay plan for a BMS Plan billed in `currency` at `amount` smallest units every `interval` `period`"""
+	return f"plan|{plan}|{currency}|{amount}|{period}|{interval}"
+
+def get_customer_id_key(customer):
+	return f"customer|{customer}"
+
+def get_gateway_id(key):
+	"""Return a cached Razorpay id, queueing a background check of entries older than the TTL"""
+	entry = frappe.cache.hget(GATEWAY_ID_CACHE_KEY, key)
+	if not entry:
+		return None
+	
+	ttl = frappe.conf.get("bms_gateway_id_ttl") or GATEWAY_ID_TTL
+	if time.time() - entry["verified_on"] > ttl:
+		frappe.enqueue(
+			"bms.billing_management_system.gateway_ids.reconcile_gateway_id",
+			queue="short",
+			job_id=f"bms_reconcile_gateway_id::{key}",
+			deduplicate=True,
+			key=key
+		)
+	
+	return entry["id"]
+
+def set_gateway_id(key, gateway_id):
+	"""Cache a Razorpay id as verified now"""
+	frappe.cache.hset(GATEWAY_ID_CACHE_KEY, key, {"id": gateway_id, "verified_on": time.time()})
+
+def forget_gateway_id(key):
+	frappe.cache.hdel(GATEWAY_ID_CACHE_KEY, key)
+
+def save_gateway_id(doctype, name, fieldname, gateway_id):
+	"""Store a new Razorpay id on its document from a background job, so the checkout request does not commit"""
+	frappe.enqueue(
+		"bms.billing_management_system.gateway_ids.store_gateway_id",
+		queue="short",
+		doctype=doctype,
+		name=name,
+		fieldname=fieldname,
+		gateway_id=gateway_id
+	)
+
+def store_gateway_id(doctype, name, fieldname, gateway_id):
+	frappe.db.set_value(doctype, name, fieldname, gateway_id, update_modified=False)
+
+def reconcile_gateway_id(key):
+	"""Background job: check a cached Razorpay id still exists, dropping it when the gateway no longer knows it"""
+	from bms.billing_management_system.razorpay_client import get_razorpay_client, razorpay
+	
+	entry = frappe.cache.hget(GATEWAY_ID_CACHE_KEY, key)
+	if not entry:
+		return
+	
+	client = get_razorpay_client()
+	kind = key.split("|", 1)[0]
+	
+	try:
+		if kind == "plan":
+			client.plan.fetch(entry["id"])
+		else:
+			client.customer.fetch(entry["id"])
+	except razorpay.errors.BadRequestError:
+		# Unknown id: the next checkout looks it up again or creates a new one
+		forget_gateway_id(key)
+		frappe.logger().info(f"Dropped stale Razorpay id {entry['id']} for {key}")
+		return
+	
+	set_gateway_id(key, entry["id"])
@@ -0,0 +1,103 @@
+import frappe
+
+# Composite indexes backing the scheduler, dashboard and portal queries
+COMPOSITE_INDEXES = {
+	"BMS Subscription": [
+		["status", "end_date"],
+		["customer", "status"],
+		["customer", "creation"],
+		["status", "auto_renewal", "next_billing_date"]
+	],
+	"BMS Invoice": [
+		["status", "due_date"],
+		["customer", "status"],
+		["customer", "creation"]
+	],
+	"BMS Payment": [
+		["customer", "status", "payment_type"],
+		["customer", "creation"],
+		["subscription", "status"],
+		["status", "payment_type", "payment_date"]
+	],
+	"BMS Activity Log": [
+		["customer", "timestamp"]
+	]
+}
+
+UNIQUE_INDEXES = {
+	"BMS Payment": [
+		["razorpay_payment_id"]
+	]
+}
+
+# Queries that must be served by an index, checked with EXPLAIN by `check_index_usage`
+INDEX_CHECKS = {
+	"expire_subscriptions": ("BMS Subscription", "status = 'Active' AND end_date < CURDATE()"),
+	"upcoming_renewals": ("BMS Subscription", "status = 'Active' AND auto_renewal = 1 AND next_billing_date <= CURDATE()"),
+	"customer_subscriptions": ("BMS Subscription", "customer = 'CUST-0001' AND status = 'Active'"),
+	"customer_subscription_page": ("BMS Subscription", "customer = 'CUST-0001' ORDER BY creation DESC, name DESC LIMIT 21"),
+	"razorpay_subscription": ("BMS Subscription", "razorpay_subscription_id = 'sub_0001'"),
+	"overdue_invoices": ("BMS Invoice", "status = 'Sent' AND due_date < CURDATE()"),
+	"customer_invoices": ("BMS Invoice", "customer = 'CUST-0001' AND status = 'Overdue'"),
+	"customer_invoice_page": ("BMS Invoice", "customer = 'CUST-0001' ORDER BY creation DESC, name DESC LIMIT 21"),
+	"customer_payments": ("BMS Payment", "customer = 'CUST-0001' AND status = 'Completed' AND payment_type = 'Payment'"),
+	"customer_payment_page": ("BMS Payment", "customer = 'CUST-0001' ORDER BY creation DESC, name DESC LIMIT 21"),
+	"subscription_payments": ("BMS Payment", "subscription = 'SUB-0001' AND status = 'Completed'"),
+	"razorpay_payment": ("BMS Payment", "razorpay_payment_id = 'pay_0001'"),
+	"activity_feed": ("BMS Activity Log", "1 = 1 ORDER BY timestamp DESC, name DESC LIMIT 21"),
+	"customer_activity": ("BMS Activity Log", "customer = 'CUST-0001' ORDER BY timestamp DESC, name DESC LIMIT 21"),
+	"customer_by_email": ("BMS Customer", "email = 'customer@example.com'")
+}
+
+def ensure_indexes():
+	"""Create the BMS composite and unique indexes that are missing, safe to run on every migrate"""
+	for doctype, indexes in COMPOSITE_INDEXES.items():
+		for fields in indexes:
+			add_index(doctype, fields)
+	
+	for doctype, indexes in UNIQUE_INDEXES.items():
+		for fields in indexes:
+			add_index(doctype, fields, unique=True)
+
+def add_index(doctype, fields, unique=False):
+	"""Add one index unless an index of the same name already exists"""
+	index_name = get_index_name(fields, unique)
+	if frappe.db.has_index(f"tab{doctype}", index_name):
+		return
+	
+	try:
+		if unique:
+			frappe.db.add_unique(doctype, fields, constraint_name=index_name)
+		else:
+			frappe.db.add_index(doctype, fields, index_name=index_name)
+		
+		frappe.logger().info(f"Added index {index_name} on {doctype}")
+	
+	except Exception:
+		# Existing duplicate values prevent a unique index; keep migrating and report it
+		frappe.log_error(frappe.get_traceback(), f"BMS Index Error: {doctype} {index_name}")
+
+def get_index_name(fields, unique=False):
+	return ("bms_unique_" if unique else "bms_") + "_".join(fields)
+
+def check_index_usage():
+	"""EXPLAIN the hot BMS queries and report the index each one uses
+	
+	Run with `bench --site <site> execute bms.billing_management_system.indexes.check_index_usage`.
+	"""
+	report = {}
+	
+	for check, (doctype, conditions) in INDEX_CHECKS.items():
+		plan = frappe.db.sql(f"EXPLAIN SELECT name FROM `tab{doctype}` WHERE {conditions}", as_dict=True)[0]
+		report[check] = {
+			"doctype": doctype,
+			"key": plan.get("key"),
+			"possible_keys": plan.get("possible_keys"),
+			"rows": plan.get("rows"),
+			"uses_index": bool(plan.get("key"))
+		}
+		
+		if not plan.get("key"):
+			frappe.logger().warning(f"BMS query {check} on {doctype} does not use an index")
+	
+	return report
@@ -0,0 +1,142 @@
+import frappe
+from frappe.utils import flt, getdate, now
+
+# Documents tracked in BMS Metrics: the date that decides the period and the amount that is summed
+METRIC_DOCTYPES = {
+	"BMS Subscription": {"date_field": "start_date", "amount_field": None},
+	"BMS Invoice": {"date_field": "invoice_date", "amount_field": "amount"},
+	"BMS Payment": {"date_field": "payment_date", "amount_field": "amount"}
+}
+
+def on_document_insert(doc, method=None):
+	"""after_insert hook: count a new document"""
+	apply_metric_deltas(get_document_deltas(doc.doctype, None, doc))
+
+def on_document_update(doc, method=None):
+	"""on_update hook: move a changed document between metric buckets"""
+	# Inserts also run on_update, but are already counted by after_insert
+	if doc.flags.in_insert:
+		return
+	
+	before = doc.get_doc_before_save()
+	if not before:
+		return
+	
+	apply_metric_deltas(get_document_deltas(doc.doctype, before, doc))
+
+def on_document_trash(doc, method=None):
+	"""on_trash hook: remove a deleted document from its bucket"""
+	apply_metric_deltas(get_document_deltas(doc.doctype, doc, None))
+
+def record_bulk_status_change(doctype, rows, new_status):
+	"""Update metrics for rows whose status was changed without saving the documents
+	
+	Each row must carry the fields used by `get_metric_key`, with `status`
+	holding the status before the change.
+	"""
+	deltas = {}
+	for row in rows:
+		after = frappe._dict(row)
+		after.status = new_status
+		merge_deltas(deltas, get_document_deltas(doctype, row, after))
+	
+	apply_metric_deltas(deltas)
+
+def get_document_deltas(doctype, before, after):
+	"""Return {metric key: [count delta, amount delta]} for a document going from `before` to `after`"""
+	deltas = {}
+	
+	if before:
+		key, amount = get_metric_key(doctype, before)
+		merge_deltas(deltas, {key: [-1, -amount]})
+	
+	if after:
+		key, amount = get_metric_key(doctype, after)
+		merge_deltas(deltas, {key: [1, amount]})
+	
+	return {key: delta for key, delta in deltas.items() if delta[0] or delta[1]}
+
+def get_metric_key(doctype, row):
+	"""Return the metric bucket of a document and the amount it contributes"""
+	config = METRIC_DOCTYPES[doctype]
+	date = row.get(config["date_field"])
+	
+	key = (
+		doctype,
+		row.get("status") or "",
+		row.get("payment_type") or "",
+		row.get("currency") or "",
+		getdate(date).strftime("%Y-%m") if date else ""
+	)
+	amount = flt(row.get(config["amount_field"])) if config["amount_field"] else 0
+	
+	return key, amount
+
+def merge_deltas(deltas, other):
+	for key, (count, amount) in other.items():
+		current = deltas.setdefault(key, [0, 0])
+		current[0] += count
+		current[1] += amount
+
+def apply_metric_deltas(deltas):
+	"""Atomically add the deltas to their BMS Metrics rows, creating missing rows"""
+	timestamp = now()
+	
+	for (doctype, status, payment_type, currency, period), (count, amount) in deltas.items():
+		frappe.db.sql("""
+			INSERT INTO `tabBMS Metrics`
+				(name, creation, modified, modified_by, owner, docstatus, idx,
+				metric_doctype, status, payment_type, currency, period, record_count, total_amount)
+			VALUES (%(name)s, %(now)s, %(now)s, 'Administrator', 'Administrator', 0, 0,
+				%(doctype)s, %(status)s, %(payment_type)s, %(currency)s, %(period)s, %(count)s, %(amount)s)
+			ON DUPLICATE KEY UPDATE
+				record_count = record_count + VALUES(record_count),
+				total_amount = total_amount + VALUES(total_amount),
+				modified = VALUES(modified)
+		""", {
+			"name": "|".join([doctype, status, payment_type, currency, period]),
+			"now": timestamp,
+			"doctype": doctype,
+			"status": status,
+			"payment_type": payment_type,
+			"currency": currency or None,
+			"period": period,
+			"count": count,
+			"amount": amount
+		})
+
+def rebuild_metrics():
+	"""Recompute BMS Metrics from the ledgers, e.g. for the initial backfill"""
+	frappe.db.delete("BMS Metrics")
+	
+	for doctype, config in METRIC_DOCTYPES.items():
+		payment_type = "payment_type" if doctype == "BMS Payment" else "''"
+		amount = f"SUM(`{config['amount_field']}`)" if config["amount_field"] else "0"
+		
+		rows = frappe.db.sql(f"""
+			SELECT status, {payment_type} AS payment_type, currency,
+				DATE_FORMAT(`{config['date_field']}`, '%Y-%m') AS period,
+				COUNT(*) AS record_count, {amount} AS total_amount
+			FROM `tab{doctype}`
+			GROUP BY status, {payment_type}, currency, period
+		""", as_dict=True)
+		
+		apply_metric_deltas({
+			(doctype, row.status or "", row.payment_type or "", row.currency or "", row.period or ""):
+				[row.record_count, flt(row.total_amount)]
+			for row in rows
+		})
+
+def get_metric_rows(doctype, **filters):
+	"""Return the precomputed metric rows of a doctype"""
+	return frappe.get_all("BMS Metrics",
+		filters={"metric_doctype": doctype, **filters},
+		fields=["status", "payment_type", "currency", "period", "record_count", "total_amount"]
+	)
+
+def get_status_counts(doctype):
+	"""Return {status: count} for a doctype from BMS Metrics"""
+	counts = {}
+	for row in get_metric_rows(doctype):
+		counts[row.status] = counts.get(row.status, 0) + row.record_count
+	return counts
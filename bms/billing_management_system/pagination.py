@@ -0,0 +1,99 @@
+import base64
+import json
+
+import frappe
+from frappe import _
+from frappe.query_builder import Order
+from frappe.utils import cint
+
+from bms.billing_management_system.aggregates import apply_filters
+
+DEFAULT_PAGE_SIZE = 20
+
+# Upper bound on rows per page, whatever the client asks for
+MAX_PAGE_SIZE = 100
+
+# Fields a client may request from the paginated list endpoints
+LIST_FIELDS = {
+	"BMS Subscription": (
+		"name", "customer", "customer_name", "plan", "plan_name", "status", "start_date", "end_date",
+		"amount", "currency", "billing_cycle", "next_billing_date", "auto_renewal",
+		"cancellation_date", "cancellation_reason", "creation"
+	),
+	"BMS Invoice": (
+		"name", "customer", "customer_name", "subscription", "plan", "plan_name", "amount", "tax_amount",
+		"total_amount", "currency", "invoice_date", "due_date", "status", "creation"
+	),
+	"BMS Payment": (
+		"name", "customer", "customer_name", "subscription", "plan", "invoice", "amount", "currency",
+		"payment_date", "payment_method", "status", "payment_type", "creation"
+	),
+	"BMS Activity Log": (
+		"name", "timestamp", "activity_type", "action", "status", "customer",
+		"reference_doctype", "reference_name", "amount", "currency", "description"
+	)
+}
+
+def get_page(doctype, filters, fields, cursor=None, page_size=None, sort_field="creation", ascending=False):
+	"""Return one page of rows, newest first unless `ascending`, as {"data", "next_cursor"}
+	
+	Pages are keyed on (sort_field, name) rather than an offset, so every page
+	costs the same index range scan however deep into the history it is.
+	`next_cursor` is None on the last page.
+	"""
+	page_size = get_page_size(page_size)
+	fields = get_list_fields(doctype, fields, sort_field)
+	order = Order.asc if ascending else Order.desc
+	
+	table = frappe.qb.DocType(doctype)
+	query = apply_filters(frappe.qb.from_(table).select(*[table[field] for field in fields]), table, filters)
+	
+	if cursor:
+		value, name = decode_cursor(cursor)
+		if ascending:
+			query = query.where(
+				(table[sort_field] > value) | ((table[sort_field] == value) & (table.name > name))
+			)
+		else:
+			query = query.where(
+				(table[sort_field] < value) | ((table[sort_field] == value) & (table.name < name))
+			)
+	
+	# One extra row tells whether another page follows
+	rows = (
+		query.orderby(table[sort_field], order=order)
+		.orderby(table.name, order=order)
+		.limit(page_size + 1)
+		.run(as_dict=True)
+	)
+	
+	next_cursor = None
+	if len(rows) > page_size:
+		rows = rows[:page_size]
+		next_cursor = encode_cursor(rows[-1][sort_field], rows[-1].name)
+	
+	return frappe._dict(data=rows, next_cursor=next_cursor)
+
+def get_page_size(page_size=None):
+	"""Clamp a requested page size to 1..`MAX_PAGE_SIZE`"""
+	return min(max(cint(page_size) or DEFAULT_PAGE_SIZE, 1), MAX_PAGE_SIZE)
+
+def get_list_fields(doctype, fields, sort_field="creation"):
+	"""Validate a client field list, which may arrive as JSON, adding the cursor columns"""
+	fields = frappe.parse_json(fields) if isinstance(fields, str) else list(fields)
+	
+	invalid = [field for field in fields if field not in LIST_FIELDS[doctype]]
+	if invalid:
+		frappe.throw(_("Fields not allowed for {0}: {1}").format(doctype, ", ".join(map(str, invalid))))
+	
+	return list(dict.fromkeys(["name", *fields, sort_field]))
+
+def encode_cursor(value, name):
+	return base64.urlsafe_b64encode(json.dumps([str(value), name]).encode()).decode()
+
+def decode_cursor(cursor):
+	try:
+		value, name = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+		return value, name
+	except Exception:
+		frappe.throw(_("Invalid cursor"))
@@ -1,17 +1,28 @@
 import frappe
 from frappe import _
 
+from bms.billing_management_system.cache import get_cached_value
+
+# Shared cache hash of the customer linked to each user
+CUSTOMER_CACHE_KEY = "bms_customer_for_user"
+
+# Prefix of the per-user cached roles
+ROLES_CACHE_KEY = "bms_user_roles"
+
+# Seconds roles are cached; role changes that do not save the User are picked up after this
+ROLES_CACHE_TTL = 300
+
 def get_subscription_permission_query_conditions(user):
 	"""Get permission query conditions for BMS Subscription"""
 	if not user:
 		user = frappe.session.user
 	
 	# Admin can see all subscriptions
-	if "BMS Admin" in frappe.get_roles(user):
+	if "BMS Admin" in get_user_roles(user):
 		return ""
 	
 	# User can only see their own subscriptions
-	if "BMS User" in frappe.get_roles(user):
+	if "BMS User" in get_user_roles(user):
 		# Get customer linked to this user
 		customer = get_customer_for_user(user)
 		if customer:
@@ -25,11 +36,11 @@ def get_invoice_permission_query_conditions(user):
 		user = frappe.session.user
 	
 	# Admin can see all invoices
-	if "BMS Admin" in frappe.get_roles(user):
+	if "BMS Admin" in get_user_roles(user):
 		return ""
 	
 	# User can only see their own invoices
-	if "BMS User" in frappe.get_roles(user):
+	if "BMS User" in get_user_roles(user):
 		customer = get_customer_for_user(user)
 		if customer:
 			return f"`tabBMS Invoice`.customer = '{customer}'"
@@ -42,11 +53,11 @@ def get_payment_permission_query_conditions(user):
 		user = frappe.session.user
 	
 	# Admin can see all payments
-	if "BMS Admin" in frappe.get_roles(user):
+	if "BMS Admin" in get_user_roles(user):
 		return ""
 	
 	# User can only see their own payments
-	if "BMS User" in frappe.get_roles(user):
+	if "BMS User" in get_user_roles(user):
 		customer = get_customer_for_user(user)
 		if customer:
 			return f"`tabBMS Payment`.customer = '{customer}'"
@@ -59,11 +70,11 @@ def has_subscription_permission(doc, ptype, user=None):
 		user = frappe.session.user
 	
 	# Admin has all permissions
-	if "BMS Admin" in frappe.get_roles(user):
+	if "BMS Admin" in get_user_roles(user):
 		return True
 	
 	# User can only access their own subscriptions
-	if "BMS User" in frappe.get_roles(user):
+	if "BMS User" in get_user_roles(user):
 		customer = get_customer_for_user(user)
 		if customer and doc.customer == customer:
 			# User can read and write their own subscriptions
@@ -77,11 +88,11 @@ def has_invoice_permission(doc, ptype, user=None):
 		user = frappe.session.user
 	
 	# Admin has all permissions
-	if "BMS Admin" in frappe.get_roles(user):
+	if "BMS Admin" in get_user_roles(user):
 		return True
 	
 	# User can only read their own invoices
-	if "BMS User" in frappe.get_roles(user):
+	if "BMS User" in get_user_roles(user):
 		customer = get_customer_for_user(user)
 		if customer and doc.customer == customer:
 			return ptype == "read"
@@ -94,11 +105,11 @@ def has_payment_permission(doc, ptype, user=None):
 		user = frappe.session.user
 	
 	# Admin has all permissions
-	if "BMS Admin" in frappe.get_roles(user):
+	if "BMS Admin" in get_user_roles(user):
 		return True
 	
 	# User can only read their own payments
-	if "BMS User" in frappe.get_roles(user):
+	if "BMS User" in get_user_roles(user):
 		customer = get_customer_for_user(user)
 		if customer and doc.customer == customer:
 			return ptype == "read"
@@ -106,8 +117,48 @@ def has_payment_permission(doc, ptype, user=None):
 	return False
 
 def get_customer_for_user(user):
-	"""Get customer linked to user"""
-	# This assumes there's a link between User and BMS Customer
-	# You might need to modify this based on your user-customer relationship
-	customer = frappe.db.get_value("BMS Customer", {"email": user}, "name")
-	return customer
+	"""Get customer linked to user
+
+	The lookup is memoized for the current request and kept in the shared
+	cache (including "no customer") until `clear_user_cache` is called.
+	"""
+	customers = _get_request_cache("bms_customer_for_user")
+	if user not in customers:
+		customer = frappe.cache.hget(CUSTOMER_CACHE_KEY, user)
+		if customer is None:
+			# This assumes there's a link between User and BMS Customer
+			# You might need to modify this based on your user-customer relationship
+			customer = frappe.db.get_value("BMS Customer", {"email": user}, "name") or ""
+			frappe.cache.hset(CUSTOMER_CACHE_KEY, user, customer)
+		customers[user] = customer or None
+	
+	return customers[user]
+
+def get_user_roles(user):
+	"""Get roles of user, memoized for the current request and kept in the shared cache for `ROLES_CACHE_TTL`"""
+	roles = _get_request_cache("bms_user_roles")
+	if user not in roles:
+		roles[user] = set(get_cached_value(get_roles_key(user), lambda: frappe.get_roles(user), ROLES_CACHE_TTL))
+	
+	return roles[user]
+
+def clear_user_cache(user):
+	"""Forget the cached customer and roles of user"""
+	frappe.cache.hdel(CUSTOMER_CACHE_KEY, user)
+	frappe.cache.delete_value(get_roles_key(user))
+	
+	for key in ("bms_customer_for_user", "bms_user_roles"):
+		_get_request_cache(key).pop(user, None)
+
+def get_roles_key(user):
+	return f"{ROLES_CACHE_KEY}:{user}"
+
+def on_user_update(doc, method=None):
+	"""User hook: roles may have been assigned or removed"""
+	clear_user_cache(doc.name)
+
+def _get_request_cache(key):
+	"""Dict stored on frappe.local, which is reset for every request"""
+	if not hasattr(frappe.local, key):
+		setattr(frappe.local, key, {})
+	return getattr(frappe.local, key)
@@ -0,0 +1,152 @@
+import re
+import time
+
+import frappe
+import requests
+from frappe import _
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Optional Razorpay import
+try:
+	import razorpay
+	RAZORPAY_AVAILABLE = True
+except ImportError:
+	RAZORPAY_AVAILABLE = False
+	razorpay = None
+
+# Connection policy defaults, overridable from site config
+RAZORPAY_CONNECT_TIMEOUT = 5
+RAZORPAY_READ_TIMEOUT = 20
+RAZORPAY_MAX_RETRIES = 3
+RAZORPAY_BACKOFF_FACTOR = 0.5
+RAZORPAY_POOL_SIZE = 10
+
+# Responses retried for idempotent requests; 429 honours Retry-After
+RAZORPAY_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+RAZORPAY_LATENCY_CACHE_KEY = "bms:razorpay_latency"
+
+# One client per credentials and policy, shared by every request the worker serves
+_clients = {}
+
+class RazorpaySession(requests.Session):
+	"""requests session with a default timeout that records the latency of every call"""
+	def __init__(self, timeout):
+		super().__init__()
+		self.timeout = timeout
+	
+	def request(self, method, url, **kwargs):
+		kwargs.setdefault("timeout", self.timeout)
+		started = time.monotonic()
+		failed = True
+		
+		try:
+			response = super().request(method, url, **kwargs)
+			failed = response.status_code >= 500
+			return response
+		finally:
+			record_latency(method, url, time.monotonic() - started, failed)
+
+def get_razorpay_credentials():
+	"""Return (key id, key secret) from site config"""
+	key_id = frappe.conf.get("razorpay_key_id")
+	key_secret = frappe.conf.get("razorpay_key_secret")
+	
+	if not key_id or not key_secret:
+		frappe.throw(
+			_("Razorpay is not configured. Set razorpay_key_id and razorpay_key_secret in site_config.json"),
+			title=_("Razorpay Configuration Error")
+		)
+	
+	return key_id, key_secret
+
+def get_razorpay_client(base_url=None):
+	"""Return the process-wide Razorpay client for the current site's credentials
+	
+	The client keeps its HTTP connections alive between calls, applies the
+	connect/read timeouts to every request and retries idempotent requests on
+	connection errors, 429 and 5xx with exponential backoff. `base_url` (or the
+	`bms_razorpay_base_url` site config) points the client at a stub server.
+	"""
+	if not RAZORPAY_AVAILABLE:
+		frappe.throw(_("Razorpay module not installed. Please install it with: pip install razorpay"))
+	
+	key_id, key_secret = get_razorpay_credentials()
+	base_url = base_url or frappe.conf.get("bms_razorpay_base_url")
+	timeout = (
+		frappe.conf.get("bms_razorpay_connect_timeout") or RAZORPAY_CONNECT_TIMEOUT,
+		frappe.conf.get("bms_razorpay_read_timeout") or RAZORPAY_READ_TIMEOUT
+	)
+	max_retries = frappe.conf.get("bms_razorpay_max_retries")
+	if max_retries is None:
+		max_retries = RAZORPAY_MAX_RETRIES
+	
+	client_key = (key_id, key_secret, base_url, timeout, max_retries)
+	if client_key not in _clients:
+		_clients[client_key] = build_razorpay_client(key_id, key_secret, base_url, timeout, max_retries)
+	
+	return _clients[client_key]
+
+def build_razorpay_client(key_id, key_secret, base_url, timeout, max_retries):
+	session = RazorpaySession(timeout)
+	adapter = HTTPAdapter(
+		pool_connections=RAZORPAY_POOL_SIZE,
+		pool_maxsize=RAZORPAY_POOL_SIZE,
+		max_retries=Retry(
+			total=max_retries,
+			backoff_factor=RAZORPAY_BACKOFF_FACTOR,
+			status_forcelist=RAZORPAY_RETRY_STATUSES,
+			respect_retry_after_header=True,
+			raise_on_status=False
+		)
+	)
+	session.mount("https://", adapter)
+	session.mount("http://", adapter)
+	
+	options = {"base_url": base_url} if base_url else {}
+	return razorpay.Client(session=session, auth=(key_id, key_secret), **options)
+
+def record_latency(method, url, seconds, failed=False):
+	"""Add one call to the per-endpoint latency counters"""
+	try:
+		endpoint = get_endpoint_name(method, url)
+		key = frappe.cache.make_key(RAZORPAY_LATENCY_CACHE_KEY)
+		
+		pipeline = frappe.cache.pipeline()
+		pipeline.hincrby(key, f"{endpoint}|count", 1)
+		pipeline.hincrbyfloat(key, f"{endpoint}|seconds", seconds)
+		if failed:
+			pipeline.hincrby(key, f"{endpoint}|errors", 1)
+		pipeline.execute()
+		
+		frappe.logger().debug(f"Razorpay {endpoint} took {seconds * 1000:.0f}ms")
+	
+	except Exception:
+		# Metrics must never break a payment call
+		pass
+
+def get_endpoint_name(method, url):
+	"""Name an endpoint without its ids, e.g. "POST /v1/subscriptions/:id/cancel" """
+	path = re.sub(r"^https?://[^/]+", "", url).split("?")[0]
+	return f"{method.upper()} {re.sub(r'/[a-z]+_[A-Za-z0-9]+', '/:id', path)}"
+
+def get_razorpay_latency_metrics():
+	"""Return {endpoint: {"count", "errors", "avg_ms"}} for the calls made since the last reset"""
+	# Read through a raw pipeline; RedisWrapper.hgetall would try to unpickle the counters
+	pipeline = frappe.cache.pipeline()
+	pipeline.hgetall(frappe.cache.make_key(RAZORPAY_LATENCY_CACHE_KEY))
+	raw = pipeline.execute()[0]
+	metrics = {}
+	
+	for field, value in raw.items():
+		endpoint, metric = frappe.safe_decode(field).rsplit("|", 1)
+		metrics.setdefault(endpoint, {"count": 0, "errors": 0, "seconds": 0.0})[metric] = float(value)
+	
+	for endpoint, values in metrics.items():
+		values["avg_ms"] = values["seconds"] * 1000 / values["count"] if values["count"] else 0
+	
+	return metrics
+
+def reset_razorpay_latency_metrics():
+	frappe.cache.delete(frappe.cache.make_key(RAZORPAY_LATENCY_CACHE_KEY))
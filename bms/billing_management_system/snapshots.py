@@ -0,0 +1,46 @@
+import frappe
+from frappe import _
+
+from bms.billing_management_system.cache import delete_cached_values, get_cached_value
+
+# Seconds a snapshot is cached, in case an invalidation is missed
+SNAPSHOT_TTL = 3600
+
+# Lightweight fields copied from linked documents, cached so validate does not load full documents
+SNAPSHOT_FIELDS = {
+	"BMS Plan": [
+		"name", "plan_name", "amount", "currency", "billing_cycle",
+		"auto_renewal", "trial_period_days", "plan_visibility", "is_active"
+	],
+	"BMS Customer": ["name", "customer_name", "email", "status"]
+}
+
+def get_snapshot_key(doctype, name):
+	return f"bms:snapshot:{doctype}:{name}"
+
+def get_snapshot(doctype, name):
+	"""Return the cached snapshot of a BMS Plan or BMS Customer, reading through to the database on a miss"""
+	snapshot = get_cached_value(
+		get_snapshot_key(doctype, name),
+		lambda: frappe.db.get_value(doctype, name, SNAPSHOT_FIELDS[doctype], as_dict=True),
+		SNAPSHOT_TTL
+	)
+	
+	if not snapshot:
+		frappe.throw(_("{0} {1} not found").format(_(doctype), name), frappe.DoesNotExistError)
+	
+	return snapshot
+
+def get_plan_snapshot(plan):
+	return get_snapshot("BMS Plan", plan)
+
+def get_customer_snapshot(customer):
+	return get_snapshot("BMS Customer", customer)
+
+def clear_snapshot(doc, method=None):
+	"""on_update/on_trash hook: drop the cached snapshot of the document"""
+	delete_cached_values(get_snapshot_key(doc.doctype, doc.name))
+
+def clear_renamed_snapshot(doc, method=None, old=None, new=None, merge=False):
+	"""after_rename hook: drop the snapshots cached under the old and new name"""
+	delete_cached_values(get_snapshot_key(doc.doctype, old), get_snapshot_key(doc.doctype, new))
@@ -1,10 +1,54 @@
 import frappe
 from frappe import _
-from frappe.utils import today, add_days, get_datetime
+from frappe.utils import today, add_days, get_datetime, cint, getdate
 from datetime import datetime, timedelta
+import json
+import time
+
+from bms.billing_management_system.doctype.bms_activity_log.bms_activity_log import log_bulk_status_change
+from bms.billing_management_system.doctype.bms_job_checkpoint.bms_job_checkpoint import (
+	advance_checkpoint,
+	complete_checkpoint,
+	get_checkpoint,
+	start_checkpoint,
+)
+from bms.billing_management_system.aggregates import count_by_status, get_total_amount
+from bms.billing_management_system.customer_dashboard import clear_customer_dashboards
+from bms.billing_management_system.metrics import record_bulk_status_change
+
+# Number of subscriptions flipped to "Expired" per UPDATE statement
+EXPIRY_CHUNK_SIZE = 1000
+
+# Number of invoices moved to "Overdue" per UPDATE statement
+OVERDUE_CHUNK_SIZE = 1000
+
+# Customers notified per queued overdue notification job
+OVERDUE_NOTIFICATION_BATCH_SIZE = 200
+
+# Subscriptions renewed between two checkpoint commits
+RENEWAL_BATCH_SIZE = 500
+
+# Phases of the nightly billing run, in the order they must complete
+DAILY_PHASES = ["check_expired_subscriptions", "check_overdue_invoices", "process_auto_renewals"]
+
+# Sharded runner defaults, overridable from site config
+DAILY_SHARD_SIZE = 5000
+DAILY_MAX_PARALLEL_SHARDS = 4
+DAILY_SHARD_TIMEOUT = 3600
+DAILY_RUN_STATE_TTL = 86400
+
+# Seconds past DAILY_SHARD_TIMEOUT before the watchdog gives up on a shard that never completed
+DAILY_SHARD_GRACE = 600
+
+# [run_id, phase_index] of the sharded daily run in progress
+DAILY_RUN_CURRENT_KEY = "bms:daily_run:current"
 
 def daily_tasks():
 	"""Daily scheduled tasks for BMS"""
+	if frappe.conf.get("bms_sharded_daily_tasks"):
+		run_daily_tasks_sharded()
+		return
+	
 	check_expired_subscriptions()
 	check_overdue_invoices()
 	process_auto_renewals()
@@ -14,82 +58,490 @@ def monthly_tasks():
 	generate_monthly_reports()
 	cleanup_old_data()
 
-def check_expired_subscriptions():
-	"""Check for expired subscriptions and update their status"""
+def run_daily_tasks_sharded():
+	"""Run the daily phases as name-range shards on the long queue
+
+	Each phase's candidate set is split into shards of `bms_daily_shard_size`
+	rows. At most `bms_daily_max_parallel_shards` shards of a phase run at a
+	time, and the next phase only starts once every shard of the current
+	one has finished.
+	"""
+	run_id = frappe.generate_hash(length=10)
+	frappe.logger().info(f"Starting sharded daily run {run_id}")
+	clear_orphaned_renewal_checkpoints()
+	start_daily_phase(run_id, 0)
+
+def start_daily_phase(run_id, phase_index):
+	"""Split a daily phase into shards and dispatch the first batch of them"""
+	if phase_index >= len(DAILY_PHASES):
+		frappe.cache.delete_value(DAILY_RUN_CURRENT_KEY)
+		frappe.logger().info(f"Sharded daily run {run_id} completed")
+		return
+	
+	phase = DAILY_PHASES[phase_index]
+	doctype, filters = get_daily_phase_candidates(phase)
+	shard_size = cint(frappe.conf.get("bms_daily_shard_size")) or DAILY_SHARD_SIZE
+	max_parallel = cint(frappe.conf.get("bms_daily_max_parallel_shards")) or DAILY_MAX_PARALLEL_SHARDS
+	
+	shards = get_shard_ranges(doctype, filters, shard_size)
+	
+	pending_key = _daily_run_key(run_id, phase_index, "pending")
+	remaining_key = _daily_run_key(run_id, phase_index, "remaining")
+	
+	for after, upto in shards:
+		frappe.cache.rpush(pending_key, json.dumps([after, upto]))
+	frappe.cache.expire(frappe.cache.make_key(pending_key), DAILY_RUN_STATE_TTL)
+	frappe.cache.set(frappe.cache.make_key(remaining_key), len(shards), ex=DAILY_RUN_STATE_TTL)
+	frappe.cache.set_value(DAILY_RUN_CURRENT_KEY, [run_id, phase_index], expires_in_sec=DAILY_RUN_STATE_TTL)
+	
+	frappe.logger().info(f"Daily run {run_id}: {phase} split into {len(shards)} shards of up to {shard_size} rows")
+	
+	for _ in range(min(max_parallel, len(shards))):
+		dispatch_next_daily_shard(run_id, phase_index)
+
+def dispatch_next_daily_shard(run_id, phase_index):
+	"""Enqueue the next pending shard of a phase, if any is left"""
+	shard = frappe.cache.lpop(_daily_run_key(run_id, phase_index, "pending"))
+	if not shard:
+		return
+	
+	after, upto = json.loads(shard)
+	mark_daily_shard_inflight(run_id, phase_index, after, upto)
+	frappe.enqueue(
+		"bms.billing_management_system.tasks.run_daily_shard",
+		queue="long",
+		timeout=DAILY_SHARD_TIMEOUT,
+		run_id=run_id,
+		phase_index=phase_index,
+		after=after,
+		upto=upto
+	)
+
+def run_daily_shard(run_id, phase_index, after=None, upto=None):
+	"""Run one phase of the daily tasks for the names in (after, upto]"""
+	phase = DAILY_PHASES[phase_index]
+	# Overdue notifications are held per run, so each customer is notified once across shards
+	run_args = {"run_id": run_id} if phase == "check_overdue_invoices" else {}
+	
+	if not mark_daily_shard_inflight(run_id, phase_index, after, upto, started=True):
+		frappe.logger().info(f"Daily run {run_id}: {phase} shard ({after}, {upto}] was released by the watchdog, skipping")
+		return
+	
 	try:
-		# Get subscriptions that have expired
-		expired_subscriptions = frappe.get_all("BMS Subscription",
-			filters={
-				"status": "Active",
-				"end_date": ["<", today()]
-			},
-			fields=["name", "customer", "plan", "status"]
+		get_daily_phase_method(phase)(after=after, upto=upto, **run_args)
+		# The next phase must see this shard's writes
+		frappe.db.commit()
+	except Exception as e:
+		frappe.db.rollback()
+		frappe.logger().error(f"Daily run {run_id}: {phase} shard ({after}, {upto}] failed: {str(e)}")
+	finally:
+		complete_daily_shard(run_id, phase_index, after, upto)
+
+def complete_daily_shard(run_id, phase_index, after=None, upto=None):
+	"""Completion barrier: keep the phase saturated and start the next one once it drains
+	
+	A shard is counted once, by whichever of its job and the watchdog gets
+	to remove it from the in-flight set first.
+	"""
+	if not frappe.cache.zrem(_inflight_key(run_id, phase_index), _shard_member(after, upto)):
+		return
+	
+	remaining = frappe.cache.decr(frappe.cache.make_key(_daily_run_key(run_id, phase_index, "remaining")))
+	
+	if remaining > 0:
+		dispatch_next_daily_shard(run_id, phase_index)
+	elif remaining == 0:
+		if DAILY_PHASES[phase_index] == "check_overdue_invoices":
+			send_held_overdue_notifications(run_id)
+		start_daily_phase(run_id, phase_index + 1)
+
+def mark_daily_shard_inflight(run_id, phase_index, after=None, upto=None, started=False):
+	"""Stamp a shard in the in-flight set, at dispatch and again when its job starts
+	
+	Returns False when the job starts after the watchdog already released the shard.
+	"""
+	key = _inflight_key(run_id, phase_index)
+	member = _shard_member(after, upto)
+	
+	if started and frappe.cache.zscore(key, member) is None:
+		return False
+	
+	frappe.cache.zadd(key, {member: time.time()}, xx=started)
+	frappe.cache.expire(key, DAILY_RUN_STATE_TTL)
+	return True
+
+def check_stalled_daily_run():
+	"""Scheduled watchdog for the sharded daily run
+	
+	A shard whose job was killed or whose worker died never reaches the
+	completion barrier, which would stall every later phase. Shards still in
+	flight `DAILY_SHARD_TIMEOUT` plus a grace period after they were last
+	stamped are released here, so the run moves on without them.
+	"""
+	current = frappe.cache.get_value(DAILY_RUN_CURRENT_KEY)
+	if not current:
+		return
+	
+	run_id, phase_index = current
+	cutoff = time.time() - DAILY_SHARD_TIMEOUT - DAILY_SHARD_GRACE
+	
+	for shard in frappe.cache.zrangebyscore(_inflight_key(run_id, phase_index), "-inf", cutoff):
+		after, upto = json.loads(shard)
+		frappe.log_error(
+			f"Daily run {run_id}: {DAILY_PHASES[phase_index]} shard ({after}, {upto}] did not complete "
+			f"within {DAILY_SHARD_TIMEOUT}s and was released",
+			"BMS Daily Run Stalled"
+		)
+		complete_daily_shard(run_id, phase_index, after, upto)
+
+def clear_orphaned_renewal_checkpoints():
+	"""Delete sharded auto-renewal checkpoints left Running by an earlier day's run
+	
+	Shard ranges change from night to night, so such a checkpoint is never
+	resumed. Its unrenewed subscriptions are still due and fall into the
+	new run's shards.
+	"""
+	orphaned = frappe.get_all("BMS Job Checkpoint",
+		filters={
+			"job_name": ["like", "process_auto_renewals:%"],
+			"status": "Running",
+			"started_on": ["<", today()]
+		},
+		pluck="name"
+	)
+	
+	if orphaned:
+		frappe.db.delete("BMS Job Checkpoint", {"name": ["in", orphaned]})
+		frappe.logger().info(f"Deleted {len(orphaned)} orphaned auto-renewal checkpoints")
+
+def get_daily_phase_method(phase):
+	"""Return the task function for a daily phase"""
+	return {
+		"check_expired_subscriptions": check_expired_subscriptions,
+		"check_overdue_invoices": check_overdue_invoices,
+		"process_auto_renewals": process_auto_renewals
+	}[phase]
+
+def get_daily_phase_candidates(phase):
+	"""Return the doctype and filters selecting the rows a daily phase works on"""
+	if phase == "check_expired_subscriptions":
+		return "BMS Subscription", {"status": "Active", "end_date": ["<", today()]}
+	elif phase == "check_overdue_invoices":
+		return "BMS Invoice", {"status": ["in", ["Sent", "Draft"]], "due_date": ["<", today()]}
+	elif phase == "process_auto_renewals":
+		return "BMS Subscription", {"status": "Active", "auto_renewal": 1, "next_billing_date": ["<=", today()]}
+
+def get_shard_ranges(doctype, filters, shard_size):
+	"""Split the rows matching `filters` into (after, upto] name ranges
+
+	The first range has no lower bound and the last has no upper bound, so
+	the shards together always cover every matching row.
+	"""
+	ranges = []
+	after = None
+	
+	while True:
+		boundary = frappe.get_all(doctype,
+			filters=with_name_range(filters, after=after),
+			order_by="name asc",
+			limit_start=shard_size - 1,
+			limit=1,
+			pluck="name"
 		)
 		
-		for subscription in expired_subscriptions:
-			subscription_doc = frappe.get_doc("BMS Subscription", subscription.name)
-			
-			# Handle expired active subscriptions
-			if subscription_doc.auto_renewal:
-				# Try to renew subscription
-				try:
-					subscription_doc.renew_subscription()
-					frappe.logger().info(f"Auto-renewed subscription: {subscription.name}")
-				except Exception as e:
-					# If renewal fails, mark as expired
-					subscription_doc.status = "Expired"
-					subscription_doc.save()
-					frappe.logger().error(f"Failed to auto-renew subscription {subscription.name}: {str(e)}")
-			else:
-				# Mark as expired
-				subscription_doc.status = "Expired"
-				subscription_doc.save()
+		if not boundary:
+			ranges.append((after, None))
+			return ranges
 		
-		frappe.logger().info(f"Processed {len(expired_subscriptions)} expired subscriptions")
+		ranges.append((after, boundary[0]))
+		after = boundary[0]
+
+def with_name_range(filters, after=None, upto=None):
+	"""Return `filters` as a filter list restricted to names in (after, upto]"""
+	filter_list = [
+		[field, *value] if isinstance(value, list) else [field, "=", value]
+		for field, value in filters.items()
+	]
+	
+	if after:
+		filter_list.append(["name", ">", after])
+	if upto:
+		filter_list.append(["name", "<=", upto])
+	
+	return filter_list
+
+def _daily_run_key(run_id, phase_index, suffix):
+	return f"bms:daily_run:{run_id}:{phase_index}:{suffix}"
+
+def _inflight_key(run_id, phase_index):
+	# Sorted set of shard -> time last stamped, used raw so it needs the site prefix
+	return frappe.cache.make_key(_daily_run_key(run_id, phase_index, "inflight"))
+
+def _overdue_notifications_key(run_id):
+	return f"bms:daily_run:{run_id}:overdue_notifications"
+
+def _shard_member(after, upto):
+	return json.dumps([after, upto])
+
+def check_expired_subscriptions(chunk_size=EXPIRY_CHUNK_SIZE, after=None, upto=None):
+	"""Check for expired subscriptions and update their status
+
+	Subscriptions without auto-renewal are flipped to "Expired" in chunked,
+	set-based updates. Only the auto-renewal subset is loaded as documents
+	and passed through `renew_subscription`. `after`/`upto` restrict the
+	run to a (after, upto] name range when called from a daily shard.
+	"""
+	try:
+		started = time.monotonic()
+		expired_count = expire_subscriptions_in_bulk(chunk_size, after=after, upto=upto)
+		renewed_count, failed_count = renew_expired_subscriptions(after=after, upto=upto)
+		
+		elapsed = time.monotonic() - started
+		processed = expired_count + renewed_count + failed_count
+		frappe.logger().info(
+			f"Processed {processed} expired subscriptions in {elapsed:.2f}s "
+			f"({_rate(processed, elapsed):.1f} rows/sec): {expired_count} expired, "
+			f"{renewed_count} renewed, {failed_count} failed to renew"
+		)
+		
+		return {
+			"expired": expired_count,
+			"renewed": renewed_count,
+			"failed": failed_count,
+			"seconds": elapsed
+		}
 		
 	except Exception as e:
 		frappe.logger().error(f"Error in check_expired_subscriptions: {str(e)}")
 
-def check_overdue_invoices():
-	"""Check for overdue invoices and update their status"""
-	try:
-		# Get invoices that are overdue
-		overdue_invoices = frappe.get_all("BMS Invoice",
-			filters={
-				"status": ["in", ["Sent", "Draft"]],
-				"due_date": ["<", today()]
-			},
-			fields=["name", "customer", "amount"]
+def expire_subscriptions_in_bulk(chunk_size=EXPIRY_CHUNK_SIZE, after=None, upto=None):
+	"""Mark expired non-auto-renewing subscriptions as "Expired", one chunk at a time"""
+	filters = with_name_range({
+		"status": "Active",
+		"auto_renewal": 0,
+		"end_date": ["<", today()]
+	}, after=after, upto=upto)
+	total = 0
+	chunk_number = 0
+	
+	while True:
+		chunk_started = time.monotonic()
+		
+		# Updated rows drop out of the filter, so the next chunk is always the first page
+		subscriptions = frappe.get_all("BMS Subscription",
+			filters=filters,
+			fields=["name", "customer", "status", "amount", "currency", "start_date"],
+			order_by="name asc",
+			limit=chunk_size
+		)
+		
+		if not subscriptions:
+			break
+		
+		names = [subscription.name for subscription in subscriptions]
+		frappe.db.set_value("BMS Subscription", {"name": ["in", names]}, "status", "Expired")
+		record_bulk_status_change("BMS Subscription", subscriptions, "Expired")
+		log_bulk_status_change("BMS Subscription", subscriptions, "Expired")
+		frappe.db.commit()
+		
+		chunk_number += 1
+		total += len(names)
+		chunk_elapsed = time.monotonic() - chunk_started
+		frappe.logger().info(
+			f"Expired subscription chunk {chunk_number}: {len(names)} rows in {chunk_elapsed:.3f}s "
+			f"({_rate(len(names), chunk_elapsed):.1f} rows/sec)"
 		)
 		
-		for invoice in overdue_invoices:
-			invoice_doc = frappe.get_doc("BMS Invoice", invoice.name)
-			invoice_doc.status = "Overdue"
-			invoice_doc.save()
+		if len(names) < chunk_size:
+			break
+	
+	if total:
+		clear_customer_dashboards()
+	
+	return total
+
+def renew_expired_subscriptions(after=None, upto=None):
+	"""Renew expired subscriptions that have auto-renewal enabled"""
+	renewal_subscriptions = frappe.get_all("BMS Subscription",
+		filters=with_name_range({
+			"status": "Active",
+			"auto_renewal": 1,
+			"end_date": ["<", today()]
+		}, after=after, upto=upto),
+		pluck="name"
+	)
+	
+	renewed_count = 0
+	failed_count = 0
+	
+	for subscription_name in renewal_subscriptions:
+		subscription_doc = frappe.get_doc("BMS Subscription", subscription_name)
+		
+		# Try to renew subscription
+		try:
+			subscription_doc.renew_subscription()
+			renewed_count += 1
+			frappe.logger().info(f"Auto-renewed subscription: {subscription_name}")
+		except Exception as e:
+			# If renewal fails, mark as expired
+			subscription_doc.status = "Expired"
+			subscription_doc.save()
+			failed_count += 1
+			frappe.logger().error(f"Failed to auto-renew subscription {subscription_name}: {str(e)}")
+	
+	return renewed_count, failed_count
+
+def _rate(count, seconds):
+	"""Rows per second, guarding against a zero duration"""
+	return count / seconds if seconds > 0 else float(count)
+
+def check_overdue_invoices(after=None, upto=None, chunk_size=OVERDUE_CHUNK_SIZE, run_id=None):
+	"""Check for overdue invoices and update their status
+
+	Invoices are moved to "Overdue" with one UPDATE per chunk, and the
+	customers are then notified once each, in queued batches. A shard of a
+	sharded daily run passes its `run_id` and its invoices are held until
+	the whole phase has finished, so that a customer whose invoices fall in
+	several shards still gets a single notification.
+	"""
+	try:
+		overdue_by_customer = {}
+		total = 0
+		
+		while True:
+			# Updated invoices drop out of the filter, so the next chunk is always the first page
+			overdue_invoices = frappe.get_all("BMS Invoice",
+				filters=with_name_range({
+					"status": ["in", ["Sent", "Draft"]],
+					"due_date": ["<", today()]
+				}, after=after, upto=upto),
+				fields=["name", "customer", "status", "amount", "currency", "invoice_date", "due_date"],
+				order_by="name asc",
+				limit=chunk_size
+			)
+			
+			if not overdue_invoices:
+				break
+			
+			frappe.db.set_value("BMS Invoice",
+				{"name": ["in", [invoice.name for invoice in overdue_invoices]]},
+				"status", "Overdue"
+			)
+			record_bulk_status_change("BMS Invoice", overdue_invoices, "Overdue")
+			log_bulk_status_change("BMS Invoice", overdue_invoices, "Overdue")
+			frappe.db.commit()
 			
-			# Send overdue notification
-			send_overdue_notification(invoice_doc)
+			for invoice in overdue_invoices:
+				overdue_by_customer.setdefault(invoice.customer, []).append(invoice)
+			total += len(overdue_invoices)
+			
+			if len(overdue_invoices) < chunk_size:
+				break
+		
+		if total:
+			clear_customer_dashboards()
 		
-		frappe.logger().info(f"Processed {len(overdue_invoices)} overdue invoices")
+		if run_id:
+			hold_overdue_notifications(run_id, overdue_by_customer)
+		else:
+			enqueue_overdue_notifications(overdue_by_customer)
+		
+		frappe.logger().info(f"Processed {total} overdue invoices for {len(overdue_by_customer)} customers")
 		
 	except Exception as e:
 		frappe.logger().error(f"Error in check_overdue_invoices: {str(e)}")
 
-def process_auto_renewals():
-	"""Process auto-renewals for subscriptions"""
+def enqueue_overdue_notifications(overdue_by_customer):
+	"""Queue grouped overdue notifications, `OVERDUE_NOTIFICATION_BATCH_SIZE` customers per job"""
+	customers = list(overdue_by_customer)
+	
+	for i in range(0, len(customers), OVERDUE_NOTIFICATION_BATCH_SIZE):
+		batch = {customer: overdue_by_customer[customer] for customer in customers[i:i + OVERDUE_NOTIFICATION_BATCH_SIZE]}
+		frappe.enqueue(
+			"bms.billing_management_system.tasks.send_overdue_notifications",
+			queue="short",
+			overdue_by_customer=batch
+		)
+
+def hold_overdue_notifications(run_id, overdue_by_customer):
+	"""Keep a shard's overdue invoices, grouped by customer, until the overdue phase of the run drains"""
+	if not overdue_by_customer:
+		return
+	
+	key = _overdue_notifications_key(run_id)
+	frappe.cache.rpush(key, frappe.as_json(overdue_by_customer))
+	frappe.cache.expire(frappe.cache.make_key(key), DAILY_RUN_STATE_TTL)
+
+def send_held_overdue_notifications(run_id):
+	"""Merge the invoices held by every shard of a run and queue one notification per customer"""
+	key = _overdue_notifications_key(run_id)
+	overdue_by_customer = {}
+	
+	for held in frappe.cache.lrange(key, 0, -1):
+		for customer, invoices in json.loads(held).items():
+			overdue_by_customer.setdefault(customer, []).extend(invoices)
+	
+	frappe.cache.delete_value(key)
+	enqueue_overdue_notifications(overdue_by_customer)
+
+def send_overdue_notifications(overdue_by_customer):
+	"""Send one overdue notification per customer for a batch of customers"""
+	for customer, invoices in overdue_by_customer.items():
+		send_customer_overdue_notification(customer, invoices)
+
+def process_auto_renewals(after=None, upto=None, batch_size=RENEWAL_BATCH_SIZE):
+	"""Process auto-renewals for subscriptions
+
+	Subscriptions are walked in name order in batches of `batch_size`, and
+	each batch is committed together with a BMS Job Checkpoint. If a run
+	stops partway, the next run resumes after the last committed
+	subscription and then wraps around to pick up anything before it.
+	"""
 	try:
+		job_name = get_renewal_job_name(after, upto)
+		checkpoint = get_checkpoint(job_name)
+		resume_from = checkpoint.last_processed if checkpoint.status == "Running" else None
+		
+		if resume_from:
+			frappe.logger().info(f"Resuming {job_name} after {resume_from} ({checkpoint.processed_count} already processed)")
+			processed = renew_subscription_batches(job_name, resume_from, upto, batch_size)
+			processed += renew_subscription_batches(job_name, after, resume_from, batch_size)
+		else:
+			start_checkpoint(job_name)
+			frappe.db.commit()
+			processed = renew_subscription_batches(job_name, after, upto, batch_size)
+		
+		complete_checkpoint(job_name)
+		frappe.db.commit()
+		
+		frappe.logger().info(f"Processed {processed} auto-renewals")
+		
+	except Exception as e:
+		frappe.logger().error(f"Error in process_auto_renewals: {str(e)}")
+
+def renew_subscription_batches(job_name, after, upto, batch_size):
+	"""Renew due subscriptions in (after, upto], checkpointing after every batch"""
+	processed = 0
+	cursor = after
+	
+	while True:
 		# Get subscriptions that need renewal
 		renewal_subscriptions = frappe.get_all("BMS Subscription",
-			filters={
+			filters=with_name_range({
 				"status": "Active",
 				"auto_renewal": 1,
 				"next_billing_date": ["<=", today()]
-			},
-			fields=["name", "customer", "plan", "amount"]
+			}, after=cursor, upto=upto),
+			order_by="name asc",
+			limit=batch_size,
+			pluck="name"
 		)
 		
-		for subscription in renewal_subscriptions:
-			subscription_doc = frappe.get_doc("BMS Subscription", subscription.name)
+		if not renewal_subscriptions:
+			break
+		
+		for subscription_name in renewal_subscriptions:
+			subscription_doc = frappe.get_doc("BMS Subscription", subscription_name)
 			
 			try:
 				# Create invoice for renewal
@@ -99,25 +551,37 @@ def process_auto_renewals():
 				subscription_doc.calculate_next_billing_date()
 				subscription_doc.save()
 				
-				frappe.logger().info(f"Created renewal invoice for subscription: {subscription.name}")
+				frappe.logger().info(f"Created renewal invoice for subscription: {subscription_name}")
 				
 			except Exception as e:
-				frappe.logger().error(f"Failed to process auto-renewal for subscription {subscription.name}: {str(e)}")
+				frappe.logger().error(f"Failed to process auto-renewal for subscription {subscription_name}: {str(e)}")
 		
-		frappe.logger().info(f"Processed {len(renewal_subscriptions)} auto-renewals")
+		cursor = renewal_subscriptions[-1]
+		advance_checkpoint(job_name, cursor, len(renewal_subscriptions))
+		frappe.db.commit()
+		processed += len(renewal_subscriptions)
 		
-	except Exception as e:
-		frappe.logger().error(f"Error in process_auto_renewals: {str(e)}")
+		if len(renewal_subscriptions) < batch_size:
+			break
+	
+	return processed
+
+def get_renewal_job_name(after=None, upto=None):
+	"""Checkpoint name for an auto-renewal run over (after, upto]"""
+	if after or upto:
+		return f"process_auto_renewals:{after or ''}:{upto or ''}"
+	return "process_auto_renewals"
 
-def send_overdue_notification(invoice_doc):
-	"""Send overdue notification to customer"""
+def send_customer_overdue_notification(customer, invoices):
+	"""Send a single overdue notification listing all of a customer's overdue invoices"""
 	try:
 		# This would integrate with Frappe's email system
 		# For now, just log the notification
-		frappe.logger().info(f"Overdue notification sent for invoice: {invoice_doc.name}")
+		invoice_names = ", ".join(invoice["name"] for invoice in invoices)
+		frappe.logger().info(f"Overdue notification sent to customer {customer} for invoices: {invoice_names}")
 		
 	except Exception as e:
-		frappe.logger().error(f"Error sending overdue notification: {str(e)}")
+		frappe.logger().error(f"Error sending overdue notification to customer {customer}: {str(e)}")
 
 def generate_monthly_reports():
 	"""Generate monthly reports"""
@@ -137,18 +601,13 @@ def generate_revenue_report():
 	"""Generate revenue report for the month"""
 	try:
 		# Get current month's payments
-		current_month = today().strftime("%Y-%m")
+		current_month = getdate(today()).strftime("%Y-%m")
 		
-		payments = frappe.get_all("BMS Payment",
-			filters={
-				"payment_type": "Payment",
-				"status": "Completed",
-				"payment_date": ["like", f"{current_month}%"]
-			},
-			fields=["amount", "currency"]
-		)
-		
-		total_revenue = sum(payment.amount for payment in payments)
+		total_revenue = get_total_amount({
+			"payment_type": "Payment",
+			"status": "Completed",
+			"payment_date": ["like", f"{current_month}%"]
+		})
 		
 		# Create report record
 		report_doc = frappe.new_doc("BMS Monthly Report")
@@ -164,14 +623,15 @@ def generate_subscription_report():
 	"""Generate subscription report for the month"""
 	try:
 		# Get subscription statistics
-		total_subscriptions = frappe.db.count("BMS Subscription")
-		active_subscriptions = frappe.db.count("BMS Subscription", {"status": "Active"})
-		cancelled_subscriptions = frappe.db.count("BMS Subscription", {"status": "Cancelled"})
+		status_counts = count_by_status("BMS Subscription", use_cache=False)
+		total_subscriptions = sum(status_counts.values())
+		active_subscriptions = status_counts.get("Active", 0)
+		cancelled_subscriptions = status_counts.get("Cancelled", 0)
 		
 		# Create report record
 		report_doc = frappe.new_doc("BMS Monthly Report")
 		report_doc.report_type = "Subscription"
-		report_doc.report_month = today().strftime("%Y-%m")
+		report_doc.report_month = getdate(today()).strftime("%Y-%m")
 		report_doc.total_subscriptions = total_subscriptions
 		report_doc.active_subscriptions = active_subscriptions
 		report_doc.cancelled_subscriptions = cancelled_subscriptions
@@ -199,5 +659,12 @@ def cleanup_old_data():
 		
 		frappe.logger().info(f"Cleaned up {len(old_subscriptions)} old subscriptions")
 		
+		# Delete checkpoints left behind by sharded auto-renewal runs (older than 30 days)
+		frappe.db.delete("BMS Job Checkpoint", {
+			"job_name": ["like", "process_auto_renewals:%"],
+			"status": "Completed",
+			"completed_on": ["<", add_days(today(), -30)]
+		})
+		
 	except Exception as e:
 		frappe.logger().error(f"Error in cleanup_old_data: {str(e)}")
@@ -0,0 +1,58 @@
+import frappe
+
+from bms.billing_management_system.cache import delete_cached_values, get_cached_value
+
+PLAN_VISIBILITY_CACHE_KEY = "bms:plan_visibility"
+
+# Seconds the index is cached, in case an invalidation is missed
+PLAN_VISIBILITY_TTL = 3600
+
+def get_visibility_index():
+	"""Return the cached plan visibility index, building it on a miss
+	
+	`public` holds the plans visible to all customers, `by_customer` maps a
+	customer to the plans targeted at it and `active` holds the active plans.
+	"""
+	return get_cached_value(PLAN_VISIBILITY_CACHE_KEY, build_visibility_index, PLAN_VISIBILITY_TTL)
+
+def build_visibility_index():
+	"""Build the visibility index from BMS Plan and BMS Plan Customer in two queries"""
+	index = frappe._dict(public=set(), by_customer={}, active=set())
+	specific_plans = set()
+	
+	for plan in frappe.get_all("BMS Plan", fields=["name", "plan_visibility", "is_active"]):
+		if plan.plan_visibility == "All Customers":
+			index.public.add(plan.name)
+		elif plan.plan_visibility == "Specific Customers":
+			specific_plans.add(plan.name)
+		
+		if plan.is_active:
+			index.active.add(plan.name)
+	
+	for row in frappe.get_all("BMS Plan Customer",
+		filters={"parenttype": "BMS Plan"},
+		fields=["parent", "customer"]
+	):
+		if row.parent in specific_plans:
+			index.by_customer.setdefault(row.customer, set()).add(row.parent)
+	
+	return index
+
+def is_plan_visible(plan, customer):
+	"""Check if `plan` is visible to `customer`: public plans, or plans listing the customer"""
+	index = get_visibility_index()
+	return plan in index.public or plan in index.by_customer.get(customer, ())
+
+def get_visible_plans(customer, active_only=True):
+	"""Return the names of the plans `customer` can see"""
+	index = get_visibility_index()
+	plans = index.public | index.by_customer.get(customer, set())
+	
+	if active_only:
+		plans = plans & index.active
+	
+	return plans
+
+def clear_visibility_index(doc=None, method=None, old=None, new=None, merge=False):
+	"""BMS Plan on_update/on_trash and BMS Plan/Customer after_rename hook: drop the index so the next lookup rebuilds it"""
+	delete_cached_values(PLAN_VISIBILITY_CACHE_KEY)
@@ -96,6 +96,8 @@ doctype_list_js = {
 
 after_install = "bms.install.after_install"
 
+after_migrate = ["bms.billing_management_system.indexes.ensure_indexes"]
+
 # Uninstallation
 # ------------
 
@@ -144,20 +146,84 @@ has_permission = {
 # ---------------
 # Hook on document methods and events
 
-# doc_events = {
-# 	"*": {
-# 		"on_update": "method",
-# 		"on_cancel": "method",
-# 		"on_trash": "method"
-# 	}
-# }
+doc_events = {
+	"BMS Subscription": {
+		"after_insert": [
+			"bms.billing_management_system.metrics.on_document_insert",
+			"bms.billing_management_system.doctype.bms_activity_log.bms_activity_log.log_document_insert"
+		],
+		"on_update": [
+			"bms.billing_management_system.metrics.on_document_update",
+			"bms.billing_management_system.gateway_ids.on_subscription_update",
+			"bms.billing_management_system.customer_dashboard.clear_customer_dashboard",
+			"bms.billing_management_system.doctype.bms_activity_log.bms_activity_log.log_document_update"
+		],
+		"on_trash": [
+			"bms.billing_management_system.metrics.on_document_trash",
+			"bms.billing_management_system.gateway_ids.on_subscription_trash",
+			"bms.billing_management_system.customer_dashboard.clear_customer_dashboard",
+			"bms.billing_management_system.doctype.bms_activity_log.bms_activity_log.log_document_trash"
+		]
+	},
+	"BMS Invoice": {
+		"after_insert": [
+			"bms.billing_management_system.metrics.on_document_insert",
+			"bms.billing_management_system.doctype.bms_activity_log.bms_activity_log.log_document_insert"
+		],
+		"on_update": [
+			"bms.billing_management_system.metrics.on_document_update",
+			"bms.billing_management_system.customer_dashboard.clear_customer_dashboard",
+			"bms.billing_management_system.doctype.bms_activity_log.bms_activity_log.log_document_update"
+		],
+		"on_trash": [
+			"bms.billing_management_system.metrics.on_document_trash",
+			"bms.billing_management_system.customer_dashboard.clear_customer_dashboard",
+			"bms.billing_management_system.doctype.bms_activity_log.bms_activity_log.log_document_trash"
+		]
+	},
+	"BMS Payment": {
+		"after_insert": [
+			"bms.billing_management_system.metrics.on_document_insert",
+			"bms.billing_management_system.doctype.bms_activity_log.bms_activity_log.log_document_insert"
+		],
+		"on_update": [
+			"bms.billing_management_system.metrics.on_document_update",
+			"bms.billing_management_system.customer_dashboard.clear_customer_dashboard",
+			"bms.billing_management_system.doctype.bms_activity_log.bms_activity_log.log_document_update"
+		],
+		"on_trash": [
+			"bms.billing_management_system.metrics.on_document_trash",
+			"bms.billing_management_system.customer_dashboard.clear_customer_dashboard",
+			"bms.billing_management_system.doctype.bms_activity_log.bms_activity_log.log_document_trash"
+		]
+	},
+	"BMS Plan": {
+		"on_update": ["bms.billing_management_system.visibility.clear_visibility_index", "bms.billing_management_system.snapshots.clear_snapshot"],
+		"after_rename": ["bms.billing_management_system.visibility.clear_visibility_index", "bms.billing_management_system.snapshots.clear_renamed_snapshot"],
+		"on_trash": ["bms.billing_management_system.visibility.clear_visibility_index", "bms.billing_management_system.snapshots.clear_snapshot"]
+	},
+	"BMS Customer": {
+		"on_update": "bms.billing_management_system.snapshots.clear_snapshot",
+		"after_rename": ["bms.billing_management_system.visibility.clear_visibility_index", "bms.billing_management_system.snapshots.clear_renamed_snapshot"],
+		"on_trash": "bms.billing_management_system.snapshots.clear_snapshot"
+	},
+	"User": {
+		"on_update": "bms.billing_management_system.permissions.on_user_update",
+		"on_trash": "bms.billing_management_system.permissions.on_user_update"
+	}
+}
 
 # Scheduled Tasks
 # ---------------
 
 scheduler_events = {
+	"all": [
+		"bms.billing_management_system.doctype.bms_webhook_event.bms_webhook_event.enqueue_pending_webhook_events",
+		"bms.billing_management_system.tasks.check_stalled_daily_run"
+	],
 	"daily": [
-		"bms.billing_management_system.tasks.daily_tasks"
+		"bms.billing_management_system.tasks.daily_tasks",
+		"bms.billing_management_system.doctype.bms_webhook_event.bms_webhook_event.cleanup_webhook_events"
 	],
 	"monthly": [
 		"bms.billing_management_system.tasks.monthly_tasks"
@@ -190,7 +256,8 @@ scheduler_events = {
 # Ignore links to specified DocTypes when deleting documents
 # -----------------------------------------------------------
 
-# ignore_links_on_delete = ["Communication", "ToDo"]
+# Activity log entries outlive the documents they reference
+ignore_links_on_delete = ["BMS Activity Log"]
 
 # Request Events
 # ----------------
@@ -1,10 +1,13 @@
 import frappe
 from frappe import _
 
+from bms.billing_management_system.indexes import ensure_indexes
+
 def after_install():
 	"""After install setup for BMS"""
 	setup_roles()
 	setup_permissions()
+	ensure_indexes()
 	create_sample_data()
 	frappe.db.commit()
 
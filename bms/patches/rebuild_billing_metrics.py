@@ -0,0 +1,5 @@
+from bms.billing_management_system.metrics import rebuild_metrics
+
+def execute():
+	"""Backfill BMS Metrics from the existing subscriptions, invoices and payments"""
+	rebuild_metrics()
@@ -148,9 +148,717 @@ class TestBMS(FrappeTestCase):
 		self.assertEqual(refund.amount, -29.99)
 		self.assertEqual(payment.status, "Refunded")
 	
+	def test_bulk_subscription_expiry(self):
+		"""Test expired subscriptions without auto-renewal are expired in bulk"""
+		from unittest.mock import patch
+		from bms.billing_management_system.tasks import check_expired_subscriptions
+		
+		self.plan.auto_renewal = 0
+		self.plan.save()
+		
+		subscription = frappe.new_doc("BMS Subscription")
+		subscription.customer = self.customer.name
+		subscription.plan = self.plan.name
+		subscription.start_date = frappe.utils.add_days(frappe.utils.today(), -60)
+		subscription.end_date = frappe.utils.add_days(frappe.utils.today(), -30)
+		subscription.status = "Active"
+		subscription.save()
+		
+		with patch.object(frappe.db, "commit"):
+			result = check_expired_subscriptions(chunk_size=1)
+		
+		self.assertGreaterEqual(result["expired"], 1)
+		self.assertEqual(frappe.db.get_value("BMS Subscription", subscription.name, "status"), "Expired")
+	
+	def test_payment_totals_aggregation(self):
+		"""Test payment totals are summed in the database"""
+		from bms.billing_management_system.aggregates import aggregate_payments, get_payment_totals
+		
+		subscription = frappe.new_doc("BMS Subscription")
+		subscription.customer = self.customer.name
+		subscription.plan = self.plan.name
+		subscription.start_date = frappe.utils.today()
+		subscription.status = "Active"
+		subscription.save()
+		
+		for amount in (29.99, 10.01):
+			payment = frappe.new_doc("BMS Payment")
+			payment.customer = self.customer.name
+			payment.subscription = subscription.name
+			payment.plan = self.plan.name
+			payment.amount = amount
+			payment.currency = "USD"
+			payment.payment_type = "Payment"
+			payment.payment_date = frappe.utils.today()
+			payment.status = "Completed"
+			payment.payment_method = "Credit Card"
+			payment.save()
+		
+		totals = get_payment_totals({"customer": self.customer.name})
+		self.assertAlmostEqual(totals.total_paid, 40.0)
+		self.assertEqual(totals.total_refunded, 0)
+		
+		groups = aggregate_payments({"customer": self.customer.name}, group_by=("currency", "month"))
+		self.assertEqual(len(groups), 1)
+		self.assertEqual(groups[0].payment_count, 2)
+		self.assertEqual(groups[0].currency, "USD")
+	
+	def test_plan_visibility_index(self):
+		"""Test plan visibility follows plan updates"""
+		from bms.billing_management_system.visibility import get_visible_plans, is_plan_visible
+		
+		self.plan.plan_visibility = "All Customers"
+		self.plan.save()
+		self.assertTrue(is_plan_visible(self.plan.name, self.customer.name))
+		
+		self.plan.plan_visibility = "Specific Customers"
+		self.plan.append("target_customers", {"customer": self.customer.name})
+		self.plan.save()
+		self.assertTrue(is_plan_visible(self.plan.name, self.customer.name))
+		self.assertFalse(is_plan_visible(self.plan.name, "Unknown Customer"))
+		self.assertIn(self.plan.name, get_visible_plans(self.customer.name))
+	
+	def test_plan_visibility_shared_by_portal_and_controller(self):
+		"""Test the portal plan list and BMSPlan.is_available_for_customer follow the visibility index"""
+		from bms.billing_management_system.api.user_portal import get_user_plans
+		
+		self.plan.plan_visibility = "Specific Customers"
+		self.plan.append("target_customers", {"customer": self.customer.name})
+		self.plan.save()
+		
+		self.assertTrue(self.plan.is_available_for_customer(self.customer.name))
+		self.assertFalse(self.plan.is_available_for_customer("Unknown Customer"))
+		self.assertIn(self.plan.name, [plan.name for plan in get_user_plans(self.customer.email)])
+		
+		self.plan.target_customers = []
+		self.plan.plan_visibility = "All Customers"
+		self.plan.is_active = 0
+		self.plan.save()
+		self.assertNotIn(self.plan.name, [plan.name for plan in get_user_plans(self.customer.email)])
+	
+	def test_plan_rename_refreshes_visibility(self):
+		"""Test renaming a plan runs the after_rename hooks and re-indexes the new name"""
+		from bms.billing_management_system.visibility import get_visible_plans
+		
+		self.assertIn(self.plan.name, get_visible_plans(self.customer.name))
+		
+		new_name = frappe.rename_doc("BMS Plan", self.plan.name, f"{self.plan.name}-renamed", force=True)
+		
+		visible = get_visible_plans(self.customer.name)
+		self.assertIn(new_name, visible)
+		self.assertNotIn(self.plan.name, visible)
+	
+	def test_bulk_subscription_creation(self):
+		"""Test bulk subscription creation reports a result per row"""
+		from unittest.mock import patch
+		from bms.billing_management_system.api.subscription import create_subscriptions_in_bulk
+		
+		with patch.object(frappe.db, "commit"):
+			response = create_subscriptions_in_bulk(csv_content="\n".join([
+				"customer,plan,start_date",
+				f"{self.customer.name},{self.plan.name},{frappe.utils.today()}",
+				f"{self.customer.name},Missing Plan,{frappe.utils.today()}"
+			]))
+		
+		self.assertEqual(response["status"], "success")
+		self.assertEqual(response["created"], 1)
+		self.assertEqual([result["status"] for result in response["results"]], ["success", "error"])
+		self.assertTrue(frappe.db.exists("BMS Subscription", response["results"][0]["subscription"]))
+		self.assertFalse(frappe.local.message_log)
+		
+		response = create_subscriptions_in_bulk(rows=[[self.customer.name, self.plan.name]], chunk_size=-5)
+		self.assertEqual(response["status"], "error")
+	
+	def test_keyset_pagination(self):
+		"""Test customer lists page by cursor without repeating or skipping rows"""
+		from bms.billing_management_system.api.invoice import get_customer_invoices
+		
+		for i in range(5):
+			frappe.get_doc({
+				"doctype": "BMS Invoice",
+				"customer": self.customer.name,
+				"amount": 100 + i,
+				"currency": "INR",
+				"invoice_date": frappe.utils.today(),
+				"due_date": frappe.utils.today()
+			}).insert()
+		
+		names = []
+		cursor = None
+		while True:
+			page = get_customer_invoices(self.customer.name, cursor=cursor, page_size=2, fields=["amount"])
+			self.assertEqual(page["status"], "success")
+			self.assertLessEqual(len(page["data"]), 2)
+			self.assertEqual(set(page["data"][0]), {"name", "amount", "creation"})
+			names.extend(row.name for row in page["data"])
+			cursor = page["next_cursor"]
+			if not cursor:
+				break
+		
+		self.assertEqual(len(names), len(set(names)))
+		self.assertEqual(len(names), frappe.db.count("BMS Invoice", {"customer": self.customer.name}))
+		self.assertEqual(get_customer_invoices(self.customer.name, fields=["notes"])["status"], "error")
+	
+	def test_customer_dashboard_cache(self):
+		"""Test the customer dashboard is cached and rebuilt when a subscription changes"""
+		from bms.billing_management_system.customer_dashboard import get_customer_dashboard
+		
+		self.assertEqual(get_customer_dashboard(self.customer.name).subscription_counts.get("Active", 0), 0)
+		
+		subscription = frappe.new_doc("BMS Subscription")
+		subscription.customer = self.customer.name
+		subscription.plan = self.plan.name
+		subscription.start_date = frappe.utils.today()
+		subscription.status = "Active"
+		subscription.save()
+		
+		dashboard = get_customer_dashboard(self.customer.name)
+		self.assertEqual(dashboard.subscription_counts.get("Active"), 1)
+		self.assertEqual(dashboard.subscriptions[0].name, subscription.name)
+	
+	def test_customer_dashboard_cache_cleared_after_commit(self):
+		"""Test a dashboard cached between the invalidation and the commit is dropped again, and expires"""
+		from bms.billing_management_system import customer_dashboard
+		
+		key = customer_dashboard.get_customer_dashboard_key(self.customer.name)
+		customer_dashboard.forget_customer_dashboard(self.customer.name)
+		
+		# A concurrent request caching the pre-commit rows
+		customer_dashboard.get_customer_dashboard(self.customer.name)
+		self.assertTrue(0 < frappe.cache.ttl(frappe.cache.make_key(key)) <= customer_dashboard.CUSTOMER_DASHBOARD_TTL)
+		
+		frappe.db.after_commit.run()
+		self.assertIsNone(frappe.cache.get_value(key, expires=True))
+	
+	def test_customer_name_propagation_clears_caches(self):
+		"""Test propagating a customer name drops the customer's dashboard and the admin sections listing names"""
+		from bms.billing_management_system import customer_dashboard, dashboard_cache
+		from bms.billing_management_system.doctype.bms_customer.bms_customer import propagate_customer_name
+		
+		customer_dashboard.get_customer_dashboard(self.customer.name)
+		for section in dashboard_cache.CUSTOMER_NAME_SECTIONS:
+			frappe.cache.set_value(dashboard_cache.get_section_key(section), {"value": [], "computed_on": 0, "seconds": 0})
+		
+		frappe.db.set_value("BMS Customer", self.customer.name, "customer_name", "Renamed Customer")
+		propagate_customer_name(self.customer.name)
+		self.assertIsNone(frappe.cache.get_value(customer_dashboard.get_customer_dashboard_key(self.customer.name), expires=True))
+		
+		frappe.db.after_commit.run()
+		for section in dashboard_cache.CUSTOMER_NAME_SECTIONS:
+			self.assertIsNone(frappe.cache.get_value(dashboard_cache.get_section_key(section), expires=True))
+	
+	def test_dashboard_section_cache(self):
+		"""Test a stale dashboard section is served while its refresh is queued once"""
+		from unittest.mock import patch
+		from bms.billing_management_system import dashboard_cache
+		
+		dashboard_cache.clear_dashboard_cache()
+		first = dashboard_cache.get_dashboard_section("payments")
+		self.assertFalse(dashboard_cache.get_dashboard_timings()["payments"]["stale"])
+		
+		# Age the cached entry past its TTL
+		key = dashboard_cache.get_section_key("payments")
+		entry = frappe.cache.get_value(key, expires=True)
+		entry["computed_on"] -= 3600
+		frappe.cache.set_value(key, entry, expires_in_sec=60)
+		
+		with patch.object(dashboard_cache.frappe, "enqueue") as enqueue:
+			self.assertEqual(dashboard_cache.get_dashboard_section("payments"), first)
+			self.assertEqual(dashboard_cache.get_dashboard_section("payments"), first)
+			self.assertEqual(enqueue.call_count, 1)
+		
+		dashboard_cache.release_section_lock("payments")
+		dashboard_cache.clear_dashboard_cache()
+	
+	def test_overdue_invoice_feed(self):
+		"""Test the overdue feed header totals by currency and pages the rows by due date"""
+		from bms.billing_management_system.api.dashboard import get_overdue_invoices, get_overdue_invoices_page
+		
+		for days in (3, 2, 1):
+			frappe.get_doc({
+				"doctype": "BMS Invoice",
+				"customer": self.customer.name,
+				"amount": 100,
+				"currency": "INR",
+				"invoice_date": frappe.utils.add_days(frappe.utils.today(), -30),
+				"due_date": frappe.utils.add_days(frappe.utils.today(), -days),
+				"status": "Overdue"
+			}).insert()
+		
+		feed = get_overdue_invoices()
+		self.assertEqual(feed["count"], frappe.db.count("BMS Invoice", {"status": "Overdue"}))
+		self.assertLessEqual(len(feed["rows"]), 5)
+		
+		due_dates = []
+		cursor = None
+		while True:
+			page = get_overdue_invoices_page(cursor=cursor, page_size=1)
+			due_dates.extend(row.due_date for row in page["data"])
+			cursor = page["next_cursor"]
+			if not cursor:
+				break
+		
+		self.assertEqual(len(due_dates), feed["count"])
+		self.assertEqual(due_dates, sorted(due_dates))
+	
+	def test_activity_log_timeline(self):
+		"""Test subscription events are logged and paged as a customer timeline"""
+		from bms.billing_management_system.api.dashboard import get_activity_feed
+		
+		subscription = frappe.new_doc("BMS Subscription")
+		subscription.customer = self.customer.name
+		subscription.plan = self.plan.name
+		subscription.start_date = frappe.utils.today()
+		subscription.status = "Active"
+		subscription.save()
+		subscription.cancel_subscription("Test cancellation")
+		
+		feed = get_activity_feed(customer=self.customer.name, page_size=1)
+		self.assertEqual(feed["status"], "success")
+		self.assertEqual(feed["data"][0].action, "status changed")
+		self.assertEqual(feed["data"][0].status, "Cancelled")
+		
+		older = get_activity_feed(customer=self.customer.name, cursor=feed["next_cursor"], page_size=1)
+		self.assertEqual(older["data"][0].action, "created")
+		self.assertEqual(older["data"][0].reference_name, subscription.name)
+	
+	def test_sharded_overdue_run_notifies_customer_once(self):
+		"""Test a customer with overdue invoices in two shards gets one notification for the run"""
+		from unittest.mock import patch
+		from bms.billing_management_system import tasks
+		
+		invoices = sorted(
+			frappe.get_doc({
+				"doctype": "BMS Invoice",
+				"customer": self.customer.name,
+				"amount": 100,
+				"currency": "INR",
+				"invoice_date": frappe.utils.add_days(frappe.utils.today(), -30),
+				"due_date": frappe.utils.add_days(frappe.utils.today(), -1),
+				"status": "Sent"
+			}).insert().name
+			for _ in range(2)
+		)
+		run_id = frappe.generate_hash(length=10)
+		
+		with patch.object(tasks, "enqueue_overdue_notifications") as enqueue:
+			with patch.object(frappe.db, "commit"):
+				# One shard per invoice
+				tasks.check_overdue_invoices(upto=invoices[0], run_id=run_id)
+				tasks.check_overdue_invoices(after=invoices[0], run_id=run_id)
+			enqueue.assert_not_called()
+			
+			tasks.send_held_overdue_notifications(run_id)
+		
+		enqueue.assert_called_once()
+		overdue_by_customer = enqueue.call_args.args[0]
+		self.assertEqual(sorted(invoice["name"] for invoice in overdue_by_customer[self.customer.name]), invoices)
+	
+	def test_stalled_daily_shard_is_released(self):
+		"""Test the watchdog releases a shard that never completed, once, and moves to the next phase"""
+		import json
+		import time
+		from unittest.mock import patch
+		from bms.billing_management_system import tasks
+		
+		run_id = frappe.generate_hash(length=10)
+		frappe.cache.set(frappe.cache.make_key(tasks._daily_run_key(run_id, 0, "remaining")), 1, ex=60)
+		frappe.cache.set_value(tasks.DAILY_RUN_CURRENT_KEY, [run_id, 0], expires_in_sec=60)
+		frappe.cache.zadd(tasks._inflight_key(run_id, 0), {
+			json.dumps([None, None]): time.time() - tasks.DAILY_SHARD_TIMEOUT - tasks.DAILY_SHARD_GRACE - 1
+		})
+		
+		try:
+			with patch.object(tasks, "start_daily_phase") as start_daily_phase:
+				tasks.check_stalled_daily_run()
+				tasks.check_stalled_daily_run()
+				# The killed job's late completion must not count the shard again
+				tasks.complete_daily_shard(run_id, 0)
+			
+			start_daily_phase.assert_called_once_with(run_id, 1)
+			self.assertFalse(tasks.mark_daily_shard_inflight(run_id, 0, started=True))
+		finally:
+			frappe.cache.delete_value(tasks.DAILY_RUN_CURRENT_KEY)
+	
+	def test_orphaned_renewal_checkpoints_are_cleared(self):
+		"""Test sharded renewal checkpoints left running by an earlier day are deleted"""
+		from bms.billing_management_system.tasks import clear_orphaned_renewal_checkpoints
+		
+		checkpoint = frappe.new_doc("BMS Job Checkpoint")
+		checkpoint.job_name = "process_auto_renewals:SUB-0001:SUB-0500"
+		checkpoint.status = "Running"
+		checkpoint.started_on = frappe.utils.add_days(frappe.utils.now_datetime(), -1)
+		checkpoint.insert(ignore_permissions=True)
+		
+		clear_orphaned_renewal_checkpoints()
+		
+		self.assertFalse(frappe.db.exists("BMS Job Checkpoint", checkpoint.name))
+	
+	def test_razorpay_resume_recalculates_next_billing_date(self):
+		"""Test a subscription.resumed webhook reactivates the subscription with a next billing date"""
+		from bms.billing_management_system.api.user_portal import handle_subscription_resumed
+		
+		subscription = frappe.new_doc("BMS Subscription")
+		subscription.customer = self.customer.name
+		subscription.plan = self.plan.name
+		subscription.start_date = frappe.utils.today()
+		subscription.end_date = frappe.utils.add_days(frappe.utils.today(), 30)
+		subscription.status = "Paused"
+		subscription.razorpay_subscription_id = "sub_test_resume"
+		subscription.save()
+		frappe.db.set_value("BMS Subscription", subscription.name, "next_billing_date", None)
+		
+		handle_subscription_resumed({"subscription": {"id": "sub_test_resume"}})
+		
+		status, next_billing_date = frappe.db.get_value("BMS Subscription", subscription.name,
+			["status", "next_billing_date"])
+		self.assertEqual(status, "Active")
+		self.assertEqual(next_billing_date, frappe.utils.add_months(subscription.end_date, 1))
+	
+	def test_razorpay_subscription_link_cached_after_commit(self):
+		"""Test a Razorpay subscription id is mapped in the cache only after commit, and misses are not cached"""
+		from bms.billing_management_system.gateway_ids import RAZORPAY_SUBSCRIPTION_CACHE_KEY, get_subscription_for_razorpay_id
+		
+		frappe.cache.hdel(RAZORPAY_SUBSCRIPTION_CACHE_KEY, "sub_test_link")
+		self.assertIsNone(get_subscription_for_razorpay_id("sub_test_link"))
+		self.assertIsNone(frappe.cache.hget(RAZORPAY_SUBSCRIPTION_CACHE_KEY, "sub_test_link"))
+		
+		subscription = frappe.new_doc("BMS Subscription")
+		subscription.customer = self.customer.name
+		subscription.plan = self.plan.name
+		subscription.start_date = frappe.utils.today()
+		subscription.status = "Active"
+		subscription.razorpay_subscription_id = "sub_test_link"
+		subscription.save()
+		
+		try:
+			self.assertIsNone(frappe.cache.hget(RAZORPAY_SUBSCRIPTION_CACHE_KEY, "sub_test_link"))
+			
+			frappe.db.after_commit.run()
+			self.assertEqual(frappe.cache.hget(RAZORPAY_SUBSCRIPTION_CACHE_KEY, "sub_test_link"), subscription.name)
+		finally:
+			frappe.cache.hdel(RAZORPAY_SUBSCRIPTION_CACHE_KEY, "sub_test_link")
+	
+	def test_razorpay_plan_cache_follows_billing_cycle(self):
+		"""Test a cached Razorpay plan id is not reused once the plan's billing cycle changes"""
+		from unittest.mock import MagicMock
+		from bms.billing_management_system.api.user_portal import create_or_get_razorpay_plan
+		from bms.billing_management_system.gateway_ids import GATEWAY_ID_CACHE_KEY
+		
+		frappe.cache.delete_value(GATEWAY_ID_CACHE_KEY)
+		client = MagicMock()
+		client.plan.create.side_effect = [{"id": "plan_monthly"}, {"id": "plan_quarterly"}]
+		
+		self.assertEqual(create_or_get_razorpay_plan(client, self.plan, "USD"), "plan_monthly")
+		self.assertEqual(create_or_get_razorpay_plan(client, self.plan, "USD"), "plan_monthly")
+		
+		self.plan.billing_cycle = "Quarterly"
+		self.assertEqual(create_or_get_razorpay_plan(client, self.plan, "USD"), "plan_quarterly")
+		
+		data = client.plan.create.call_args.kwargs["data"]
+		self.assertEqual((data["period"], data["interval"]), ("monthly", 3))
+	
+	def test_plan_repricing_applies_change_saved_mid_run(self):
+		"""Test repricing goes round again when the plan is changed while it runs"""
+		from unittest.mock import patch
+		from bms.billing_management_system.doctype.bms_plan import bms_plan
+		
+		subscription = frappe.new_doc("BMS Subscription")
+		subscription.customer = self.customer.name
+		subscription.plan = self.plan.name
+		subscription.start_date = frappe.utils.today()
+		subscription.end_date = frappe.utils.add_days(frappe.utils.today(), 30)
+		subscription.status = "Active"
+		subscription.save()
+		
+		frappe.db.set_value("BMS Plan", self.plan.name, "amount", 39.99)
+		reprice_pending_subscriptions = bms_plan.reprice_pending_subscriptions
+		
+		def save_during_run(*args, **kwargs):
+			repriced = reprice_pending_subscriptions(*args, **kwargs)
+			if frappe.db.get_value("BMS Plan", self.plan.name, "amount") == 39.99:
+				# What a save committed after the last chunk leaves behind
+				frappe.db.set_value("BMS Plan", self.plan.name, {"amount": 49.99, "repricing_status": "Queued"})
+			return repriced
+		
+		with patch.object(frappe.db, "commit"), patch.object(bms_plan, "reprice_pending_subscriptions", side_effect=save_during_run) as run:
+			bms_plan.reprice_subscriptions(self.plan.name)
+		
+		self.assertEqual(run.call_count, 2)
+		self.assertEqual(frappe.db.get_value("BMS Subscription", subscription.name, "amount"), 49.99)
+		self.assertEqual(frappe.db.get_value("BMS Plan", self.plan.name, "repricing_status"), "Completed")
+	
+	def test_razorpay_client_retries_stub_gateway(self):
+		"""Test the shared Razorpay client retries a 5xx from a local stub gateway"""
+		import threading
+		from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+		from unittest.mock import patch
+		from bms.billing_management_system import razorpay_client
+		
+		if not razorpay_client.RAZORPAY_AVAILABLE:
+			self.skipTest("razorpay is not installed")
+		
+		statuses = [503, 200]
+		
+		class StubGateway(BaseHTTPRequestHandler):
+			def do_GET(self):
+				body = b'{"id": "plan_stub"}'
+				self.send_response(statuses.pop(0) if statuses else 200)
+				self.send_header("Content-Type", "application/json")
+				self.send_header("Content-Length", str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+			
+			def log_message(self, *args):
+				pass
+		
+		server = ThreadingHTTPServer(("127.0.0.1", 0), StubGateway)
+		threading.Thread(target=server.serve_forever, daemon=True).start()
+		credentials = patch.dict(frappe.conf, {"razorpay_key_id": "rzp_test_stub", "razorpay_key_secret": "stub_secret"})
+		credentials.start()
+		
+		try:
+			client = razorpay_client.get_razorpay_client(base_url=f"http://127.0.0.1:{server.server_port}")
+			self.assertEqual(client.plan.fetch("plan_stub")["id"], "plan_stub")
+			self.assertEqual(statuses, [])
+			self.assertIs(client, razorpay_client.get_razorpay_client(base_url=f"http://127.0.0.1:{server.server_port}"))
+		finally:
+			credentials.stop()
+			server.shutdown()
+	
+	def test_razorpay_credentials_required(self):
+		"""Test a missing Razorpay key or secret raises a configuration error"""
+		from unittest.mock import patch
+		from bms.billing_management_system.razorpay_client import get_razorpay_credentials
+		
+		with patch.dict(frappe.conf, {"razorpay_key_id": "rzp_test_stub", "razorpay_key_secret": None}):
+			self.assertRaises(frappe.ValidationError, get_razorpay_credentials)
+		
+		with patch.dict(frappe.conf, {"razorpay_key_id": None, "razorpay_key_secret": "stub_secret"}):
+			self.assertRaises(frappe.ValidationError, get_razorpay_credentials)
+	
+	def create_test_invoice(self, status="Draft", days_overdue=0):
+		"""Create test invoice"""
+		return frappe.get_doc({
+			"doctype": "BMS Invoice",
+			"customer": self.customer.name,
+			"amount": 100,
+			"currency": "INR",
+			"invoice_date": frappe.utils.add_days(frappe.utils.today(), -30),
+			"due_date": frappe.utils.add_days(frappe.utils.today(), -days_overdue),
+			"status": status
+		}).insert()
+	
+	def assertMetricsMatchLedger(self, doctype):
+		"""Compare the BMS Metrics rows of a doctype with a GROUP BY recount of the ledger"""
+		from bms.billing_management_system.metrics import METRIC_DOCTYPES, get_metric_rows
+		
+		config = METRIC_DOCTYPES[doctype]
+		payment_type = "payment_type" if doctype == "BMS Payment" else "''"
+		amount = f"SUM(`{config['amount_field']}`)" if config["amount_field"] else "0"
+		
+		recount = {
+			(row.status or "", row.payment_type or "", row.currency or "", row.period or ""):
+				(row.record_count, frappe.utils.flt(row.total_amount, 2))
+			for row in frappe.db.sql(f"""
+				SELECT status, {payment_type} AS payment_type, currency,
+					DATE_FORMAT(`{config['date_field']}`, '%Y-%m') AS period,
+					COUNT(*) AS record_count, {amount} AS total_amount
+				FROM `tab{doctype}`
+				GROUP BY status, {payment_type}, currency, period
+			""", as_dict=True)
+		}
+		metrics = {
+			(row.status or "", row.payment_type or "", row.currency or "", row.period or ""):
+				(row.record_count, frappe.utils.flt(row.total_amount, 2))
+			for row in get_metric_rows(doctype)
+			if row.record_count or frappe.utils.flt(row.total_amount, 2)
+		}
+		
+		self.assertEqual(metrics, recount)
+	
+	def test_metrics_follow_invoice_lifecycle(self):
+		"""Test BMS Metrics match a recount after an insert, a status change and a trash"""
+		from bms.billing_management_system.metrics import get_status_counts, rebuild_metrics
+		
+		rebuild_metrics()
+		
+		invoice = self.create_test_invoice()
+		self.assertMetricsMatchLedger("BMS Invoice")
+		
+		before = get_status_counts("BMS Invoice")
+		invoice.status = "Sent"
+		invoice.save()
+		after = get_status_counts("BMS Invoice")
+		
+		self.assertEqual(after.get("Draft", 0), before.get("Draft", 0) - 1)
+		self.assertEqual(after.get("Sent", 0), before.get("Sent", 0) + 1)
+		self.assertMetricsMatchLedger("BMS Invoice")
+		
+		invoice.delete()
+		self.assertMetricsMatchLedger("BMS Invoice")
+	
+	def test_metrics_follow_bulk_status_change(self):
+		"""Test record_bulk_status_change keeps BMS Metrics in step with a set-based update"""
+		from bms.billing_management_system.metrics import rebuild_metrics, record_bulk_status_change
+		
+		rebuild_metrics()
+		
+		names = [self.create_test_invoice(status="Sent", days_overdue=1).name for _ in range(3)]
+		rows = frappe.get_all("BMS Invoice",
+			filters={"name": ["in", names]},
+			fields=["name", "status", "amount", "currency", "invoice_date"]
+		)
+		
+		frappe.db.set_value("BMS Invoice", {"name": ["in", names]}, "status", "Overdue")
+		record_bulk_status_change("BMS Invoice", rows, "Overdue")
+		
+		self.assertMetricsMatchLedger("BMS Invoice")
+	
+	def test_user_roles_cache_expires(self):
+		"""Test cached roles expire, so role changes that do not save the User are picked up"""
+		from bms.billing_management_system import permissions
+		
+		permissions.clear_user_cache("Administrator")
+		self.assertIn("System Manager", permissions.get_user_roles("Administrator"))
+		
+		ttl = frappe.cache.ttl(frappe.cache.make_key(permissions.get_roles_key("Administrator")))
+		self.assertTrue(0 < ttl <= permissions.ROLES_CACHE_TTL)
+	
+	def test_auto_renewal_resumes_from_checkpoint(self):
+		"""Test an auto-renewal run left Running resumes after its last committed subscription"""
+		from unittest.mock import patch
+		from bms.billing_management_system.doctype.bms_job_checkpoint.bms_job_checkpoint import (
+			advance_checkpoint,
+			get_checkpoint,
+			start_checkpoint,
+		)
+		from bms.billing_management_system.tasks import get_renewal_job_name, process_auto_renewals
+		
+		names = []
+		for _ in range(2):
+			subscription = frappe.new_doc("BMS Subscription")
+			subscription.customer = self.customer.name
+			subscription.plan = self.plan.name
+			subscription.start_date = frappe.utils.add_days(frappe.utils.today(), -30)
+			subscription.end_date = frappe.utils.today()
+			subscription.status = "Active"
+			subscription.auto_renewal = 1
+			subscription.save()
+			frappe.db.set_value("BMS Subscription", subscription.name, "next_billing_date", frappe.utils.add_days(frappe.utils.today(), -1))
+			names.append(subscription.name)
+		names.sort()
+		
+		# A run that committed the first batch and then died
+		job_name = get_renewal_job_name(upto=names[-1])
+		get_checkpoint(job_name)
+		start_checkpoint(job_name)
+		advance_checkpoint(job_name, names[0], 1)
+		
+		with patch.object(frappe.db, "commit"):
+			process_auto_renewals(upto=names[-1], batch_size=1)
+		
+		checkpoint = get_checkpoint(job_name)
+		self.assertEqual(checkpoint.status, "Completed")
+		# Counted on from the interrupted run instead of starting again at zero
+		self.assertGreaterEqual(checkpoint.processed_count, 1 + len(names))
+		for name in names:
+			self.assertGreater(frappe.db.get_value("BMS Subscription", name, "next_billing_date"), frappe.utils.getdate())
+	
+	def test_customer_email_change_clears_permission_cache(self):
+		"""Test the cached user -> customer link follows a change of the customer's email"""
+		from bms.billing_management_system.permissions import get_customer_for_user
+		
+		self.assertEqual(get_customer_for_user("test@example.com"), self.customer.name)
+		self.assertIsNone(get_customer_for_user("changed@example.com"))
+		
+		self.customer.email = "changed@example.com"
+		self.customer.save()
+		
+		self.assertIsNone(get_customer_for_user("test@example.com"))
+		self.assertEqual(get_customer_for_user("changed@example.com"), self.customer.name)
+	
+	def test_webhook_event_retried_until_failed(self):
+		"""Test a failing webhook event stays queued for a retry and is marked Failed after the last attempt"""
+		from unittest.mock import patch
+		from bms.billing_management_system.doctype.bms_webhook_event import bms_webhook_event
+		
+		body = frappe.as_json({"event": "subscription.paused", "payload": {}})
+		name = bms_webhook_event.store_webhook_event("subscription.paused", body, event_id="evt_test_retry")
+		
+		def get_event():
+			return frappe.db.get_value("BMS Webhook Event", name, ["name", "event", "payload", "attempts", "status"], as_dict=True)
+		
+		handlers = {"subscription.paused": "bms.tests.test_bms.fail_webhook_handler"}
+		with patch.dict(bms_webhook_event.WEBHOOK_HANDLERS, handlers), patch.object(frappe.db, "commit"), patch.object(frappe.db, "rollback"):
+			self.assertFalse(bms_webhook_event.process_webhook_event(get_event()))
+			self.assertEqual((get_event().status, get_event().attempts), ("Queued", 1))
+			
+			frappe.db.set_value("BMS Webhook Event", name, "attempts", bms_webhook_event.WEBHOOK_MAX_ATTEMPTS - 1)
+			self.assertFalse(bms_webhook_event.process_webhook_event(get_event()))
+			self.assertEqual(get_event().status, "Failed")
+		
+		with patch.object(frappe.db, "commit"):
+			self.assertEqual(bms_webhook_event.drain_webhook_events(), 0)
+	
+	def test_webhook_event_dedup_and_cleanup(self):
+		"""Test a redelivered webhook event is stored once, and processed events are cleaned up after the TTL"""
+		from unittest.mock import patch
+		from bms.billing_management_system.doctype.bms_webhook_event import bms_webhook_event
+		
+		body = frappe.as_json({"event": "payment.captured", "payload": {}})
+		name = bms_webhook_event.store_webhook_event("payment.captured", body, event_id="evt_test_dedup")
+		
+		self.assertTrue(name)
+		self.assertIsNone(bms_webhook_event.store_webhook_event("payment.captured", body, event_id="evt_test_dedup"))
+		self.assertEqual(frappe.db.count("BMS Webhook Event", {"event_id": "evt_test_dedup"}), 1)
+		
+		with patch.object(frappe.db, "commit"):
+			self.assertTrue(bms_webhook_event.process_webhook_event(
+				frappe.db.get_value("BMS Webhook Event", name, ["name", "event", "payload", "attempts"], as_dict=True)
+			))
+		
+		# Still recognised as a redelivery once processed
+		self.assertIsNone(bms_webhook_event.store_webhook_event("payment.captured", body, event_id="evt_test_dedup"))
+		
+		failed = bms_webhook_event.store_webhook_event("payment.captured", body, event_id="evt_test_failed")
+		frappe.db.set_value("BMS Webhook Event", failed, "status", "Failed")
+		
+		received_on = frappe.utils.add_days(frappe.utils.now(), -bms_webhook_event.WEBHOOK_EVENT_TTL_DAYS - 1)
+		frappe.db.set_value("BMS Webhook Event", {"name": ["in", [name, failed]]}, "received_on", received_on)
+		bms_webhook_event.cleanup_webhook_events()
+		
+		self.assertFalse(frappe.db.exists("BMS Webhook Event", name))
+		self.assertTrue(frappe.db.exists("BMS Webhook Event", failed))
+	
+	def test_webhook_drain_queued_while_previous_runs(self):
+		"""Test an event stored while a drain is running queues another drain, while a waiting drain is reused"""
+		from unittest.mock import patch
+		from bms.billing_management_system.doctype.bms_webhook_event import bms_webhook_event
+		
+		frappe.cache.delete(frappe.cache.make_key(bms_webhook_event.WEBHOOK_DRAIN_QUEUED_KEY))
+		
+		with patch.object(bms_webhook_event.frappe, "enqueue") as enqueue:
+			bms_webhook_event.queue_webhook_drain()
+			bms_webhook_event.queue_webhook_drain()
+			self.assertEqual(enqueue.call_count, 1)
+			
+			# The queued drain starts, then another event arrives
+			with patch.object(bms_webhook_event, "drain_queued_events") as drain_queued_events:
+				bms_webhook_event.drain_webhook_events()
+			drain_queued_events.assert_called_once()
+			
+			bms_webhook_event.queue_webhook_drain()
+			self.assertEqual(enqueue.call_count, 2)
+		
+		frappe.cache.delete(frappe.cache.make_key(bms_webhook_event.WEBHOOK_DRAIN_QUEUED_KEY))
+	
 	def tearDown(self):
 		"""Clean up test data"""
 		frappe.db.rollback()
 
+def fail_webhook_handler(payload):
+	raise Exception("Gateway handler failed")
+
 if __name__ == "__main__":
 	unittest.main()